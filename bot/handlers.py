@@ -3,8 +3,12 @@
 """
 
 from datetime import datetime, timedelta
+from itertools import groupby
+import asyncio
 import logging
 import os
+import random
+import re
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command
@@ -16,6 +20,9 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     FSInputFile,
+    BufferedInputFile,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from aiogram.exceptions import TelegramBadRequest
 
@@ -24,14 +31,33 @@ from aiogram.types import ErrorEvent
 
 router = Router()
 
-from config.settings import BOT_TOKEN
+from config.settings import (
+    BOT_TOKEN,
+    PICKER_PAGE_SIZE,
+    INLINE_CACHE_TIME,
+    INLINE_MAX_RESULTS,
+    MAX_RANGE_DAYS,
+    MESSAGE_CHUNK_LIMIT,
+    EXPORT_PROGRESS_INTERVAL,
+    TELEGRAM_UPLOAD_LIMIT,
+    IMPORT_TEMP_DIR,
+    ICS_FEED_FUTURE_DAYS,
+    ICS_FEED_PAST_DAYS,
+)
 from database.db_manager import DatabaseManager
+from utils.action_logger import action_log_writer, get_action_policy
+from utils.cache import export_cache, normalize_search_key, reference_cache, schedule_text_cache
+from utils.calendar_feed import CALENDAR_TITLES, calendar_url, get_calendar, get_data_version
+from utils.export_jobs import EXPORT_BUSY_MESSAGE, build_schedule_excel, export_queue, format_export_queued
+from utils.import_jobs import format_already_imported, import_job_runner
+from utils.schedule_image import get_week_image, image_file_ids, prepare_week_cells, schedule_image_key
 from utils.reporting import (
     export_user_actions_to_csv, 
     export_user_actions_to_excel, 
-    export_schedule_to_excel,
     create_schedule_import_template,
-    import_schedule_from_excel
+    get_schedule_import_format,
+    file_sha256,
+    get_day_name,
 )
 
 logger = logging.getLogger(__name__)
@@ -108,6 +134,11 @@ class SearchStates(StatesGroup):
     waiting_for_room_search = State()
 
 
+class RangeStates(StatesGroup):
+    """Состояния для просмотра расписания за период"""
+    waiting_for_range = State()
+
+
 # ============== РОЛИ И ЛОГИ ==============
 
 def is_admin(user: dict | None) -> bool:
@@ -120,15 +151,22 @@ def is_developer(user: dict | None) -> bool:
 
 def log_user_action(telegram_id: int, action: str, details: str = ""):
     """
-    Логируем действие:
+    Логируем действие по политике из ACTION_LOG_POLICIES:
     - в стандартный лог (logging)
-    - в БД (таблица user_actions_log через DatabaseManager.log_user_action)
+    - в БД (таблица user_actions): через очередь в памяти, пакетами в фоне;
+      при выборке или политике "count" — только в сводках активности
     """
+    policy = get_action_policy(action)
+    mode = policy[0]
+    if mode == "off":
+        return
+
+    if mode == "count" or (mode == "sample" and random.random() >= policy[1]):
+        action_log_writer.log(telegram_id, action, sample_rate=None)
+        return
+
     logger.info(f"[USER_ACTION] tg_id={telegram_id} action={action} details={details}")
-    try:
-        db.log_user_action(telegram_id, action, details)
-    except Exception as e:
-        logger.error(f"Ошибка записи действия пользователя в БД: {e}")
+    action_log_writer.log(telegram_id, action, details, sample_rate=policy[1] if mode == "sample" else 1.0)
 
 
 # ============== КЛАВИАТУРЫ ==============
@@ -178,7 +216,24 @@ def get_days_keyboard(context_type="my", context_id=None) -> InlineKeyboardMarku
         InlineKeyboardButton(text="🔢 По номеру недели", callback_data=select_cb),
     ])
 
-    # Третья строка - навигация
+    # Третья строка - месяц и произвольный период
+    month_key = datetime.now().strftime('%Y%m')
+    if context_type == "my":
+        month_cb = f"my_month_{month_key}"
+        range_cb = "my_range"
+        image_cb = "my_image"
+    else:
+        month_cb = f"{context_type}_month_{month_key}_{context_id}"
+        range_cb = f"{context_type}_range_{context_id}"
+        image_cb = f"{context_type}_image_{context_id}"
+
+    buttons.append([
+        InlineKeyboardButton(text="🗓 Месяц", callback_data=month_cb),
+        InlineKeyboardButton(text="📆 Период", callback_data=range_cb),
+        InlineKeyboardButton(text="🖼 Картинкой", callback_data=image_cb),
+    ])
+
+    # Четвёртая строка - навигация
     buttons.append([
         InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_menu"),
     ])
@@ -223,6 +278,29 @@ def get_week_selector_keyboard(context_type="my", context_id=None) -> InlineKeyb
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def get_month_keyboard(context_type: str, context_id, year: int, month: int) -> InlineKeyboardMarkup:
+    """Навигация по месяцам: предыдущий / следующий / назад к дням"""
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    if context_type == "my":
+        prev_cb = f"my_month_{prev_year}{prev_month:02d}"
+        next_cb = f"my_month_{next_year}{next_month:02d}"
+        back_cb = "back_to_days"
+    else:
+        prev_cb = f"{context_type}_month_{prev_year}{prev_month:02d}_{context_id}"
+        next_cb = f"{context_type}_month_{next_year}{next_month:02d}_{context_id}"
+        back_cb = f"{context_type}_back_to_days_{context_id}"
+
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f"◀️ {prev_month:02d}.{prev_year}", callback_data=prev_cb),
+            InlineKeyboardButton(text=f"{next_month:02d}.{next_year} ▶️", callback_data=next_cb),
+        ],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=back_cb)],
+    ])
+
+
 def get_settings_keyboard(user_settings: dict) -> InlineKeyboardMarkup:
     """
     Клавиатура настроек (5 пунктов)
@@ -240,6 +318,117 @@ def get_settings_keyboard(user_settings: dict) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+# Буквы для алфавитного выбора преподавателя (без Ё, Й, Ъ, Ы, Ь)
+TEACHER_ALPHABET = "АБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЩЭЮЯ"
+
+
+def get_faculty_picker_keyboard(purpose: str) -> InlineKeyboardMarkup:
+    """
+    Первый шаг выбора группы: список факультетов
+    purpose: "set" — выбор своей группы | "find" — поиск расписания группы
+    """
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"🏛 {f['short_name'] or f['name']}",
+            callback_data=f"gpick_{purpose}_crs_{f['id']}"
+        )]
+        for f in db.get_faculties()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_course_picker_keyboard(purpose: str, faculty_id: int) -> InlineKeyboardMarkup:
+    """Второй шаг выбора группы: курсы факультета"""
+    row = []
+    for course in db.get_faculty_courses(faculty_id):
+        text = f"{course} курс" if course else "Без курса"
+        row.append(InlineKeyboardButton(
+            text=text,
+            callback_data=f"gpick_{purpose}_grp_{faculty_id}_{course}_n_0"
+        ))
+
+    buttons = [row[i:i + 3] for i in range(0, len(row), 3)]
+    buttons.append([InlineKeyboardButton(text="◀️ К факультетам", callback_data=f"gpick_{purpose}_fac")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_group_picker_keyboard(purpose: str, faculty_id: int, course: int,
+                              direction: str = "n", cursor_id: int = 0) -> InlineKeyboardMarkup:
+    """
+    Третий шаг выбора группы: страница групп курса.
+    direction: "n" — страница после группы cursor_id, "p" — страница перед ней
+    """
+    if direction == "p":
+        groups, has_prev = db.get_groups_page(faculty_id, course, before_id=cursor_id, limit=PICKER_PAGE_SIZE)
+        has_next = True
+    else:
+        groups, has_next = db.get_groups_page(faculty_id, course, after_id=cursor_id or None, limit=PICKER_PAGE_SIZE)
+        has_prev = bool(cursor_id)
+
+    row = [
+        InlineKeyboardButton(text=g['group_number'], callback_data=f"gpick_{purpose}_sel_{g['id']}")
+        for g in groups
+    ]
+    buttons = [row[i:i + 3] for i in range(0, len(row), 3)]
+
+    nav = []
+    if groups and has_prev:
+        nav.append(InlineKeyboardButton(
+            text="◀️", callback_data=f"gpick_{purpose}_grp_{faculty_id}_{course}_p_{groups[0]['id']}"
+        ))
+    if groups and has_next:
+        nav.append(InlineKeyboardButton(
+            text="▶️", callback_data=f"gpick_{purpose}_grp_{faculty_id}_{course}_n_{groups[-1]['id']}"
+        ))
+    if nav:
+        buttons.append(nav)
+
+    buttons.append([InlineKeyboardButton(text="◀️ К курсам", callback_data=f"gpick_{purpose}_crs_{faculty_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_teacher_alphabet_keyboard() -> InlineKeyboardMarkup:
+    """Выбор первой буквы фамилии преподавателя"""
+    row = [
+        InlineKeyboardButton(text=letter, callback_data=f"tpick_l_{letter}")
+        for letter in TEACHER_ALPHABET
+    ]
+    buttons = [row[i:i + 7] for i in range(0, len(row), 7)]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_teacher_page_keyboard(direction: str = "l", cursor: str = "") -> InlineKeyboardMarkup:
+    """
+    Страница преподавателей по алфавиту.
+    direction: "l" — с буквы cursor, "n" — после преподавателя с id cursor,
+               "p" — перед преподавателем с id cursor
+    """
+    if direction == "p":
+        teachers, has_prev = db.get_teachers_page(before_id=int(cursor), limit=PICKER_PAGE_SIZE)
+        has_next = True
+    elif direction == "n":
+        teachers, has_next = db.get_teachers_page(after_id=int(cursor), limit=PICKER_PAGE_SIZE)
+        has_prev = True
+    else:
+        teachers, has_next = db.get_teachers_page(letter=cursor or None, limit=PICKER_PAGE_SIZE)
+        has_prev = bool(cursor)
+
+    buttons = [
+        [InlineKeyboardButton(text=t['fio'], callback_data=f"tpick_sel_{t['id']}")]
+        for t in teachers
+    ]
+
+    nav = []
+    if teachers and has_prev:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"tpick_p_{teachers[0]['id']}"))
+    nav.append(InlineKeyboardButton(text="🔤 Алфавит", callback_data="tpick_abc"))
+    if teachers and has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"tpick_n_{teachers[-1]['id']}"))
+    buttons.append(nav)
+
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 # ============== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==============
 
 def format_schedule_day(schedule: list[dict], group_number: str, date: datetime) -> str:
@@ -319,6 +508,109 @@ def format_room_schedule(room: dict, schedule: list[dict], date: datetime) -> st
     return text
 
 
+WEEK_DAY_NAMES = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
+
+
+def group_lessons_by_date(lessons: list[dict]) -> dict[str, list[dict]]:
+    """Группировка занятий по дате 'YYYY-MM-DD'"""
+    schedule_by_date = {}
+    for lesson in lessons:
+        date = lesson['lesson_date'].strftime('%Y-%m-%d') if hasattr(lesson['lesson_date'], 'strftime') else lesson['lesson_date']
+        schedule_by_date.setdefault(date, []).append(lesson)
+    return schedule_by_date
+
+
+def format_lesson_short(kind: str, lesson: dict) -> str:
+    """Одно занятие в недельном виде (с отступом)"""
+    text = (
+        f"  🕐 {lesson['lesson_number']} пара ({lesson['start_time']}-{lesson['end_time']})\n"
+        f"  📚 {lesson['subject_name']}\n"
+    )
+    if kind != "group":
+        text += f"  👥 Группа: {lesson['group_number']}\n"
+    if kind != "teacher" and lesson.get('teacher_fio'):
+        text += f"  👨‍🏫 {lesson['teacher_fio']}\n"
+    if kind != "room" and lesson.get('room_number'):
+        text += f"  🏢 {lesson['building_name']}, ауд. {lesson['room_number']}\n"
+    return text
+
+
+def format_schedule_header(kind: str, title: str) -> str:
+    """Заголовок расписания группы/преподавателя/аудитории"""
+    if kind == "teacher":
+        return f"👨‍🏫 <b>Расписание: {title}</b>\n"
+    if kind == "room":
+        return f"🚪 <b>Аудитория {title}</b>\n"
+    return f"📅 <b>Расписание группы {title}</b>\n"
+
+
+def format_week_schedule(kind: str, title: str, monday: datetime, lessons: list[dict]) -> str:
+    """
+    Расписание на неделю ПН–СБ для группы, преподавателя или аудитории
+    kind: "group" | "teacher" | "room"
+    """
+    schedule_by_date = group_lessons_by_date(lessons)
+
+    text = format_schedule_header(kind, title)
+    text += f"📆 Неделя с {monday.strftime('%d.%m.%Y')}\n\n"
+
+    for i in range(6):
+        day = monday + timedelta(days=i)
+        text += f"<b>{WEEK_DAY_NAMES[i]} ({day.strftime('%d.%m')})</b>\n"
+
+        schedule = schedule_by_date.get(day.strftime('%Y-%m-%d'), [])
+        if schedule:
+            for lesson in schedule:
+                text += format_lesson_short(kind, lesson)
+        else:
+            text += "  Свободна\n" if kind == "room" else "  Занятий нет\n"
+
+        text += "\n"
+
+    return text
+
+
+def iter_schedule_chunks(kind: str, title: str, date_from, date_to, lessons,
+                         limit: int = MESSAGE_CHUNK_LIMIT):
+    """
+    Ленивый рендер расписания за период в сообщения не длиннее limit.
+    lessons — итерируемый объект, отсортированный по дате и номеру пары;
+    сообщения делятся по границам дней (длинный день — по границам занятий).
+    Всегда отдаёт хотя бы одно сообщение.
+    """
+    header = format_schedule_header(kind, title)
+    header += f"📆 {date_from.strftime('%d.%m.%Y')} – {date_to.strftime('%d.%m.%Y')}\n\n"
+    continuation = format_schedule_header(kind, title) + "📆 (продолжение)\n\n"
+
+    chunk = header
+    has_lessons = False
+
+    for lesson_date, day_lessons in groupby(lessons, key=lambda lesson: lesson['lesson_date']):
+        has_lessons = True
+        if not hasattr(lesson_date, 'strftime'):
+            lesson_date = datetime.strptime(str(lesson_date), '%Y-%m-%d')
+
+        day_title = f"<b>{get_day_name(lesson_date.weekday())} ({lesson_date.strftime('%d.%m')})</b>\n"
+        if len(chunk) + len(day_title) > limit:
+            yield chunk
+            chunk = continuation
+        chunk += day_title
+
+        for lesson in day_lessons:
+            lesson_text = format_lesson_short(kind, lesson)
+            if len(chunk) + len(lesson_text) > limit:
+                yield chunk
+                chunk = continuation + day_title
+            chunk += lesson_text
+
+        chunk += "\n"
+
+    if not has_lessons:
+        chunk += "Занятий нет 🎉" if kind != "room" else "Аудитория свободна 🎉"
+
+    yield chunk
+
+
 # ============== КОМАНДЫ ОСНОВНЫЕ ==============
 
 @dp.message(Command("start"))
@@ -336,14 +628,11 @@ async def cmd_start(message: types.Message, state: FSMContext):
             reply_markup=get_main_keyboard()
         )
     else:
-        groups = db.get_all_groups()
-        groups_text = "\n".join([f"{g['group_number']}" for g in groups])
-
         await message.answer(
             "👋 Добро пожаловать в бот расписания!\n\n"
-            f"Выберите вашу группу из списка:\n\n"
-            f"<code>{groups_text}</code>\n\n"
-            "Введите номер группы:",
+            "Выберите факультет, курс и группу кнопками ниже\n"
+            "или введите номер группы:",
+            reply_markup=get_faculty_picker_keyboard("set"),
             parse_mode='HTML'
         )
         await state.set_state(UserStates.waiting_for_group)
@@ -371,6 +660,7 @@ async def cmd_help(message: types.Message):
     help_text += """
 <b>Экспорт:</b>
 /export_schedule [группа] [дней] – Расписание в Excel
+/calendar [группа | ФИО | ауд.] – Календарь (.ics) и подписка для телефона
 """
 
     # Команды администратора
@@ -378,11 +668,12 @@ async def cmd_help(message: types.Message):
         help_text += """
 <b>Команды администратора:</b>
 /export_all_schedule [дней] – Расписание всех групп в Excel
-/export_logs [дней] [формат] – Логи в Excel/CSV
+/export_logs [дней] [формат] – Логи в Excel/CSV/gz
 /get_template – Получить шаблон для импорта расписания
 /import_schedule – Загрузить расписание из файла
 /clear_schedule [группа] [дата_от] [дата_до] – Удалить расписание
 /logs [дней] – Отчёт действий пользователей (CSV)
+/activity [дней] – Сводка активности пользователей
 """
 
     # Команды разработчика
@@ -422,6 +713,7 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
         str(SearchStates.waiting_for_group_search): "поиска по группе",
         str(SearchStates.waiting_for_teacher_search): "поиска по преподавателю",
         str(SearchStates.waiting_for_room_search): "поиска по аудитории",
+        str(RangeStates.waiting_for_range): "выбора периода",
         str(FileStates.waiting_for_schedule_file): "загрузки файла",
     }
     
@@ -564,55 +856,142 @@ async def process_group_selection(message: types.Message, state: FSMContext):
             await cmd_help(message)
         return
 
-    groups = db.get_all_groups()
-    group = next((g for g in groups if g['group_number'].upper() == group_number), None)
+    group = db.get_group_by_number(group_number)
 
     if not group:
-        groups_text = "\n".join([f"{g['group_number']}" for g in groups])
         await message.answer(
             f"❌ Группа '{group_number}' не найдена.\n\n"
-            f"Доступные группы:\n\n"
-            f"<code>{groups_text}</code>\n\n"
-            f"Введите точное название группы:",
+            f"Выберите группу кнопками ниже или введите точное название группы:",
+            reply_markup=get_faculty_picker_keyboard("set"),
             parse_mode='HTML'
         )
         return
 
-    # Создаем или обновляем пользователя
-    telegram_id = message.from_user.id
-    username = message.from_user.username
-    user = db.get_user_by_telegram_id(telegram_id)
-
-    if user:
-        db.update_user_group(user['id'], group['id'])
-    else:
-        user = db.create_user(telegram_id, username, None, role='user', group_id=group['id'])
-
+    save_user_group(message.from_user, group)
     await state.clear()
 
     await message.answer(
-        f"✅ Группа установлена: {group_number}\n"
+        f"✅ Группа установлена: {group['group_number']}\n"
         f"🏛 Факультет: {group['faculty_name']}\n\n"
         f"Теперь вы можете просматривать расписание!",
         reply_markup=get_main_keyboard()
     )
 
 
+def save_user_group(from_user: types.User, group: dict):
+    """Создаем пользователя или обновляем его группу"""
+    user = db.get_user_by_telegram_id(from_user.id)
+
+    if user:
+        db.update_user_group(user['id'], group['id'])
+    else:
+        db.create_user(from_user.id, from_user.username, None, role='user', group_id=group['id'])
+
+
 @dp.message(F.text == "⚙️ Сменить группу")
 async def change_group(message: types.Message, state: FSMContext):
     """Смена группы пользователя"""
-    groups = db.get_all_groups()
-    groups_text = "\n".join([f"{g['group_number']}" for g in groups])
-
     await message.answer(
-        f"Выберите новую группу из списка:\n\n"
-        f"<code>{groups_text}</code>\n\n"
-        "Введите номер группы:",
+        "Выберите новую группу кнопками ниже или введите номер группы:",
+        reply_markup=get_faculty_picker_keyboard("set"),
         parse_mode='HTML'
     )
     await state.set_state(UserStates.waiting_for_group)
 
 
+# ============== CALLBACK: ПОСТРАНИЧНЫЙ ВЫБОР ГРУППЫ ==============
+
+@dp.callback_query(F.data.regexp(r"^gpick_(set|find)_fac$"))
+async def group_picker_faculties(callback: types.CallbackQuery):
+    """Шаг 1: список факультетов"""
+    purpose = callback.data.split('_')[1]
+
+    await safe_edit_text(callback.message,
+        "🏛 Выберите факультет:",
+        reply_markup=get_faculty_picker_keyboard(purpose)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.regexp(r"^gpick_(set|find)_crs_(\d+)$"))
+async def group_picker_courses(callback: types.CallbackQuery):
+    """Шаг 2: курсы выбранного факультета"""
+    parts = callback.data.split('_')
+    purpose = parts[1]
+    faculty_id = int(parts[3])
+
+    await safe_edit_text(callback.message,
+        "🎓 Выберите курс:",
+        reply_markup=get_course_picker_keyboard(purpose, faculty_id)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.regexp(r"^gpick_(set|find)_grp_(\d+)_(\d+)_([np])_(\d+)$"))
+async def group_picker_groups(callback: types.CallbackQuery):
+    """Шаг 3: страница групп курса"""
+    parts = callback.data.split('_')
+    purpose = parts[1]
+    faculty_id = int(parts[3])
+    course = int(parts[4])
+    direction = parts[5]
+    cursor_id = int(parts[6])
+
+    await safe_edit_text(callback.message,
+        "👥 Выберите группу:",
+        reply_markup=get_group_picker_keyboard(purpose, faculty_id, course, direction, cursor_id)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.regexp(r"^gpick_(set|find)_sel_(\d+)$"))
+async def group_picker_select(callback: types.CallbackQuery, state: FSMContext):
+    """Группа выбрана: сохраняем её пользователю или показываем расписание"""
+    parts = callback.data.split('_')
+    purpose = parts[1]
+    group = db.get_group_by_id(int(parts[3]))
+
+    if not group:
+        await callback.answer("❌ Группа не найдена", show_alert=True)
+        return
+
+    await state.clear()
+
+    if purpose == "set":
+        save_user_group(callback.from_user, group)
+        await callback.message.delete()
+        await callback.message.answer(
+            f"✅ Группа установлена: {group['group_number']}\n"
+            f"🏛 Факультет: {group['faculty_name']}\n\n"
+            f"Теперь вы можете просматривать расписание!",
+            reply_markup=get_main_keyboard()
+        )
+        await callback.answer()
+        return
+
+    log_user_action(callback.from_user.id, "group_search", group['group_number'])
+
+    group_number = group['group_number']
+    today = datetime.now()
+    schedule = db.get_schedule_by_group(group_number, today.strftime('%Y-%m-%d'))
+
+    if schedule:
+        schedule_text = format_schedule_day(schedule, group_number, today)
+    else:
+        schedule_text = (
+            f"📅 Расписание группы {group_number}\n"
+            f"📆 {today.strftime('%d.%m.%Y')}\n\n"
+            f"На сегодня занятий нет."
+        )
+
+    await safe_edit_text(callback.message,
+        schedule_text,
+        reply_markup=get_days_keyboard("group", group_number),
+        parse_mode='HTML'
+    )
+    await callback.answer()
+
+
 # ============== МОЕ РАСПИСАНИЕ ==============
 
 @dp.message(F.text == "📅 Мое расписание")
@@ -709,6 +1088,7 @@ async def process_day_selection(callback: types.CallbackQuery):
     day_map = {'ПН': 0, 'ВТ': 1, 'СР': 2, 'ЧТ': 3, 'ПТ': 4, 'СБ': 5}
     day_abbr = callback.data.split('_')[1]
     target_weekday = day_map[day_abbr]
+    log_user_action(callback.from_user.id, "schedule_day", day_abbr)
 
     today = datetime.now()
     days_ahead = target_weekday - today.weekday()
@@ -944,11 +1324,8 @@ async def search_group(message: types.Message, state: FSMContext):
     if len(parts) > 1 and parts[0].startswith("/group"):
         group_param = parts[1].strip().upper()
 
-    groups = db.get_all_groups()
-    groups_text = "\n".join([f"{g['group_number']}" for g in groups])
-
     if group_param:
-        group = next((g for g in groups if g["group_number"].upper() == group_param), None)
+        group = db.get_group_by_number(group_param)
         if not group:
             await message.answer(f"❌ Группа '{group_param}' не найдена.")
             return
@@ -974,9 +1351,9 @@ async def search_group(message: types.Message, state: FSMContext):
 
     await message.answer(
         f"🔍 <b>Поиск расписания по группе</b>\n\n"
-        f"Доступные группы:\n\n"
-        f"<code>{groups_text}</code>\n\n"
-        f"Введите номер группы:",
+        f"Выберите факультет, курс и группу кнопками ниже\n"
+        f"или введите номер группы:",
+        reply_markup=get_faculty_picker_keyboard("find"),
         parse_mode="HTML",
     )
     await state.set_state(SearchStates.waiting_for_group_search)
@@ -1005,17 +1382,15 @@ async def process_group_search(message: types.Message, state: FSMContext):
         )
         return
 
-    groups = db.get_all_groups()
-    group = next((g for g in groups if g['group_number'].upper() == group_number), None)
+    group = db.get_group_by_number(group_number)
 
     if not group:
         # Показываем подсказку
-        groups_text = "\n".join([f"{g['group_number']}" for g in groups])
         await message.answer(
             f"❌ Группа '<code>{group_number}</code>' не найдена.\n\n"
-            f"<b>Доступные группы:</b>\n"
-            f"<code>{groups_text}</code>\n\n"
-            f"Попробуйте ещё раз или нажмите /cancel для отмены.",
+            f"Выберите группу кнопками ниже, попробуйте ещё раз\n"
+            f"или нажмите /cancel для отмены.",
+            reply_markup=get_faculty_picker_keyboard("find"),
             parse_mode='HTML'
         )
         return
@@ -1259,10 +1634,8 @@ async def search_teacher(message: types.Message, state: FSMContext):
     if len(parts) > 1 and parts[0].startswith("/teacher"):
         teacher_param = parts[1].strip()
 
-    teachers = db.get_all_teachers()
-    teachers_text = "\n".join([f"{t['fio']}" for t in teachers[:20]])
-
     if teacher_param:
+        teachers = db.get_all_teachers()
         teacher = next((t for t in teachers if teacher_param.lower() in t['fio'].lower()), None)
         if not teacher:
             await message.answer(f"❌ Преподаватель '{teacher_param}' не найден.")
@@ -1280,9 +1653,9 @@ async def search_teacher(message: types.Message, state: FSMContext):
 
     await message.answer(
         f"👨‍🏫 <b>Поиск по преподавателю</b>\n\n"
-        f"Преподаватели (первые 20):\n\n"
-        f"<code>{teachers_text}</code>\n\n"
-        f"Введите ФИО преподавателя:",
+        f"Выберите первую букву фамилии\n"
+        f"или введите ФИО преподавателя:",
+        reply_markup=get_teacher_alphabet_keyboard(),
         parse_mode='HTML'
     )
     await state.set_state(SearchStates.waiting_for_teacher_search)
@@ -1316,12 +1689,11 @@ async def process_teacher_search(message: types.Message, state: FSMContext):
 
     if not teacher:
         # Показываем подсказку
-        teachers_text = "\n".join([f"{t['fio']}" for t in teachers[:15]])
         await message.answer(
             f"❌ Преподаватель '<code>{teacher_name}</code>' не найден.\n\n"
-            f"<b>Попробуйте из списка (первые 15):</b>\n"
-            f"<code>{teachers_text}</code>\n\n"
-            f"Попытайтесь ещё раз или нажмите /cancel для отмены.",
+            f"Выберите преподавателя по первой букве фамилии,\n"
+            f"попытайтесь ещё раз или нажмите /cancel для отмены.",
+            reply_markup=get_teacher_alphabet_keyboard(),
             parse_mode='HTML'
         )
         return
@@ -1338,6 +1710,54 @@ async def process_teacher_search(message: types.Message, state: FSMContext):
     )
 
 
+# ============== CALLBACK: ВЫБОР ПРЕПОДАВАТЕЛЯ ПО АЛФАВИТУ ==============
+
+@dp.callback_query(F.data == "tpick_abc")
+async def teacher_picker_alphabet(callback: types.CallbackQuery):
+    """Выбор первой буквы фамилии"""
+    await safe_edit_text(callback.message,
+        "🔤 Выберите первую букву фамилии преподавателя:",
+        reply_markup=get_teacher_alphabet_keyboard()
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.regexp(r"^tpick_(l_\w|[np]_\d+)$"))
+async def teacher_picker_page(callback: types.CallbackQuery):
+    """Страница преподавателей: с буквы или вперёд/назад от крайнего на странице"""
+    _, direction, cursor = callback.data.split('_', 2)
+
+    await safe_edit_text(callback.message,
+        "👨‍🏫 Выберите преподавателя:",
+        reply_markup=get_teacher_page_keyboard(direction, cursor)
+    )
+    await callback.answer()
+
+
+@dp.callback_query(F.data.regexp(r"^tpick_sel_(\d+)$"))
+async def teacher_picker_select(callback: types.CallbackQuery, state: FSMContext):
+    """Преподаватель выбран: показываем расписание на сегодня"""
+    teacher_id = int(callback.data.split('_')[2])
+    teacher = db.get_teacher_by_id(teacher_id)
+
+    if not teacher:
+        await callback.answer("❌ Преподаватель не найден", show_alert=True)
+        return
+
+    await state.clear()
+
+    today = datetime.now()
+    schedule = db.get_teacher_schedule(teacher_id, today.strftime('%Y-%m-%d'))
+    text = format_teacher_schedule(teacher, schedule, today)
+
+    await safe_edit_text(callback.message,
+        text,
+        reply_markup=get_days_keyboard("teacher", teacher_id),
+        parse_mode='HTML'
+    )
+    await callback.answer()
+
+
 # ============== CALLBACK: ПРЕПОДАВАТЕЛЬ (дни/недели) ==============
 
 @dp.callback_query(F.data.regexp(r"^teacher_day_(.+)_(\d+)$"))
@@ -1839,6 +2259,360 @@ async def room_back_to_days(callback: types.CallbackQuery):
     await callback.answer()
 
 
+# ============== МЕСЯЦ И ПРОИЗВОЛЬНЫЙ ПЕРИОД ==============
+
+def resolve_schedule_context(context_type: str, context_id, telegram_id: int):
+    """
+    Контекст клавиатуры → (kind, entity_id, title) или None.
+    context_type: "my" | "group" | "teacher" | "room"
+    """
+    if context_type == "my":
+        user = db.get_user_by_telegram_id(telegram_id)
+        if not user or not user.get('group_number'):
+            return None
+        return "group", user['group_number'], user['group_number']
+
+    if context_type == "group":
+        return "group", context_id, context_id
+
+    if context_type == "teacher":
+        teacher = db.get_teacher_by_id(int(context_id))
+        return ("teacher", teacher['id'], teacher['fio']) if teacher else None
+
+    room = db.get_room_by_id(int(context_id))
+    return ("room", room['id'], room['room_number']) if room else None
+
+
+def fetch_schedule_range(kind: str, entity_id, date_from, date_to):
+    """Расписание за период одним *_range запросом"""
+    if kind == "teacher":
+        return db.get_teacher_schedule_range(entity_id, date_from, date_to)
+    if kind == "room":
+        return db.get_room_schedule_range(entity_id, date_from, date_to)
+    return db.get_schedule_by_group_range(entity_id, date_from, date_to)
+
+
+async def send_schedule_range(message: types.Message, kind: str, entity_id, title: str,
+                              date_from, date_to, reply_markup=None):
+    """
+    Отправка расписания за период несколькими сообщениями.
+    Сообщения уходят по мере рендера; клавиатура — у последнего.
+    """
+    lessons = fetch_schedule_range(kind, entity_id, date_from, date_to)
+
+    pending = None
+    for chunk in iter_schedule_chunks(kind, title, date_from, date_to, lessons):
+        if pending is not None:
+            await message.answer(pending, parse_mode='HTML')
+        pending = chunk
+
+    await message.answer(pending, reply_markup=reply_markup, parse_mode='HTML')
+
+
+def parse_date_range(text: str):
+    """
+    Разбор периода «01.10.2026 - 15.10.2026» (или в формате YYYY-MM-DD).
+    Возвращает (date_from, date_to) или None.
+    """
+    found = re.findall(r"\d{1,2}\.\d{1,2}\.\d{4}|\d{4}-\d{1,2}-\d{1,2}", text)
+    if len(found) != 2:
+        return None
+
+    dates = []
+    for value in found:
+        fmt = '%d.%m.%Y' if '.' in value else '%Y-%m-%d'
+        try:
+            dates.append(datetime.strptime(value, fmt))
+        except ValueError:
+            return None
+
+    return min(dates), max(dates)
+
+
+@dp.callback_query(F.data.regexp(r"^(my|group|teacher|room)_month_(\d{6})(?:_(.+))?$"))
+async def show_month_schedule(callback: types.CallbackQuery):
+    """Расписание за календарный месяц"""
+    match = re.match(r"^(my|group|teacher|room)_month_(\d{4})(\d{2})(?:_(.+))?$", callback.data)
+    context_type, year, month, context_id = match.group(1), int(match.group(2)), int(match.group(3)), match.group(4)
+
+    context = resolve_schedule_context(context_type, context_id, callback.from_user.id)
+    if not context:
+        await callback.answer("❌ Расписание не найдено", show_alert=True)
+        return
+    kind, entity_id, title = context
+
+    date_from = datetime(year, month, 1)
+    next_month = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    date_to = next_month - timedelta(days=1)
+
+    await callback.answer()
+    await send_schedule_range(
+        callback.message, kind, entity_id, title, date_from, date_to,
+        reply_markup=get_month_keyboard(context_type, context_id, year, month)
+    )
+
+
+@dp.callback_query(F.data.regexp(r"^(my|group|teacher|room)_range(?:_(.+))?$"))
+async def ask_schedule_range(callback: types.CallbackQuery, state: FSMContext):
+    """Запрос произвольного периода"""
+    context_type, _, context_id = callback.data.partition("_range")
+    context_id = context_id.lstrip("_") or None
+
+    await state.set_state(RangeStates.waiting_for_range)
+    await state.update_data(context_type=context_type, context_id=context_id)
+
+    await callback.message.answer(
+        "📆 Введите период в формате <code>ДД.ММ.ГГГГ - ДД.ММ.ГГГГ</code>\n"
+        f"Например: <code>01.10.2026 - 15.10.2026</code> (не длиннее {MAX_RANGE_DAYS} дн.)\n\n"
+        "Или нажмите /cancel для отмены.",
+        parse_mode='HTML'
+    )
+    await callback.answer()
+
+
+@dp.message(RangeStates.waiting_for_range)
+async def process_schedule_range(message: types.Message, state: FSMContext):
+    """Обработка введённого периода"""
+    parsed = parse_date_range(message.text or "")
+    if not parsed:
+        await message.answer(
+            "⚠️ Не удалось разобрать период.\n"
+            "Пример: <code>01.10.2026 - 15.10.2026</code>\n\n"
+            "Попробуйте ещё раз или нажмите /cancel для отмены.",
+            parse_mode='HTML'
+        )
+        return
+
+    date_from, date_to = parsed
+    if (date_to - date_from).days + 1 > MAX_RANGE_DAYS:
+        await message.answer(f"⚠️ Период слишком длинный: максимум {MAX_RANGE_DAYS} дн.")
+        return
+
+    data = await state.get_data()
+    context_type = data.get("context_type", "my")
+    context_id = data.get("context_id")
+
+    context = resolve_schedule_context(context_type, context_id, message.from_user.id)
+    await state.clear()
+    if not context:
+        await message.answer("❌ Расписание не найдено.")
+        return
+    kind, entity_id, title = context
+
+    log_user_action(message.from_user.id, "schedule_range", f"{kind} {title}: {message.text}")
+    await send_schedule_range(
+        message, kind, entity_id, title, date_from, date_to,
+        reply_markup=get_days_keyboard(context_type, context_id)
+    )
+
+
+# ============== РАСПИСАНИЕ КАРТИНКОЙ ==============
+
+@dp.callback_query(F.data.regexp(r"^(my|group|teacher|room)_image(?:_(.+))?$"))
+async def show_week_image(callback: types.CallbackQuery):
+    """
+    Текущая неделя картинкой. Если такая же картинка уже отправлялась,
+    повторно используем её file_id; иначе рендерим в пуле процессов.
+    """
+    context_type, _, context_id = callback.data.partition("_image")
+    context_id = context_id.lstrip("_") or None
+
+    context = resolve_schedule_context(context_type, context_id, callback.from_user.id)
+    if not context:
+        await callback.answer("❌ Расписание не найдено", show_alert=True)
+        return
+    kind, entity_id, title = context
+
+    today = datetime.now()
+    monday = today - timedelta(days=today.weekday())
+    lessons = fetch_schedule_range(kind, entity_id, monday.strftime('%Y-%m-%d'),
+                                   (monday + timedelta(days=5)).strftime('%Y-%m-%d'))
+
+    week_label = f"неделя с {monday.strftime('%d.%m.%Y')}"
+    days = [
+        f"{WEEK_DAY_NAMES[i]} {(monday + timedelta(days=i)).strftime('%d.%m')}"
+        for i in range(6)
+    ]
+    cells = prepare_week_cells(kind, lessons)
+    caption = format_schedule_header(kind, title).strip()
+
+    await callback.answer("⏳ Готовлю картинку...")
+    log_user_action(callback.from_user.id, "schedule_image", f"{kind} {title}")
+
+    key = schedule_image_key(title, week_label, cells)
+    file_id = image_file_ids.get(key)
+    if file_id:
+        await callback.message.answer_photo(photo=file_id, caption=caption, parse_mode='HTML')
+        return
+
+    key, png = await get_week_image(title, week_label, days, cells)
+    sent = await callback.message.answer_photo(
+        photo=BufferedInputFile(png, filename="schedule.png"),
+        caption=caption,
+        parse_mode='HTML'
+    )
+    if sent.photo:
+        image_file_ids.set(key, sent.photo[-1].file_id)
+
+
+# ============== INLINE-РЕЖИМ (@bot ИВТ-21) ==============
+
+def render_entity_schedule(entry: dict, period: str, day: datetime) -> str:
+    """
+    Текст расписания для записи справочника (синхронно, ходит в БД).
+    entry: {'kind', 'id', 'title'} из reference_cache
+    period: "day" | "week"
+    """
+    kind = entry['kind']
+
+    if period == "week":
+        monday = day - timedelta(days=day.weekday())
+        date_from = monday.strftime('%Y-%m-%d')
+        date_to = (monday + timedelta(days=5)).strftime('%Y-%m-%d')
+
+        if kind == "teacher":
+            lessons = db.get_teacher_schedule_range(entry['id'], date_from, date_to)
+        elif kind == "room":
+            lessons = db.get_room_schedule_range(entry['id'], date_from, date_to)
+        else:
+            lessons = db.get_schedule_by_group_range(entry['title'], date_from, date_to)
+
+        return format_week_schedule(kind, entry['title'], monday, lessons)
+
+    date_str = day.strftime('%Y-%m-%d')
+    if kind == "teacher":
+        schedule = db.get_teacher_schedule(entry['id'], date_str)
+        return format_teacher_schedule({'fio': entry['title']}, schedule, day)
+    if kind == "room":
+        schedule = db.get_room_schedule(entry['id'], date_str)
+        return format_room_schedule({'room_number': entry['title']}, schedule, day)
+
+    schedule = db.get_schedule_by_group(entry['title'], date_str)
+    return format_schedule_day(schedule, entry['title'], day)
+
+
+async def get_entity_schedule_text(entry: dict, period: str) -> str:
+    """
+    Текст расписания из кэша; при промахе — рендер в отдельном потоке.
+    Ключ включает версию данных: после импорта или правки расписания
+    тексты собираются заново, а не ждут истечения SCHEDULE_CACHE_TTL.
+    """
+    today = datetime.now()
+    period_start = today - timedelta(days=today.weekday()) if period == "week" else today
+    version = (await get_data_version(db))['version']
+    key = (entry['kind'], entry['id'], period, period_start.date(), version)
+
+    text = schedule_text_cache.get(key)
+    if text is None:
+        text = await asyncio.to_thread(render_entity_schedule, entry, period, today)
+        schedule_text_cache.set(key, text)
+    return text
+
+
+def truncate_message(text: str, limit: int = 4096) -> str:
+    """Обрезка текста до лимита Telegram по границе абзаца"""
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n\n", 0, limit - 2)
+    return text[:cut if cut > 0 else limit - 2] + "\n…"
+
+
+@dp.inline_query()
+async def inline_schedule_lookup(inline_query: types.InlineQuery):
+    """
+    @bot <группа | ФИО | аудитория> — расписание на сегодня и на неделю.
+    Справочники берутся из памяти, тексты — из кэша; при промахе текст
+    рендерится в отдельном потоке (до 2 × INLINE_MAX_RESULTS запросов к БД).
+    """
+    if not reference_cache.is_loaded:
+        await asyncio.to_thread(reference_cache.refresh, db)
+
+    entries = reference_cache.search(inline_query.query, limit=INLINE_MAX_RESULTS)
+    if not entries:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    icons = {"group": "👥", "teacher": "👨‍🏫", "room": "🚪"}
+    texts = await asyncio.gather(*(
+        get_entity_schedule_text(entry, period)
+        for entry in entries
+        for period in ("day", "week")
+    ))
+
+    results = []
+    for i, entry in enumerate(entries):
+        title = entry['title']
+        if entry['kind'] == "room" and entry.get('building_name'):
+            title = f"{title} ({entry['building_name']})"
+
+        for j, (period, period_title) in enumerate((("day", "сегодня"), ("week", "неделя"))):
+            results.append(InlineQueryResultArticle(
+                id=f"{entry['kind']}_{entry['id']}_{period}",
+                title=f"{icons[entry['kind']]} {title} — {period_title}",
+                description="Расписание на сегодня" if period == "day" else "Расписание на текущую неделю",
+                input_message_content=InputTextMessageContent(
+                    message_text=truncate_message(texts[i * 2 + j]),
+                    parse_mode="HTML",
+                ),
+            ))
+
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+
+@dp.message(Command("calendar"))
+async def cmd_calendar(message: types.Message):
+    """
+    /calendar [группа | ФИО | аудитория]
+    Календарь .ics (ICS_FEED_PAST_DAYS дней назад и ICS_FEED_FUTURE_DAYS вперёд)
+    и ссылка на подписку, если запущен сервер подписок (utils/calendar_feed.py).
+    Без аргумента — группа пользователя.
+    """
+    log_user_action(message.from_user.id, "calendar", message.text)
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) > 1:
+        query = parts[1]
+    else:
+        user = db.get_user_by_telegram_id(message.from_user.id)
+        if not user or not user.get('group_number'):
+            await message.answer("❌ Вы не выбрали группу. Используйте: /calendar [группа | ФИО | аудитория]")
+            return
+        query = user['group_number']
+
+    if not reference_cache.is_loaded:
+        await asyncio.to_thread(reference_cache.refresh, db)
+
+    entries = reference_cache.search(query, limit=INLINE_MAX_RESULTS)
+    if not entries:
+        await message.answer(f"❌ Не найдено групп, преподавателей или аудиторий: {query}")
+        return
+    # Точное совпадение важнее первого по алфавиту (ИВТ-2 → ИВТ-2, а не ИВТ-21)
+    key = normalize_search_key(query)
+    entry = next((e for e in entries if normalize_search_key(e['title']) == key), entries[0])
+
+    try:
+        calendar = await get_calendar(db, entry)
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке календаря: {e}")
+        await message.answer(f"❌ Ошибка при подготовке календаря: {str(e)}")
+        return
+
+    caption = (f"📅 {CALENDAR_TITLES[entry['kind']]} {entry['title']}\n"
+               f"Пар: {calendar['lessons']} (за {ICS_FEED_PAST_DAYS} дн. назад и {ICS_FEED_FUTURE_DAYS} дн. вперёд)\n\n")
+    url = calendar_url(entry)
+    if url:
+        caption += (f"🔗 Подписка: {url}\n"
+                    f"Добавьте ссылку в календарь телефона («Добавить календарь по URL») — "
+                    f"расписание будет обновляться само.")
+    else:
+        caption += "Откройте файл, чтобы добавить пары в календарь телефона."
+
+    await message.answer_document(
+        document=BufferedInputFile(calendar['body'], filename=f"{entry['title']}.ics"),
+        caption=caption,
+    )
+
+
 # ============== НАСТРОЙКИ /settings ==============
 
 from config.roles import ROLE_TITLES
@@ -1935,18 +2709,82 @@ async def settings_default_view(callback: types.CallbackQuery):
 async def settings_change_group(callback: types.CallbackQuery, state: FSMContext):
     """Запускаем сценарий смены группы через существующую логику"""
     await callback.answer()
-    groups = db.get_all_groups()
-    groups_text = "\n".join([f"{g['group_number']}" for g in groups])
 
     await callback.message.answer(
-        f"Выберите новую группу из списка:\n\n"
-        f"<code>{groups_text}</code>\n\n"
-        "Введите номер группы:",
+        "Выберите новую группу кнопками ниже или введите номер группы:",
+        reply_markup=get_faculty_picker_keyboard("set"),
         parse_mode='HTML'
     )
     await state.set_state(UserStates.waiting_for_group)
 
 
+# ============== ПОТОКОВАЯ ВЫГРУЗКА ОТЧЕТОВ ==============
+
+def count_rows(rows, progress: dict):
+    """Пропускает строки дальше, считая их в progress['rows']"""
+    for row in rows:
+        progress['rows'] += 1
+        yield row
+
+
+async def run_export_with_progress(status: types.Message, export, progress: dict, total: int = 0,
+                                   user_id: int = None):
+    """
+    Выполняет export() в отдельном потоке и раз в EXPORT_PROGRESS_INTERVAL секунд
+    обновляет сообщение status количеством выгруженных строк.
+    Выгрузка занимает место в export_queue; пока мест нет, в status показывается очередь.
+    Возвращает результат export().
+    """
+    base_text = status.text or ""
+
+    async def show_queue(position: int):
+        try:
+            await status.edit_text(f"{base_text}\n\n{format_export_queued(position)}")
+        except TelegramBadRequest:
+            pass
+
+    async with export_queue.slot(user_id or status.chat.id, on_wait=show_queue):
+        task = asyncio.create_task(asyncio.to_thread(export))
+        last_text = None
+
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=EXPORT_PROGRESS_INTERVAL)
+            if done:
+                break
+
+            rows = progress['rows']
+            text = f"{base_text}\n\nВыгружено строк: {rows}"
+            if total:
+                text += f" из ~{total} ({min(rows * 100 // total, 99)}%)"
+            if text != last_text:
+                try:
+                    await status.edit_text(text)
+                    last_text = text
+                except TelegramBadRequest:
+                    pass
+
+    return task.result()
+
+
+async def send_report_file(message: types.Message, status: types.Message, filename: str, caption: str):
+    """Отправка готового отчёта с проверкой лимита Telegram на размер файла"""
+    size = os.path.getsize(filename)
+    if size > TELEGRAM_UPLOAD_LIMIT:
+        await status.edit_text(
+            f"⚠️ Файл получился слишком большим ({size // (1024 * 1024)} МБ), "
+            f"Telegram принимает до {TELEGRAM_UPLOAD_LIMIT // (1024 * 1024)} МБ.\n"
+            f"Уменьшите период или выберите формат gz (CSV со сжатием).\n"
+            f"Файл сохранён на сервере: {filename}"
+        )
+        return
+
+    await message.answer_document(document=FSInputFile(filename), caption=caption)
+    try:
+        await status.delete()
+    except TelegramBadRequest:
+        pass
+
+
 # ============== ОТЧЕТЫ /logs и РОЛИ /setrole ==============
 
 @dp.message(Command("logs"))
@@ -1970,19 +2808,80 @@ async def cmd_logs(message: types.Message):
             await message.answer("⚠️ Использование: /logs [количество_дней]\nНапример: /logs 7")
             return
 
-    actions = db.get_user_actions(last_days=days)
-    if not actions:
-        await message.answer("За указанный период действий не найдено.")
+    if export_queue.is_user_busy(message.from_user.id):
+        await message.answer(EXPORT_BUSY_MESSAGE)
         return
 
-    filename = export_user_actions_to_csv(actions)  # создаёт файл в /reports
-    doc = FSInputFile(filename)
-    await message.answer_document(
-        document=doc,
+    status = await message.answer(f"⏳ Выгружаю действия за последние {days} дн...")
+    progress = {'rows': 0}
+    filename = await run_export_with_progress(
+        status,
+        lambda: export_user_actions_to_csv(count_rows(db.iter_user_actions(last_days=days), progress)),
+        progress,
+        total=db.estimate_user_actions_count(last_days=days),
+        user_id=message.from_user.id,
+    )
+    if not progress['rows']:
+        os.remove(filename)   # пустой отчёт (только заголовок) не храним
+        await status.edit_text("За указанный период действий не найдено.")
+        return
+
+    await send_report_file(
+        message, status, filename,
         caption=f"📊 Отчет по действиям пользователей за последние {days} дн."
     )
 
 
+@dp.message(Command("activity"))
+async def cmd_activity(message: types.Message):
+    """
+    /activity [days]
+    Сводка активности пользователей за N дней по сводным таблицам
+    (без чтения сырого журнала). Только для admin/developer.
+    """
+    user = db.get_user_by_telegram_id(message.from_user.id)
+    if not is_admin(user):
+        await message.answer("❌ У вас нет прав для просмотра статистики.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    days = 7
+    if len(parts) > 1:
+        try:
+            days = int(parts[1])
+            if not 1 <= days <= 366:
+                raise ValueError
+        except ValueError:
+            await message.answer("⚠️ Использование: /activity [количество_дней]\nНапример: /activity 30")
+            return
+
+    summary = await asyncio.to_thread(db.get_activity_summary, days)
+    if not summary['days']:
+        await message.answer("За указанный период действий не найдено.")
+        return
+
+    total_actions = sum(d['actions'] for d in summary['days'])
+    text = f"📈 <b>Активность за {days} дн.</b>\n"
+    text += f"Действий: {total_actions}, пользователей: {summary['total_users']}\n\n"
+
+    text += "<b>По дням</b> (действий / пользователей):\n"
+    for d in summary['days'][:14]:
+        text += f"• {d['day'].strftime('%d.%m')} {get_day_name(d['day'].weekday())[:2]}: {d['actions']} / {d['users']}\n"
+    if len(summary['days']) > 14:
+        text += f"… и ещё {len(summary['days']) - 14} дн.\n"
+
+    text += "\n<b>По действиям</b> (действий / пользователей):\n"
+    for a in summary['actions'][:15]:
+        text += f"• {a['action']}: {a['actions']} / {a['users']}\n"
+
+    if summary['peak_hours']:
+        peaks = ", ".join(f"{h['hour']:02d}:00 ({h['actions']})" for h in summary['peak_hours'])
+        text += f"\n⏰ Пиковые часы: {peaks}"
+
+    await message.answer(text, parse_mode="HTML")
+    log_user_action(message.from_user.id, "activity", message.text)
+
+
 @dp.message(Command("setrole"))
 async def cmd_setrole(message: types.Message):
     """
@@ -2021,6 +2920,90 @@ async def cmd_setrole(message: types.Message):
 
 # ============== ЭКСПОРТ РАСПИСАНИЯ И ЛОГОВ В EXCEL ==============
 
+# Выгрузки расписания, которые собираются прямо сейчас: ключ export_cache -> задача.
+# Повторный запрос того же ключа ждёт уже начатую сборку, а не пишет тот же файл второй раз
+schedule_export_builds = {}
+
+
+async def send_schedule_export(message: types.Message, key: tuple, date_from, date_to, group_number,
+                               group_name: str, progress_text: str, caption) -> bool:
+    """
+    Отправка выгрузки расписания через export_cache. key — (вид, группа, начало,
+    конец, версия данных): пока данные не менялись, повторно отправляется file_id
+    прошлой отправки (или готовый файл), без запроса к БД и без пересоздания XLSX.
+    Новая выгрузка занимает место в export_queue и собирается в пуле процессов:
+    занятия за период (все группы, если group_number не указан) читаются
+    серверным курсором и сразу пишутся в файл. caption(rows) — подпись.
+    Возвращает False, если занятий нет.
+    """
+    user_id = message.from_user.id
+    status = None
+
+    async def show_status(text: str):
+        nonlocal status
+        try:
+            if status is None:
+                status = await message.answer(text)
+            else:
+                await status.edit_text(text)
+        except TelegramBadRequest:
+            pass
+
+    async def build():
+        """Собрать выгрузку; запись export_cache или None, если занятий нет"""
+        async with export_queue.slot(user_id, on_wait=lambda position: show_status(format_export_queued(position))):
+            await show_status(progress_text)
+            path = export_cache.path_for(key)
+            rows = await build_schedule_excel(date_from, date_to, group_number, group_name, path)
+            return export_cache.put(key, path, rows) if rows else None
+
+    async def ensure_built():
+        nonlocal status
+        task = schedule_export_builds.get(key)
+        if task is None:
+            task = asyncio.ensure_future(build())
+            schedule_export_builds[key] = task
+            task.add_done_callback(lambda _: schedule_export_builds.pop(key, None))
+        else:
+            await show_status(progress_text)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if status is not None:
+                try:
+                    await status.delete()
+                except TelegramBadRequest:
+                    pass
+                status = None
+
+    entry = export_cache.get(key)
+    if entry is None:
+        if key not in schedule_export_builds and export_queue.is_user_busy(user_id):
+            await message.answer(EXPORT_BUSY_MESSAGE)
+            return True
+        entry = await ensure_built()
+        if entry is None:
+            return False
+
+    if entry['file_id']:
+        try:
+            await message.answer_document(document=entry['file_id'], caption=caption(entry['rows']))
+            return True
+        except TelegramBadRequest as e:
+            # file_id мог устареть — отправляем файл заново
+            logger.warning(f"Не удалось отправить выгрузку по file_id: {e}")
+            entry['file_id'] = None
+            if not os.path.exists(entry['path']):
+                entry = await ensure_built()
+                if entry is None:
+                    return False
+
+    sent = await message.answer_document(document=FSInputFile(entry['path']), caption=caption(entry['rows']))
+    export_cache.set_file_id(key, sent.document.file_id)
+    export_cache.cleanup()
+    return True
+
+
 @dp.message(Command("export_schedule"))
 async def cmd_export_schedule(message: types.Message):
     """
@@ -2057,23 +3040,21 @@ async def cmd_export_schedule(message: types.Message):
         today = datetime.now()
         date_from = today - timedelta(days=days)
         
-        schedule_data = db.get_schedule_by_group_range(group_number, date_from.date(), today.date())
-        
-        if not schedule_data:
-            await message.answer(f"❌ На группу {group_number} расписание не найдено.")
-            return
-        
-        # Экспортируем в Excel
-        await message.answer(f"⏳ Подготавливаю расписание группы {group_number}...")
-        filename = export_schedule_to_excel(schedule_data, group_name=group_number)
-        
-        doc = FSInputFile(filename)
-        await message.answer_document(
-            document=doc,
-            caption=f"📅 Расписание группы {group_number}\n"
-                   f"Период: последние {days} дней\n"
-                   f"Занятий: {len(schedule_data)} шт."
+        version = await asyncio.to_thread(db.get_data_version)
+        sent = await send_schedule_export(
+            message,
+            key=("schedule", group_number, date_from.date(), today.date(), version),
+            date_from=date_from.date(),
+            date_to=today.date(),
+            group_number=group_number,
+            group_name=group_number,
+            progress_text=f"⏳ Подготавливаю расписание группы {group_number}...",
+            caption=lambda rows: (f"📅 Расписание группы {group_number}\n"
+                                  f"Период: последние {days} дней\n"
+                                  f"Занятий: {rows} шт."),
         )
+        if not sent:
+            await message.answer(f"❌ На группу {group_number} расписание не найдено.")
         
     except Exception as e:
         logger.error(f"Ошибка при экспорте расписания: {e}")
@@ -2109,24 +3090,21 @@ async def cmd_export_all_schedule(message: types.Message):
         today = datetime.now()
         date_from = today - timedelta(days=days)
         
-        await message.answer(f"⏳ Подготавливаю расписание всех групп за последние {days} дней...")
-        
-        schedule_data = db.get_all_schedule_range(date_from.date(), today.date())
-        
-        if not schedule_data:
-            await message.answer("❌ Расписание не найдено.")
-            return
-        
-        # Экспортируем в Excel
-        filename = export_schedule_to_excel(schedule_data, group_name="все_группы")
-        
-        doc = FSInputFile(filename)
-        await message.answer_document(
-            document=doc,
-            caption=f"📅 Расписание всех групп\n"
-                   f"Период: последние {days} дней\n"
-                   f"Всего занятий: {len(schedule_data)} шт."
+        version = await asyncio.to_thread(db.get_data_version)
+        sent = await send_schedule_export(
+            message,
+            key=("schedule", None, date_from.date(), today.date(), version),
+            date_from=date_from.date(),
+            date_to=today.date(),
+            group_number=None,
+            group_name="все_группы",
+            progress_text=f"⏳ Подготавливаю расписание всех групп за последние {days} дней...",
+            caption=lambda rows: (f"📅 Расписание всех групп\n"
+                                  f"Период: последние {days} дней\n"
+                                  f"Всего занятий: {rows} шт."),
         )
+        if not sent:
+            await message.answer("❌ Расписание не найдено.")
         
     except Exception as e:
         logger.error(f"Ошибка при экспорте расписания: {e}")
@@ -2162,34 +3140,48 @@ async def cmd_export_logs(message: types.Message):
     
     if len(parts) > 2:
         file_format = parts[2].lower()
-        if file_format not in ("excel", "xlsx", "csv"):
-            await message.answer("⚠️ Формат должен быть: excel, xlsx или csv")
+        if file_format not in ("excel", "xlsx", "csv", "gz", "csv.gz"):
+            await message.answer("⚠️ Формат должен быть: excel, xlsx, csv или gz (CSV со сжатием)")
             return
     
     # Нормализуем формат
     if file_format in ("excel", "xlsx"):
         file_format = "excel"
+    elif file_format in ("gz", "csv.gz"):
+        file_format = "csv.gz"
     
+    if export_queue.is_user_busy(message.from_user.id):
+        await message.answer(EXPORT_BUSY_MESSAGE)
+        return
+
     try:
-        actions = db.get_user_actions(last_days=days)
-        
-        if not actions:
-            await message.answer("За указанный период действий не найдено.")
-            return
-        
+        status = await message.answer(
+            f"⏳ Подготавливаю логи за последние {days} дн. в формате {file_format.upper()}..."
+        )
+        progress = {'rows': 0}
+        rows = count_rows(db.iter_user_actions(last_days=days), progress)
+
         if file_format == "excel":
-            await message.answer(f"⏳ Подготавливаю логи за последние {days} дн. в формате Excel...")
-            filename = export_user_actions_to_excel(actions)
+            export = lambda: export_user_actions_to_excel(rows)
         else:
-            await message.answer(f"⏳ Подготавливаю логи за последние {days} дн. в формате CSV...")
-            filename = export_user_actions_to_csv(actions)
+            export = lambda: export_user_actions_to_csv(rows, compress=file_format == "csv.gz")
+
+        filename = await run_export_with_progress(
+            status, export, progress,
+            total=db.estimate_user_actions_count(last_days=days),
+            user_id=message.from_user.id,
+        )
+
+        if not progress['rows']:
+            os.remove(filename)   # пустой отчёт (только заголовок) не храним
+            await status.edit_text("За указанный период действий не найдено.")
+            return
         
-        doc = FSInputFile(filename)
-        await message.answer_document(
-            document=doc,
+        await send_report_file(
+            message, status, filename,
             caption=f"📊 Логи действий пользователей\n"
                    f"Период: последние {days} дн.\n"
-                   f"Записей: {len(actions)} шт.\n"
+                   f"Записей: {progress['rows']} шт.\n"
                    f"Формат: {file_format.upper()}"
         )
         
@@ -2270,8 +3262,12 @@ async def cmd_get_template(message: types.Message):
 @dp.message(Command("import_schedule"))
 async def cmd_import_schedule(message: types.Message, state: FSMContext):
     """
-    /import_schedule
-    Загрузить расписание из Excel файла.
+    /import_schedule [diff] [force]
+    Загрузить расписание из файла (Excel, CSV/TSV, JSON Lines, iCalendar).
+    С параметром diff файл сначала сравнивается с текущим расписанием,
+    а после подтверждения применяется только разница.
+    Файл, который уже импортирован и с тех пор не менялся, повторно не загружается;
+    force — импортировать всё равно.
     Доступно только администраторам.
     """
     user = db.get_user_by_telegram_id(message.from_user.id)
@@ -2280,8 +3276,21 @@ async def cmd_import_schedule(message: types.Message, state: FSMContext):
         await message.answer("❌ Команда доступна только администратору.")
         return
     
+    options = {part.lower() for part in message.text.split()[1:]}
+    mode = "diff" if "diff" in options else "import"
+    await state.update_data(import_mode=mode, import_force="force" in options)
+    
+    if mode == "diff":
+        await message.answer(
+            "🔍 Режим сравнения: файл будет сравнён с текущим расписанием групп из файла "
+            "за период файла, вы увидите сводку изменений и сможете применить только разницу."
+        )
     await message.answer(
-        "📤 Отправьте Excel файл с расписанием.\n\n"
+        "📤 Отправьте файл с расписанием: Excel (.xlsx), CSV/TSV (.csv, .tsv), "
+        "JSON Lines (.jsonl) или календарь iCalendar (.ics).\n"
+        "Колонки — как в шаблоне: Группа, Дата, Пара, Начало, Конец, Предмет, Тип, "
+        "Преподаватель, Аудитория.\n"
+        "В .ics группа — название календаря, пара определяется по времени начала события.\n\n"
         "Используйте команду /get_template для получения шаблона."
     )
     await state.set_state(UserStates.waiting_for_file)
@@ -2310,46 +3319,48 @@ async def process_schedule_import(message: types.Message, state: FSMContext):
         return
     
     if not message.document:
-        await message.answer("❌ Пожалуйста, отправьте файл Excel (.xlsx)")
+        await message.answer("❌ Пожалуйста, отправьте файл Excel (.xlsx), CSV/TSV, JSON Lines (.jsonl) или iCalendar (.ics)")
         return
     
     # Проверяем расширение файла
-    if not message.document.file_name.lower().endswith(('.xlsx', '.xls')):
-        await message.answer("❌ Поддерживаются только файлы Excel (.xlsx)")
+    if not get_schedule_import_format(message.document.file_name):
+        await message.answer("❌ Поддерживаются файлы Excel (.xlsx), CSV/TSV (.csv, .tsv), JSON Lines (.jsonl) и iCalendar (.ics)")
         return
     
     try:
-        await message.answer("⏳ Обрабатываю файл...")
+        status = await message.answer("⏳ Загружаю файл...")
         
-        # Скачиваем файл
-        file_path = f"temp/{message.document.file_id}.xlsx"
-        os.makedirs("temp", exist_ok=True)
+        # Скачиваем файл; он удаляется, когда задача импорта завершится.
+        # Имя — по сообщению, а не по file_id: тот же документ, присланный повторно,
+        # не перезапишет файл задачи, которая ещё не завершилась
+        extension = os.path.splitext(message.document.file_name)[1].lower()
+        file_path = os.path.join(IMPORT_TEMP_DIR, f"{message.chat.id}_{message.message_id}{extension}")
+        os.makedirs(IMPORT_TEMP_DIR, exist_ok=True)
         
         file_info = await bot.get_file(message.document.file_id)
         await bot.download_file(file_info.file_path, file_path)
         
         log_user_action(message.from_user.id, "import_schedule", f"Файл: {message.document.file_name}")
         
-        # Импортируем расписание
-        result = import_schedule_from_excel(file_path, db)
-        
-        # Удаляем временный файл
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        # Формируем ответ
-        response = f"✅ {result['message']}\n"
-        response += f"📝 Добавлено записей: {result['added']}\n"
+        # Тот же файл, уже импортированный без последующих изменений, — не разбираем
+        data = await state.get_data()
+        sha256 = await asyncio.to_thread(file_sha256, file_path)
+        if not data.get('import_force'):
+            imported = await asyncio.to_thread(db.find_imported_file, sha256)
+            if imported:
+                os.remove(file_path)
+                await status.edit_text(format_already_imported(message.document.file_name, imported))
+                return
         
-        if result['errors']:
-            response += f"\n⚠️ Ошибок: {len(result['errors'])}\n"
-            response += "Детали ошибок:\n"
-            for error in result['errors'][:10]:  # Показываем первые 10 ошибок
-                response += f"• {error}\n"
-            if len(result['errors']) > 10:
-                response += f"... и ещё {len(result['errors']) - 10} ошибок\n"
-        
-        await message.answer(response)
+        # Импорт идёт в фоне: сообщение status показывает ход импорта и кнопку отмены
+        await import_job_runner.submit(
+            db, bot, status,
+            admin_telegram_id=message.from_user.id,
+            file_path=file_path,
+            file_name=message.document.file_name,
+            mode=data.get('import_mode', "import"),
+            file_sha256=sha256,
+        )
         
     except Exception as e:
         logger.error(f"Ошибка при импорте расписания: {e}")
@@ -2359,6 +3370,50 @@ async def process_schedule_import(message: types.Message, state: FSMContext):
         await state.clear()
 
 
+@dp.callback_query(F.data.regexp(r"^import_cancel_(\d+)$"))
+async def cancel_schedule_import(callback: types.CallbackQuery):
+    """Отмена фонового импорта расписания кнопкой под сообщением о ходе импорта"""
+    user = db.get_user_by_telegram_id(callback.from_user.id)
+    if not is_admin(user):
+        await callback.answer("❌ У вас нет прав для отмены импорта.", show_alert=True)
+        return
+
+    job_id = int(callback.data.rsplit("_", 1)[1])
+    if import_job_runner.cancel(job_id):
+        log_user_action(callback.from_user.id, "import_cancel", f"Задача импорта #{job_id}")
+        await callback.answer("⏳ Отменяю импорт, изменения будут откатены...")
+    else:
+        await callback.answer("Импорт уже завершён.", show_alert=True)
+
+
+@dp.callback_query(F.data.regexp(r"^import_(apply|discard)_(\d+)$"))
+async def decide_schedule_import_diff(callback: types.CallbackQuery):
+    """Применение или отказ от изменений после сравнения файла с расписанием"""
+    user = db.get_user_by_telegram_id(callback.from_user.id)
+    if not is_admin(user):
+        await callback.answer("❌ У вас нет прав для импорта расписания.", show_alert=True)
+        return
+
+    _, decision, job_id = callback.data.split("_")
+    job_id = int(job_id)
+
+    if decision == "apply":
+        applied = await import_job_runner.apply_preview(
+            db, bot, job_id, callback.message, admin_telegram_id=callback.from_user.id
+        )
+        if not applied:
+            await callback.answer("Изменения уже применены или отменены.", show_alert=True)
+            return
+        log_user_action(callback.from_user.id, "import_apply", f"Предпросмотр импорта #{job_id}")
+        await callback.answer("⏳ Применяю изменения...")
+    else:
+        if not await import_job_runner.discard_preview(db, job_id):
+            await callback.answer("Изменения уже применены или отменены.", show_alert=True)
+            return
+        await safe_edit_text(callback.message, f"{callback.message.text}\n\n❌ Изменения не применены.")
+        await callback.answer()
+
+
 @dp.message(Command("clear_schedule"))
 async def cmd_clear_schedule(message: types.Message):
     """
@@ -2447,6 +3502,7 @@ async def lost_message_handler(message: types.Message, state: FSMContext):
         str(SearchStates.waiting_for_group_search): "🔄 <b>Вы не закончили поиск по группе</b>",
         str(SearchStates.waiting_for_teacher_search): "🔄 <b>Вы не закончили поиск по преподавателю</b>",
         str(SearchStates.waiting_for_room_search): "🔄 <b>Вы не закончили поиск по аудитории</b>",
+        str(RangeStates.waiting_for_range): "🔄 <b>Вы не закончили выбор периода</b>",
         str(FileStates.waiting_for_schedule_file): "🔄 <b>Вы начали загрузку расписания</b>",
     }
     
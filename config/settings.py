@@ -12,7 +12,9 @@ DB_CONFIG = {
     'user': os.getenv('DB_USER', 'postgres'),
     'password': os.getenv('DB_PASSWORD', 'postgres'),
     'host': os.getenv('DB_HOST', 'localhost'),
-    'port': os.getenv('DB_PORT', '5432')
+    'port': os.getenv('DB_PORT', '5432'),
+    # Не ждать недоступную БД дольше нескольких секунд
+    'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5'))
 }
 
 # Уровни доступа пользователей
@@ -55,7 +57,80 @@ SCHEDULE_TIMES = {
 # Настройки логирования
 LOG_FILE = 'bot.log'
 LOG_REPORTS_DIR = 'reports'
+EXPORT_CACHE_SIZE = 256                      # сколько готовых выгрузок помнить (путь и file_id)
+EXPORT_CACHE_DIR = os.path.join(LOG_REPORTS_DIR, 'cache')  # файлы кэша выгрузок — отдельно от отчётов
+REPORTS_DIR_MAX_BYTES = 200 * 1024 * 1024    # предел размера EXPORT_CACHE_DIR, старые файлы удаляются
 
 # Каталог для хранения файлов
 FILES_DIR = 'files'
-SCHEDULES_DIR = os.path.join(FILES_DIR, 'schedules')
\ No newline at end of file
+SCHEDULES_DIR = os.path.join(FILES_DIR, 'schedules')
+
+# Постраничный выбор групп и преподавателей (кнопок на странице)
+PICKER_PAGE_SIZE = 12
+
+# Inline-режим (@bot ИВТ-21) и кэши
+INLINE_CACHE_TIME = 60       # сколько секунд Telegram кэширует ответ на inline-запрос (сбросить этот кэш бот не может)
+INLINE_MAX_RESULTS = 5       # групп/преподавателей/аудиторий в ответе (по 2 варианта на каждую)
+REFERENCE_CACHE_TTL = 600    # период обновления справочников в памяти, сек
+SCHEDULE_CACHE_TTL = 300     # время жизни готового текста расписания, сек
+SCHEDULE_CACHE_SIZE = 2000   # максимум текстов расписания в кэше
+
+# Просмотр расписания за месяц/период
+MAX_RANGE_DAYS = 186          # максимальная длина произвольного периода, дней
+MESSAGE_CHUNK_LIMIT = 4000    # запас до лимита Telegram в 4096 символов на сообщение
+
+# Расписание картинкой
+SCHEDULE_IMAGE_FONT = os.getenv('SCHEDULE_IMAGE_FONT', 'DejaVuSans.ttf')  # TTF с кириллицей
+IMAGE_RENDER_WORKERS = int(os.getenv('IMAGE_RENDER_WORKERS', '2'))        # процессов для рендера
+IMAGE_CACHE_SIZE = 200        # готовых PNG в памяти
+
+# Журнал действий пользователей: очередь в памяти + пакетная запись в БД
+ACTION_LOG_QUEUE_SIZE = 10000         # максимум записей в очереди, лишние отбрасываются
+ACTION_LOG_BATCH_SIZE = 200           # записей в одном INSERT
+ACTION_LOG_FLUSH_INTERVAL_MS = 1000   # не реже чем раз в столько миллисекунд
+ACTION_LOG_USER_CACHE_TTL = 600       # сколько секунд помнить user_id по Telegram ID
+ACTION_LOG_SPOOL_FILE = os.path.join(FILES_DIR, 'action_log_spool.jsonl')  # запас на время недоступности БД
+ACTION_LOG_REPLAY_INTERVAL = 30       # как часто пробовать дозаписать запас в БД, сек
+ACTION_LOG_PARTITIONS_AHEAD = 2       # месячных секций журнала создаётся наперёд
+ACTION_LOG_RETENTION_MONTHS = int(os.getenv('ACTION_LOG_RETENTION_MONTHS', '12'))  # хранить полных месяцев
+
+# Политики записи по типам действий:
+#   ("always",)       — каждое действие попадает в журнал
+#   ("sample", p)     — в журнал попадает доля p действий (с отметкой sample_rate = p)
+#   ("count",)        — только счётчики в сводках /activity, без строк журнала
+#   ("off",)          — не учитывается совсем
+# Сводки /activity считают все действия, кроме "off", независимо от выборки.
+ACTION_LOG_DEFAULT_POLICY = ("always",)
+ACTION_LOG_POLICIES = {
+    'schedule_day': ("count",),
+    'my_schedule': ("sample", 0.1),
+}
+
+# Выгрузка больших отчётов
+EXPORT_PROGRESS_INTERVAL = 3                 # как часто обновлять сообщение о прогрессе, сек
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024     # максимальный размер файла, который бот может отправить
+EXPORT_MAX_CONCURRENT = 2                    # выгрузок одновременно (и процессов для сборки XLSX), остальные ждут в очереди
+EXPORT_PER_USER_LIMIT = 1                    # незавершённых выгрузок у одного пользователя
+
+# Фоновый импорт расписания
+IMPORT_PROGRESS_INTERVAL = 3                 # как часто обновлять сообщение о ходе импорта, сек
+IMPORT_TEMP_DIR = "temp"                     # куда скачиваются файлы импорта до окончания задачи
+IMPORT_PREVIEW_TTL = 24 * 3600               # сколько предпросмотр (diff) ждёт решения, сек; затем отклоняется, файл удаляется
+IMPORT_VALIDATION_WORKERS = min(4, os.cpu_count() or 1)  # процессов для проверки строк больших файлов
+IMPORT_VALIDATION_CHUNK = 5000               # строк в одной пачке проверки
+IMPORT_SKIP_UNCHANGED_GROUPS = True          # не перезаписывать группы, пары которых не изменились с прошлого импорта
+
+# Календарные подписки (.ics) для групп, преподавателей и аудиторий
+ICS_FEED_PORT = int(os.getenv('ICS_FEED_PORT', '0'))       # порт HTTP-сервера подписок, 0 — не запускать
+ICS_FEED_HOST = os.getenv('ICS_FEED_HOST', '0.0.0.0')
+ICS_FEED_BASE_URL = os.getenv('ICS_FEED_BASE_URL', '').rstrip('/')  # публичный адрес сервера для ссылок в /calendar
+ICS_FEED_PAST_DAYS = 14                      # сколько дней прошедших пар включать в календарь
+ICS_FEED_FUTURE_DAYS = 120                   # и сколько дней вперёд
+ICS_FEED_MAX_AGE = 3600                      # Cache-Control: клиентам и прокси не спрашивать чаще, сек
+ICS_FEED_CACHE_SIZE = 1024                   # готовых календарей в памяти (по версии данных)
+ICS_FEED_VERSION_TTL = 30                    # как долго считать версию данных актуальной без запроса к БД, сек
+
+# Импорт iCalendar (.ics)
+ICS_TIMEZONE = os.getenv('TIMEZONE', 'Europe/Moscow')  # в этот пояс переводится время событий с TZID/UTC
+ICS_RRULE_HORIZON_DAYS = 366                 # на сколько дней разворачивать повторения без COUNT/UNTIL
+ICS_DEFAULT_SUBJECT_TYPE = 'lecture'         # тип пары, если его нет в CATEGORIES и названии
@@ -3,8 +3,15 @@
 ИСПРАВЛЕНО: убран параметр commit, убрано дублирование методов
 """
 
+import csv
+import io
+from collections import Counter
+from datetime import date, timedelta
+import threading
+import uuid
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import logging
 from config.settings import DB_CONFIG
 from database.schema import CREATE_TABLES_SQL, INSERT_LESSON_TIMES_SQL, INSERT_TEST_DATA_SQL
@@ -12,11 +19,50 @@ from database.schema import CREATE_TABLES_SQL, INSERT_LESSON_TIMES_SQL, INSERT_T
 logger = logging.getLogger(__name__)
 
 
+class ImportCancelled(Exception):
+    """Импорт остановлен по запросу администратора (транзакция откатывается)"""
+
+
+class _CopyStream:
+    """
+    Файлоподобный источник для COPY ... FROM STDIN (FORMAT csv):
+    строки CSV формируются из итератора по мере чтения, без загрузки всего файла в память.
+    """
+
+    def __init__(self, rows, chunk_size: int = 1 << 16):
+        self._rows = iter(rows)
+        self._chunk_size = chunk_size
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def read(self, size: int = -1) -> str:
+        while self._buffer.tell() < max(size, self._chunk_size):
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
 class DatabaseManager:
     """Класс для управления подключением и операциями с базой данных"""
     
     def __init__(self):
-        self.connection = None
+        # Соединение хранится отдельно для каждого потока: методы вызываются
+        # и из event loop, и из asyncio.to_thread одновременно
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        return getattr(self._local, 'connection', None)
+
+    @connection.setter
+    def connection(self, value):
+        self._local.connection = value
     
     def connect(self):
         """Установка соединения с базой данных"""
@@ -81,6 +127,44 @@ class DatabaseManager:
             cursor.close()
             self.disconnect()
     
+    def _execute_returning(self, query, params=None):
+        """Запрос с изменением данных и RETURNING: вернуть строки и зафиксировать"""
+        conn = self.connect()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        try:
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+            conn.commit()
+            return result
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка выполнения запроса: {e}")
+            raise
+        finally:
+            cursor.close()
+            self.disconnect()
+
+    def iter_query(self, query, params=None, batch_size: int = 5000):
+        """
+        Потоковое чтение результата через именованный (серверный) курсор:
+        строки приходят пачками по batch_size, в памяти держится одна пачка.
+        Генератор использует собственное соединение; оно закрывается,
+        когда генератор исчерпан или закрыт.
+        """
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = batch_size
+
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+            conn.rollback()
+            conn.close()
+    
     def get_user_by_telegram_id(self, telegram_id):
         """Получение пользователя по Telegram ID"""
         query = """
@@ -275,62 +359,74 @@ class DatabaseManager:
         """
         return self.execute_query(query, (room_id, date), fetch=True)
     
-    def get_all_schedule_range(self, date_from, date_to, group_number=None):
-        """Получение расписания за период для всех групп или конкретной группы"""
+    def _schedule_range_query(self, date_from, date_to, group_number=None):
+        """Запрос и параметры расписания за период (все группы или одна) для выгрузки"""
+        query = """
+            SELECT 
+                sg.group_number,
+                s.lesson_date,
+                lt.lesson_number,
+                lt.start_time,
+                lt.end_time,
+                sub.name as subject_name,
+                sub.subject_type,
+                t.fio as teacher_fio,
+                b.name as building_name,
+                r.room_number,
+                s.notes
+            FROM schedule s
+            JOIN student_groups sg ON s.group_id = sg.id
+            JOIN lesson_times lt ON s.lesson_time_id = lt.id
+            JOIN subjects sub ON s.subject_id = sub.id
+            LEFT JOIN teachers t ON s.teacher_id = t.id
+            LEFT JOIN rooms r ON s.room_id = r.id
+            LEFT JOIN buildings b ON r.building_id = b.id
+        """
         if group_number:
             # Расписание для конкретной группы
-            query = """
-                SELECT 
-                    sg.group_number,
-                    s.lesson_date,
-                    lt.lesson_number,
-                    lt.start_time,
-                    lt.end_time,
-                    sub.name as subject_name,
-                    sub.subject_type,
-                    t.fio as teacher_fio,
-                    b.name as building_name,
-                    r.room_number,
-                    s.notes
-                FROM schedule s
-                JOIN student_groups sg ON s.group_id = sg.id
-                JOIN lesson_times lt ON s.lesson_time_id = lt.id
-                JOIN subjects sub ON s.subject_id = sub.id
-                LEFT JOIN teachers t ON s.teacher_id = t.id
-                LEFT JOIN rooms r ON s.room_id = r.id
-                LEFT JOIN buildings b ON r.building_id = b.id
-                WHERE sg.group_number = %s 
-                AND s.lesson_date BETWEEN %s AND %s
-                ORDER BY s.lesson_date, lt.lesson_number
-            """
-            return self.execute_query(query, (group_number, date_from, date_to), fetch=True)
-        else:
-            # Расписание для всех групп
-            query = """
-                SELECT 
-                    sg.group_number,
-                    s.lesson_date,
-                    lt.lesson_number,
-                    lt.start_time,
-                    lt.end_time,
-                    sub.name as subject_name,
-                    sub.subject_type,
-                    t.fio as teacher_fio,
-                    b.name as building_name,
-                    r.room_number,
-                    s.notes
-                FROM schedule s
-                JOIN student_groups sg ON s.group_id = sg.id
-                JOIN lesson_times lt ON s.lesson_time_id = lt.id
-                JOIN subjects sub ON s.subject_id = sub.id
-                LEFT JOIN teachers t ON s.teacher_id = t.id
-                LEFT JOIN rooms r ON s.room_id = r.id
-                LEFT JOIN buildings b ON r.building_id = b.id
-                WHERE s.lesson_date BETWEEN %s AND %s
-                ORDER BY sg.group_number, s.lesson_date, lt.lesson_number
+            query += """
+            WHERE sg.group_number = %s 
+            AND s.lesson_date BETWEEN %s AND %s
+            ORDER BY s.lesson_date, lt.lesson_number
             """
-            return self.execute_query(query, (date_from, date_to), fetch=True)
+            return query, (group_number, date_from, date_to)
+
+        # Расписание для всех групп
+        query += """
+            WHERE s.lesson_date BETWEEN %s AND %s
+            ORDER BY sg.group_number, s.lesson_date, lt.lesson_number
+        """
+        return query, (date_from, date_to)
+
+    def get_all_schedule_range(self, date_from, date_to, group_number=None):
+        """Получение расписания за период для всех групп или конкретной группы"""
+        query, params = self._schedule_range_query(date_from, date_to, group_number)
+        return self.execute_query(query, params, fetch=True)
+
+    def iter_all_schedule_range(self, date_from, date_to, group_number=None, batch_size: int = 5000):
+        """
+        То же расписание потоком через серверный курсор (iter_query):
+        выгрузка учебного года всех групп не держит все занятия в памяти
+        """
+        query, params = self._schedule_range_query(date_from, date_to, group_number)
+        return self.iter_query(query, params, batch_size=batch_size)
     
+    def get_data_version(self, name: str = "schedule") -> int:
+        """
+        Версия данных (таблица data_versions): растёт при любом изменении
+        расписания и справочников; используется в ключе кэша выгрузок
+        """
+        result = self.execute_query("SELECT version FROM data_versions WHERE name = %s", (name,), fetch=True)
+        return result[0]['version'] if result else 0
+
+    def get_data_version_info(self, name: str = "schedule"):
+        """Версия данных и время последнего изменения (с часовым поясом) — для ETag/Last-Modified"""
+        result = self.execute_query(
+            "SELECT version, changed_at::timestamptz AS changed_at FROM data_versions WHERE name = %s",
+            (name,), fetch=True
+        )
+        return result[0] if result else None
+
     def get_all_groups(self):
         """Получение списка всех групп"""
         query = """
@@ -342,19 +438,170 @@ class DatabaseManager:
         return self.execute_query(query, fetch=True)
     
     def get_all_teachers(self):
-        """Получение списка всех преподавателей (без дублей)"""
+        """Получение списка всех преподавателей"""
         query = """
-            SELECT DISTINCT ON (fio) id, fio, department, position
+            SELECT id, fio, department, position
             FROM teachers
             ORDER BY fio, id
         """
         return self.execute_query(query, fetch=True)
     
+    def get_all_rooms(self):
+        """Получение списка всех аудиторий"""
+        query = """
+            SELECT r.id, r.room_number, b.name as building_name
+            FROM rooms r
+            LEFT JOIN buildings b ON r.building_id = b.id
+            ORDER BY r.room_number
+        """
+        return self.execute_query(query, fetch=True)
+
     def get_all_users(self):
         """Получение всех пользователей"""
         query = "SELECT id, telegram_id, username, role FROM users"
         return self.execute_query(query, fetch=True)
 
+    # ===== КАТАЛОГ ГРУПП И ПРЕПОДАВАТЕЛЕЙ (ПОСТРАНИЧНО) =====
+
+    def get_group_by_number(self, group_number: str):
+        """Получение группы по номеру (без учёта регистра)"""
+        query = """
+            SELECT sg.id, sg.group_number, sg.course, sg.faculty_id, f.name as faculty_name
+            FROM student_groups sg
+            JOIN faculties f ON sg.faculty_id = f.id
+            WHERE upper(sg.group_number) = upper(%s)
+            LIMIT 1
+        """
+        result = self.execute_query(query, (group_number,), fetch=True)
+        return result[0] if result else None
+
+    def get_group_by_id(self, group_id: int):
+        """Получение группы по id"""
+        query = """
+            SELECT sg.id, sg.group_number, sg.course, sg.faculty_id, f.name as faculty_name
+            FROM student_groups sg
+            JOIN faculties f ON sg.faculty_id = f.id
+            WHERE sg.id = %s
+        """
+        result = self.execute_query(query, (group_id,), fetch=True)
+        return result[0] if result else None
+
+    def get_teacher_by_id(self, teacher_id: int):
+        """Получение преподавателя по id"""
+        query = "SELECT id, fio, department, position FROM teachers WHERE id = %s"
+        result = self.execute_query(query, (teacher_id,), fetch=True)
+        return result[0] if result else None
+
+    def get_room_by_id(self, room_id: int):
+        """Получение аудитории по id"""
+        query = """
+            SELECT r.id, r.building_id, r.room_number, b.name as building_name
+            FROM rooms r
+            LEFT JOIN buildings b ON r.building_id = b.id
+            WHERE r.id = %s
+        """
+        result = self.execute_query(query, (room_id,), fetch=True)
+        return result[0] if result else None
+
+    def get_faculties(self):
+        """Список факультетов, в которых есть хотя бы одна группа"""
+        query = """
+            SELECT f.id, f.name, f.short_name
+            FROM faculties f
+            WHERE EXISTS (SELECT 1 FROM student_groups sg WHERE sg.faculty_id = f.id)
+            ORDER BY f.name
+        """
+        return self.execute_query(query, fetch=True)
+
+    def get_faculty_courses(self, faculty_id: int):
+        """Список курсов факультета (0 — группы без указанного курса)"""
+        query = """
+            SELECT DISTINCT COALESCE(course, 0) as course
+            FROM student_groups
+            WHERE faculty_id = %s
+            ORDER BY 1
+        """
+        return [r['course'] for r in self.execute_query(query, (faculty_id,), fetch=True)]
+
+    def get_groups_page(self, faculty_id: int, course: int, after_id: int = None,
+                        before_id: int = None, limit: int = 12):
+        """
+        Страница групп факультета/курса (keyset-пагинация по group_number).
+        after_id — следующая страница после группы с этим id,
+        before_id — предыдущая страница перед группой с этим id.
+        Возвращает (строки страницы, есть ли ещё страница в направлении листания).
+        """
+        conditions = ["sg.faculty_id = %s"]
+        params = [faculty_id]
+
+        if course:
+            conditions.append("sg.course = %s")
+            params.append(course)
+        else:
+            conditions.append("sg.course IS NULL")
+
+        order = "ASC"
+        if after_id:
+            conditions.append("sg.group_number > (SELECT group_number FROM student_groups WHERE id = %s)")
+            params.append(after_id)
+        elif before_id:
+            conditions.append("sg.group_number < (SELECT group_number FROM student_groups WHERE id = %s)")
+            params.append(before_id)
+            order = "DESC"
+
+        params.append(limit + 1)
+        query = f"""
+            SELECT sg.id, sg.group_number, sg.course
+            FROM student_groups sg
+            WHERE {" AND ".join(conditions)}
+            ORDER BY sg.group_number {order}
+            LIMIT %s
+        """
+        rows = self.execute_query(query, tuple(params), fetch=True)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before_id:
+            # Для страницы «назад» строки выбраны в обратном порядке
+            rows.reverse()
+        return rows, has_more
+
+    def get_teachers_page(self, after_id: int = None, before_id: int = None,
+                          letter: str = None, limit: int = 12):
+        """
+        Страница преподавателей по алфавиту (keyset-пагинация по (fio, id)).
+        letter — начать страницу с первой фамилии на эту букву.
+        Возвращает (строки страницы, есть ли ещё страница в направлении листания).
+        """
+        order = "ASC"
+        if after_id:
+            condition = "WHERE (fio, id) > (SELECT fio, id FROM teachers WHERE id = %s)"
+            params = [after_id]
+        elif before_id:
+            condition = "WHERE (fio, id) < (SELECT fio, id FROM teachers WHERE id = %s)"
+            params = [before_id]
+            order = "DESC"
+        elif letter:
+            condition = "WHERE fio >= %s"
+            params = [letter]
+        else:
+            condition = ""
+            params = []
+
+        params.append(limit + 1)
+        query = f"""
+            SELECT id, fio, department, position
+            FROM teachers
+            {condition}
+            ORDER BY fio {order}, id {order}
+            LIMIT %s
+        """
+        rows = self.execute_query(query, tuple(params), fetch=True)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before_id:
+            rows.reverse()
+        return rows, has_more
+
     # ===== РОЛИ ПОЛЬЗОВАТЕЛЕЙ =====
 
     def update_user_role(self, user_id: int, role: str):
@@ -417,126 +664,444 @@ class DatabaseManager:
         """
         self.execute_query(query, (user_id, telegram_id, username, action, details))
 
+    def get_users_by_telegram_ids(self, telegram_ids):
+        """
+        Пользователи по списку Telegram ID одним запросом
+        (для пакетной записи действий)
+        """
+        if not telegram_ids:
+            return []
+        query = """
+            SELECT id, telegram_id, username
+            FROM users
+            WHERE telegram_id = ANY(%s)
+        """
+        return self.execute_query(query, (list(telegram_ids),), fetch=True)
+
+    def insert_user_actions_bulk(self, rows):
+        """
+        Пакетная вставка действий одним многострочным INSERT.
+        В той же транзакции обновляются сводки user_actions_hourly
+        и user_actions_daily_users.
+        rows — кортежи (user_id, telegram_id, username, action, details, created_at, sample_rate);
+        sample_rate = None — действие только учитывается в сводках (политика "count")
+        """
+        if not rows:
+            return 0
+
+        hourly = Counter()
+        logged = Counter()
+        daily_users = set()
+        journal = []
+        for row in rows:
+            _, telegram_id, _, action, _, created_at, sample_rate = row
+            hour_key = (created_at.replace(minute=0, second=0, microsecond=0), action)
+            hourly[hour_key] += 1
+            daily_users.add((created_at.date(), action, telegram_id))
+            if sample_rate is not None:
+                logged[hour_key] += 1
+                journal.append(row)
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            if journal:
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO user_actions (user_id, telegram_id, username, action, details, created_at, sample_rate)
+                    VALUES %s
+                    """,
+                    journal,
+                    page_size=len(journal)
+                )
+            execute_values(
+                cursor,
+                """
+                INSERT INTO user_actions_hourly (hour, action, actions_count, logged_count)
+                VALUES %s
+                ON CONFLICT (hour, action)
+                DO UPDATE SET actions_count = user_actions_hourly.actions_count + EXCLUDED.actions_count,
+                              logged_count = user_actions_hourly.logged_count + EXCLUDED.logged_count
+                """,
+                [(hour, action, count, logged[(hour, action)]) for (hour, action), count in hourly.items()],
+                page_size=len(hourly)
+            )
+            execute_values(
+                cursor,
+                """
+                INSERT INTO user_actions_daily_users (day, action, telegram_id)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                """,
+                list(daily_users),
+                page_size=len(daily_users)
+            )
+            conn.commit()
+            return len(journal)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка пакетной записи действий пользователей: {e}")
+            raise
+        finally:
+            cursor.close()
+            self.disconnect()
+
     def get_user_actions(self, last_days: int = 1):
         """
         Возвращает последние действия пользователей за N дней
         """
+        # created_at — TIMESTAMP без пояса, сравниваем с LOCALTIMESTAMP,
+        # чтобы планировщик отсекал лишние месячные секции
         query = """
-            SELECT user_id, telegram_id, username, action, details, created_at
+            SELECT user_id, telegram_id, username, action, details, sample_rate, created_at
             FROM user_actions
-            WHERE created_at >= NOW() - INTERVAL %s
+            WHERE created_at >= LOCALTIMESTAMP - %s::interval
             ORDER BY created_at DESC
         """
         param = f"{last_days} days"
         return self.execute_query(query, (param,), fetch=True)
 
+    def iter_user_actions(self, last_days: int = 1, batch_size: int = 5000):
+        """Действия за N дней потоком (для выгрузки больших периодов)"""
+        query = """
+            SELECT user_id, telegram_id, username, action, details, sample_rate, created_at
+            FROM user_actions
+            WHERE created_at >= LOCALTIMESTAMP - %s::interval
+            ORDER BY created_at DESC
+        """
+        return self.iter_query(query, (f"{last_days} days",), batch_size=batch_size)
+
+    def estimate_user_actions_count(self, last_days: int = 1):
+        """Примерное число строк журнала за N дней по почасовым сводкам (для прогресса)"""
+        query = """
+            SELECT COALESCE(SUM(logged_count), 0)::bigint AS total
+            FROM user_actions_hourly
+            WHERE hour >= date_trunc('hour', LOCALTIMESTAMP - %s::interval)
+        """
+        result = self.execute_query(query, (f"{last_days} days",), fetch=True)
+        return result[0]['total'] if result else 0
+
+    # ===== СЕКЦИИ ЖУРНАЛА ДЕЙСТВИЙ =====
+
+    def get_user_actions_partitions(self):
+        """Месячные секции журнала: [(имя, первый день месяца), ...] по возрастанию"""
+        query = """
+            SELECT c.relname AS name
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'user_actions'::regclass
+              AND c.relname ~ '^user_actions_[0-9]{6}$'
+            ORDER BY c.relname
+        """
+        partitions = []
+        for row in self.execute_query(query, fetch=True):
+            suffix = row['name'].rsplit('_', 1)[1]
+            partitions.append((row['name'], date(int(suffix[:4]), int(suffix[4:]), 1)))
+        return partitions
+
+    def ensure_user_actions_partitions(self, months_ahead: int = 2):
+        """Создаёт секции на текущий месяц и months_ahead месяцев вперёд"""
+        month = date.today().replace(day=1)
+        for _ in range(months_ahead + 1):
+            self.execute_query("SELECT create_user_actions_partition(%s)", (month,))
+            month = (month + timedelta(days=32)).replace(day=1)
+
+    def drop_old_user_actions_partitions(self, keep_months: int = 12):
+        """
+        Хранение журнала: удаляет секции старше keep_months полных месяцев
+        (DROP TABLE секции вместо DELETE по миллионам строк).
+        Возвращает имена удалённых секций.
+        """
+        cutoff = date.today().replace(day=1)
+        for _ in range(keep_months):
+            cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+
+        dropped = []
+        for name, month in self.get_user_actions_partitions():
+            if month < cutoff:
+                self.execute_query(f'DROP TABLE IF EXISTS "{name}"')
+                dropped.append(name)
+
+        # В секции по умолчанию остаются только случайные строки — чистим обычным DELETE
+        self.execute_query("DELETE FROM user_actions_default WHERE created_at < %s", (cutoff,))
+        # Почасовые сводки малы и хранятся дольше, пользователи по дням — вместе с журналом
+        self.execute_query("DELETE FROM user_actions_daily_users WHERE day < %s", (cutoff,))
+        return dropped
+
+    # ===== СВОДКИ АКТИВНОСТИ =====
+
+    def get_activity_summary(self, last_days: int = 7):
+        """
+        Активность пользователей за N дней (включая сегодня) по сводным таблицам:
+        - days: [{'day', 'actions', 'users'}] по убыванию даты
+        - actions: [{'action', 'actions', 'users'}] по убыванию количества
+        - peak_hours: [{'hour', 'actions'}] — самые нагруженные часы суток
+        - total_users: уникальных пользователей за весь период
+        """
+        since = date.today() - timedelta(days=last_days - 1)
+
+        days = self.execute_query(
+            """
+            SELECT d.day, d.actions, COALESCE(u.users, 0) AS users
+            FROM (
+                SELECT hour::date AS day, SUM(actions_count)::bigint AS actions
+                FROM user_actions_hourly
+                WHERE hour >= %s
+                GROUP BY 1
+            ) d
+            LEFT JOIN (
+                SELECT day, COUNT(DISTINCT telegram_id) AS users
+                FROM user_actions_daily_users
+                WHERE day >= %s
+                GROUP BY day
+            ) u ON u.day = d.day
+            ORDER BY d.day DESC
+            """,
+            (since, since), fetch=True
+        )
+
+        actions = self.execute_query(
+            """
+            SELECT a.action, a.actions, COALESCE(u.users, 0) AS users
+            FROM (
+                SELECT action, SUM(actions_count)::bigint AS actions
+                FROM user_actions_hourly
+                WHERE hour >= %s
+                GROUP BY action
+            ) a
+            LEFT JOIN (
+                SELECT action, COUNT(DISTINCT telegram_id) AS users
+                FROM user_actions_daily_users
+                WHERE day >= %s
+                GROUP BY action
+            ) u ON u.action = a.action
+            ORDER BY a.actions DESC
+            """,
+            (since, since), fetch=True
+        )
+
+        peak_hours = self.execute_query(
+            """
+            SELECT EXTRACT(HOUR FROM hour)::int AS hour, SUM(actions_count)::bigint AS actions
+            FROM user_actions_hourly
+            WHERE hour >= %s
+            GROUP BY 1
+            ORDER BY actions DESC
+            LIMIT 3
+            """,
+            (since,), fetch=True
+        )
+
+        total = self.execute_query(
+            """
+            SELECT COUNT(DISTINCT telegram_id) AS users
+            FROM user_actions_daily_users
+            WHERE day >= %s
+            """,
+            (since,), fetch=True
+        )
+
+        return {
+            'days': days,
+            'actions': actions,
+            'peak_hours': peak_hours,
+            'total_users': total[0]['users'] if total else 0,
+        }
+
     # ===== ИМПОРТ РАСПИСАНИЯ =====
 
+    # Справочники уникальны по norm_name(...) (см. schema.py): регистр, ё/е и
+    # лишние пробелы не порождают дублей. Существующая запись только читается,
+    # вставляются лишь недостающие (ON CONFLICT DO NOTHING) — поиск уже известного
+    # имени ничего не пишет и не меняет версию данных (data_versions).
+    # Основной SELECT не видит строку, вставленную параллельно после начала запроса,
+    # поэтому такие имена дочитываются отдельным запросом (_resolve_missing).
+
+    def _resolve_missing(self, result: dict, names, query):
+        """Дочитать id имён, которых нет в result (вставлены параллельным запросом)"""
+        missing = [name for name in dict.fromkeys(names) if name not in result]
+        if missing:
+            for row in self.execute_query(query, (missing,), fetch=True) or []:
+                result[row['name']] = row['id']
+        return result
+
     def get_or_create_subject(self, subject_name: str, subject_type: str = "lecture"):
-        """Получить или создать предмет"""
+        """Получить или создать предмет (один запрос)"""
         try:
-            # Ищем существующий предмет
-            query = "SELECT id FROM subjects WHERE name = %s LIMIT 1"
-            result = self.execute_query(query, (subject_name,), fetch=True)
-            
-            if result:
-                return result[0]['id']
-            
-            # Создаём новый предмет
-            insert_query = """
-                INSERT INTO subjects (name, subject_type)
-                VALUES (%s, %s)
-                RETURNING id
-            """
-            conn = self.connect()
-            cursor = conn.cursor()
-            try:
-                cursor.execute(insert_query, (subject_name, subject_type))
-                new_id = cursor.fetchone()[0]
-                conn.commit()
-                return new_id
-            finally:
-                cursor.close()
-                self.disconnect()
+            return self.get_or_create_subjects([(subject_name, subject_type)])[subject_name]
         except Exception as e:
             logger.error(f"Ошибка при создании предмета '{subject_name}': {e}")
             raise
 
     def get_or_create_teacher(self, teacher_fio: str):
-        """Получить или создать преподавателя"""
+        """Получить или создать преподавателя (один запрос)"""
         if not teacher_fio:
             return None
-            
+
         try:
-            # Ищем существующего преподавателя
-            query = "SELECT id FROM teachers WHERE fio = %s LIMIT 1"
-            result = self.execute_query(query, (teacher_fio,), fetch=True)
-            
-            if result:
-                return result[0]['id']
-            
-            # Создаём нового преподавателя
-            insert_query = "INSERT INTO teachers (fio) VALUES (%s) RETURNING id"
-            conn = self.connect()
-            cursor = conn.cursor()
-            try:
-                cursor.execute(insert_query, (teacher_fio,))
-                new_id = cursor.fetchone()[0]
-                conn.commit()
-                return new_id
-            finally:
-                cursor.close()
-                self.disconnect()
+            return self.get_or_create_teachers([teacher_fio])[teacher_fio]
         except Exception as e:
             logger.error(f"Ошибка при создании преподавателя '{teacher_fio}': {e}")
             raise
 
     def get_or_create_room(self, room_number: str):
-        """Получить или создать аудиторию"""
+        """
+        Получить или создать аудиторию (один запрос).
+        Номер ищется во всех корпусах; новая аудитория попадает в первый корпус,
+        а если корпусов нет — в созданный «Главный корпус».
+        """
         if not room_number:
             return None
-            
+
         try:
-            # Ищем существующую аудиторию
-            query = "SELECT id FROM rooms WHERE room_number = %s LIMIT 1"
-            result = self.execute_query(query, (room_number,), fetch=True)
-            
-            if result:
-                return result[0]['id']
-            
-            # Создаём новую аудиторию (по умолчанию здание 1)
-            insert_query = """
-                INSERT INTO rooms (room_number, building_id)
-                VALUES (%s, (SELECT id FROM buildings LIMIT 1))
-                RETURNING id
-            """
-            conn = self.connect()
-            cursor = conn.cursor()
-            try:
-                cursor.execute(insert_query, (room_number,))
-                result = cursor.fetchone()
-                if result:
-                    new_id = result[0]
-                    conn.commit()
-                    return new_id
-                else:
-                    # Если зданий нет, создаём здание
-                    cursor.execute("INSERT INTO buildings (name) VALUES ('Главный корпус') RETURNING id")
-                    building_id = cursor.fetchone()[0]
-                    cursor.execute(
-                        "INSERT INTO rooms (room_number, building_id) VALUES (%s, %s) RETURNING id",
-                        (room_number, building_id)
-                    )
-                    new_id = cursor.fetchone()[0]
-                    conn.commit()
-                    return new_id
-            finally:
-                cursor.close()
-                self.disconnect()
+            return self.get_or_create_rooms([room_number])[room_number]
         except Exception as e:
             logger.error(f"Ошибка при создании аудитории '{room_number}': {e}")
             raise
 
+    def get_or_create_subjects(self, subjects):
+        """
+        Пакетный вариант get_or_create_subject: subjects — пары (название, тип).
+        Возвращает {название как передано: id}; один запрос на весь список.
+        """
+        subjects = [(name, subject_type) for name, subject_type in subjects if name]
+        if not subjects:
+            return {}
+
+        names = [name for name, _ in subjects]
+        types = [subject_type for _, subject_type in subjects]
+        rows = self._execute_returning("""
+            WITH wanted AS (
+                SELECT DISTINCT ON (norm_name(t.name)) t.name, t.subject_type, norm_name(t.name) AS key
+                FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS t(name, subject_type, n)
+                ORDER BY norm_name(t.name), t.n
+            ), existing AS (
+                SELECT norm_name(name) AS key, id FROM subjects
+                WHERE norm_name(name) IN (SELECT key FROM wanted)
+            ), created AS (
+                INSERT INTO subjects (name, subject_type)
+                SELECT w.name, w.subject_type FROM wanted w
+                WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.key = w.key)
+                ON CONFLICT ((norm_name(name))) DO NOTHING
+                RETURNING id, norm_name(name) AS key
+            ), resolved AS (
+                SELECT key, id FROM existing
+                UNION ALL
+                SELECT key, id FROM created
+            )
+            SELECT t.name, r.id
+            FROM unnest(%s::text[]) AS t(name)
+            JOIN resolved r ON r.key = norm_name(t.name)
+        """, (names, types, names), )
+        return self._resolve_missing({row['name']: row['id'] for row in rows}, names, """
+            SELECT t.name, s.id
+            FROM unnest(%s::text[]) AS t(name)
+            JOIN subjects s ON norm_name(s.name) = norm_name(t.name)
+        """)
+
+    def get_or_create_teachers(self, teacher_fios):
+        """Пакетный вариант get_or_create_teacher: {ФИО как передано: id}"""
+        fios = [fio for fio in teacher_fios if fio]
+        if not fios:
+            return {}
+
+        rows = self._execute_returning("""
+            WITH wanted AS (
+                SELECT DISTINCT ON (norm_name(t.fio)) t.fio, norm_name(t.fio) AS key
+                FROM unnest(%s::text[]) WITH ORDINALITY AS t(fio, n)
+                ORDER BY norm_name(t.fio), t.n
+            ), existing AS (
+                SELECT norm_name(fio) AS key, id FROM teachers
+                WHERE norm_name(fio) IN (SELECT key FROM wanted)
+            ), created AS (
+                INSERT INTO teachers (fio)
+                SELECT w.fio FROM wanted w
+                WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.key = w.key)
+                ON CONFLICT ((norm_name(fio))) DO NOTHING
+                RETURNING id, norm_name(fio) AS key
+            ), resolved AS (
+                SELECT key, id FROM existing
+                UNION ALL
+                SELECT key, id FROM created
+            )
+            SELECT t.fio AS name, r.id
+            FROM unnest(%s::text[]) AS t(fio)
+            JOIN resolved r ON r.key = norm_name(t.fio)
+        """, (fios, fios), )
+        return self._resolve_missing({row['name']: row['id'] for row in rows}, fios, """
+            SELECT t.fio AS name, s.id
+            FROM unnest(%s::text[]) AS t(fio)
+            JOIN teachers s ON norm_name(s.fio) = norm_name(t.fio)
+        """)
+
+    def get_or_create_rooms(self, room_numbers):
+        """
+        Пакетный вариант get_or_create_room: {номер как передан: id}.
+        Существующие номера берутся из любого корпуса, новые создаются в первом.
+        """
+        numbers = [number for number in room_numbers if number]
+        if not numbers:
+            return {}
+
+        conn = self.connect()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("""
+                INSERT INTO buildings (name)
+                SELECT 'Главный корпус'
+                WHERE NOT EXISTS (SELECT 1 FROM buildings)
+                  AND EXISTS (
+                      SELECT 1 FROM unnest(%s::text[]) AS t(room_number)
+                      WHERE NOT EXISTS (
+                          SELECT 1 FROM rooms r WHERE norm_name(r.room_number) = norm_name(t.room_number)
+                      )
+                  )
+            """, (numbers,))
+            cursor.execute("""
+                WITH wanted AS (
+                    SELECT DISTINCT ON (norm_name(t.room_number)) t.room_number, norm_name(t.room_number) AS key
+                    FROM unnest(%(numbers)s::text[]) WITH ORDINALITY AS t(room_number, n)
+                    ORDER BY norm_name(t.room_number), t.n
+                ), existing AS (
+                    SELECT norm_name(room_number) AS key, MIN(id) AS id
+                    FROM rooms
+                    WHERE norm_name(room_number) IN (SELECT key FROM wanted)
+                    GROUP BY 1
+                ), created AS (
+                    INSERT INTO rooms (room_number, building_id)
+                    SELECT w.room_number, (SELECT MIN(id) FROM buildings)
+                    FROM wanted w
+                    WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.key = w.key)
+                    ON CONFLICT (building_id, (norm_name(room_number))) DO NOTHING
+                    RETURNING id, norm_name(room_number) AS key
+                ), resolved AS (
+                    SELECT key, id FROM existing
+                    UNION ALL
+                    SELECT key, id FROM created
+                )
+                SELECT t.room_number AS name, r.id
+                FROM unnest(%(numbers)s::text[]) AS t(room_number)
+                JOIN resolved r ON r.key = norm_name(t.room_number)
+            """, {'numbers': numbers})
+            result = {row['name']: row['id'] for row in cursor.fetchall()}
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при создании аудиторий: {e}")
+            raise
+        finally:
+            cursor.close()
+            self.disconnect()
+
+        return self._resolve_missing(result, numbers, """
+            SELECT t.room_number AS name, MIN(r.id) AS id
+            FROM unnest(%s::text[]) AS t(room_number)
+            JOIN rooms r ON norm_name(r.room_number) = norm_name(t.room_number)
+            GROUP BY t.room_number
+        """)
+
     def add_schedule_from_import(self, group_number: str, lesson_date: str, lesson_number: int,
                                 start_time: str, end_time: str, subject_name: str,
                                 subject_type: str = "lecture", teacher_fio: str = None,
@@ -570,45 +1135,31 @@ class DatabaseManager:
             if room_number:
                 room_id = self.get_or_create_room(room_number)
             
-            # Получаем время пары
-            lesson_times = self.execute_query(
-                "SELECT id FROM lesson_times WHERE lesson_number = %s",
-                (lesson_number,), fetch=True
-            )
-            
-            if not lesson_times:
-                raise ValueError(f"Пара номер {lesson_number} не найдена")
-            
-            lesson_time_id = lesson_times[0]['id']
-            
-            # Проверяем, нет ли уже такой записи
-            existing = self.execute_query("""
-                SELECT id FROM schedule 
-                WHERE group_id = %s AND lesson_date = %s 
-                AND lesson_time_id = %s
-            """, (group_id, lesson_date, lesson_time_id), fetch=True)
-            
-            if existing:
-                # Обновляем существующую запись
-                update_query = """
-                    UPDATE schedule
-                    SET subject_id = %s, teacher_id = %s, room_id = %s
-                    WHERE id = %s
-                """
-                self.execute_query(
-                    update_query,
-                    (subject_id, teacher_id, room_id, existing[0]['id'])
-                )
-            else:
-                # Создаём новую запись
-                insert_query = """
+            # Время пары подставляется прямо в INSERT; существующая пара группы
+            # обновляется через уникальный индекс (group_id, lesson_date, lesson_time_id)
+            conn = self.connect()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
                     INSERT INTO schedule (group_id, lesson_date, lesson_time_id, subject_id, teacher_id, room_id)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """
-                self.execute_query(
-                    insert_query,
-                    (group_id, lesson_date, lesson_time_id, subject_id, teacher_id, room_id)
-                )
+                    SELECT %s, %s, lt.id, %s, %s, %s
+                    FROM lesson_times lt
+                    WHERE lt.lesson_number = %s
+                    ON CONFLICT (group_id, lesson_date, lesson_time_id)
+                    DO UPDATE SET subject_id = EXCLUDED.subject_id,
+                                  teacher_id = EXCLUDED.teacher_id,
+                                  room_id = EXCLUDED.room_id
+                """, (group_id, lesson_date, subject_id, teacher_id, room_id, lesson_number))
+
+                if cursor.rowcount == 0:
+                    raise ValueError(f"Пара номер {lesson_number} не найдена")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                self.disconnect()
             
             logger.info(f"Добавлено расписание: {group_number} {lesson_date} пара {lesson_number}")
             
@@ -616,6 +1167,512 @@ class DatabaseManager:
             logger.error(f"Ошибка при добавлении расписания: {e}")
             raise
 
+    def _stage_import(self, cursor, records, check_cancel):
+        """
+        Общая часть пакетного импорта и сравнения (в транзакции cursor):
+        COPY строк в import_staging, ошибки по группам/парам (такие строки удаляются
+        из import_staging, чтобы по ним не создавались справочники), создание недостающих
+        справочников и временная таблица import_resolved (group_id, lesson_date,
+        lesson_time_id, subject_id, teacher_id, room_id) — по одной строке на пару группы.
+        Возвращает (ошибки, число строк import_resolved).
+        """
+        cursor.execute("""
+            CREATE TEMP TABLE import_staging (
+                row_num INTEGER,
+                group_number TEXT,
+                lesson_date DATE,
+                lesson_number INTEGER,
+                start_time TEXT,
+                end_time TEXT,
+                subject_name TEXT,
+                subject_type TEXT,
+                teacher_fio TEXT,
+                room_number TEXT
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(
+            """
+            COPY import_staging (row_num, group_number, lesson_date, lesson_number, start_time,
+                                 end_time, subject_name, subject_type, teacher_fio, room_number)
+            FROM STDIN WITH (FORMAT csv)
+            """,
+            _CopyStream(
+                (r['row_num'], r['group'], r['date'], r['lesson_number'], r['start_time'],
+                 r['end_time'], r['subject'], r['subject_type'], r['teacher'], r['room'])
+                for r in records
+            )
+        )
+        check_cancel()
+        cursor.execute("ANALYZE import_staging")
+
+        # Строки с несуществующей группой или номером пары — в ошибки и из staging:
+        # предметы, преподаватели и аудитории создаются только по импортируемым строкам
+        cursor.execute("""
+            DELETE FROM import_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM student_groups g WHERE g.group_number = s.group_number)
+               OR NOT EXISTS (SELECT 1 FROM lesson_times lt WHERE lt.lesson_number = s.lesson_number)
+            RETURNING s.row_num, s.group_number, s.lesson_number,
+                      NOT EXISTS (SELECT 1 FROM student_groups g WHERE g.group_number = s.group_number)
+        """)
+        errors = []
+        for row_num, group_number, lesson_number, no_group in sorted(cursor.fetchall()):
+            if no_group:
+                errors.append(f"Строка {row_num}: Группа '{group_number}' не найдена")
+            else:
+                errors.append(f"Строка {row_num}: Пара номер {lesson_number} не найдена")
+
+        # Недостающие справочники — одним запросом на каждый;
+        # совпадение ищется по нормализованному имени (norm_name)
+        cursor.execute("""
+            INSERT INTO subjects (name, subject_type)
+            SELECT DISTINCT ON (norm_name(s.subject_name)) s.subject_name, s.subject_type
+            FROM (
+                SELECT DISTINCT ON (subject_name) subject_name, subject_type, row_num
+                FROM import_staging
+                ORDER BY subject_name, row_num
+            ) s
+            ORDER BY norm_name(s.subject_name), s.row_num
+            ON CONFLICT ((norm_name(name))) DO NOTHING
+        """)
+        cursor.execute("""
+            INSERT INTO teachers (fio)
+            SELECT DISTINCT ON (norm_name(s.teacher_fio)) s.teacher_fio
+            FROM (SELECT DISTINCT teacher_fio FROM import_staging WHERE teacher_fio IS NOT NULL) s
+            ORDER BY norm_name(s.teacher_fio), s.teacher_fio
+            ON CONFLICT ((norm_name(fio))) DO NOTHING
+        """)
+        cursor.execute("""
+            INSERT INTO buildings (name)
+            SELECT 'Главный корпус'
+            WHERE NOT EXISTS (SELECT 1 FROM buildings)
+              AND EXISTS (SELECT 1 FROM import_staging WHERE room_number IS NOT NULL)
+        """)
+        cursor.execute("""
+            INSERT INTO rooms (room_number, building_id)
+            SELECT DISTINCT ON (norm_name(s.room_number)) s.room_number, (SELECT MIN(id) FROM buildings)
+            FROM (SELECT DISTINCT room_number FROM import_staging WHERE room_number IS NOT NULL) s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM rooms r WHERE norm_name(r.room_number) = norm_name(s.room_number)
+            )
+            ORDER BY norm_name(s.room_number), s.room_number
+            ON CONFLICT (building_id, (norm_name(room_number))) DO NOTHING
+        """)
+
+        check_cancel()
+        # Сопоставление строк с id; при повторе пары в файле берём последнюю строку.
+        # norm_name считается только для различающихся имён (их единицы тысяч),
+        # строки файла соединяются с ними по имени как есть.
+        # Номер аудитории может повторяться в разных корпусах — берём первую
+        cursor.execute("""
+            CREATE TEMP TABLE import_resolved ON COMMIT DROP AS
+            WITH subject_ids AS (
+                SELECT d.subject_name, sub.id
+                FROM (SELECT DISTINCT subject_name FROM import_staging) d
+                JOIN subjects sub ON norm_name(sub.name) = norm_name(d.subject_name)
+            ), teacher_ids AS (
+                SELECT d.teacher_fio, t.id
+                FROM (SELECT DISTINCT teacher_fio FROM import_staging) d
+                JOIN teachers t ON norm_name(t.fio) = norm_name(d.teacher_fio)
+            ), room_ids AS (
+                SELECT d.room_number, MIN(r.id) AS id
+                FROM (SELECT DISTINCT room_number FROM import_staging) d
+                JOIN rooms r ON norm_name(r.room_number) = norm_name(d.room_number)
+                GROUP BY d.room_number
+            )
+            SELECT DISTINCT ON (g.id, s.lesson_date, lt.id)
+                   g.id AS group_id, s.lesson_date, lt.id AS lesson_time_id,
+                   sub.id AS subject_id, t.id AS teacher_id, r.id AS room_id
+            FROM import_staging s
+            JOIN student_groups g ON g.group_number = s.group_number
+            JOIN lesson_times lt ON lt.lesson_number = s.lesson_number
+            JOIN subject_ids sub ON sub.subject_name = s.subject_name
+            LEFT JOIN teacher_ids t ON t.teacher_fio = s.teacher_fio
+            LEFT JOIN room_ids r ON r.room_number = s.room_number
+            ORDER BY g.id, s.lesson_date, lt.id, s.row_num DESC
+        """)
+        return errors, cursor.rowcount
+
+    def _import_checksums(self, cursor):
+        """
+        Временная таблица import_checksums: для каждой группы из import_resolved —
+        период и MD5 её пар (по id справочников, в порядке даты и пары)
+        """
+        cursor.execute("""
+            CREATE TEMP TABLE import_checksums ON COMMIT DROP AS
+            SELECT group_id,
+                   MIN(lesson_date) AS date_from,
+                   MAX(lesson_date) AS date_to,
+                   md5(string_agg(concat_ws(',', lesson_date, lesson_time_id, subject_id, teacher_id, room_id),
+                                  ';' ORDER BY lesson_date, lesson_time_id)) AS checksum
+            FROM import_resolved
+            GROUP BY group_id
+        """)
+
+    def _record_import_ledger(self, cursor, ledger: dict, rows: int):
+        """
+        Запись файла в журнал импорта и контрольных сумм его групп.
+        Выполняется после изменения расписания: триггер на schedule к этому
+        моменту уже удалил прежние суммы затронутых групп.
+        ledger — {'file_sha256', 'file_name', 'admin_telegram_id', 'job_id'}.
+        """
+        cursor.execute("""
+            INSERT INTO import_ledger (file_sha256, file_name, admin_telegram_id, job_id, rows_count, groups_count)
+            SELECT %s, %s, %s, %s, %s, COUNT(*) FROM import_checksums
+            RETURNING id
+        """, (ledger['file_sha256'], ledger.get('file_name'), ledger.get('admin_telegram_id'),
+              ledger.get('job_id'), rows))
+        ledger_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO import_group_checksums (group_id, ledger_id, date_from, date_to, checksum)
+            SELECT group_id, %s, date_from, date_to, checksum FROM import_checksums
+            ON CONFLICT (group_id) DO UPDATE SET ledger_id = EXCLUDED.ledger_id,
+                                                 date_from = EXCLUDED.date_from,
+                                                 date_to = EXCLUDED.date_to,
+                                                 checksum = EXCLUDED.checksum
+        """, (ledger_id,))
+        return ledger_id
+
+    def bulk_import_schedule(self, records, cancel=None, ledger=None, skip_unchanged=False):
+        """
+        Пакетный импорт расписания одной транзакцией.
+        records — итерируемый набор словарей (как в import_schedule_from_file):
+        row_num, group, date (date), lesson_number, start_time, end_time,
+        subject, subject_type, teacher, room.
+
+        Строки загружаются COPY во временную таблицу, недостающие предметы,
+        преподаватели и аудитории создаются одним INSERT на каждый справочник,
+        затем расписание обновляется/дополняется одним INSERT ... ON CONFLICT.
+        Повтор одной и той же пары группы в файле — побеждает последняя строка.
+
+        cancel — необязательный threading.Event: если он установлен, импорт
+        прерывается между этапами с ImportCancelled и ничего не сохраняется
+        (чтение records прерывается самим источником строк).
+        ledger — данные файла для журнала импорта (см. _record_import_ledger);
+        skip_unchanged=True — группы, чьи пары совпадают с последним импортом
+        и с тех пор не менялись (та же контрольная сумма), не записываются.
+
+        Возвращает {'rows', 'inserted', 'updated', 'duplicates', 'skipped_groups',
+        'skipped_rows', 'errors': [...]}, где rows — сколько строк загружено во временную таблицу.
+        """
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise ImportCancelled("Импорт отменён")
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            errors, resolved = self._stage_import(cursor, records, check_cancel)
+
+            skipped_groups = skipped_rows = 0
+            if ledger or skip_unchanged:
+                self._import_checksums(cursor)
+            if skip_unchanged:
+                cursor.execute("""
+                    WITH unchanged AS (
+                        SELECT c.group_id
+                        FROM import_checksums c
+                        JOIN import_group_checksums g ON g.group_id = c.group_id
+                        WHERE g.checksum = c.checksum
+                          AND g.date_from = c.date_from
+                          AND g.date_to = c.date_to
+                    ), skipped AS (
+                        DELETE FROM import_resolved r
+                        USING unchanged u
+                        WHERE r.group_id = u.group_id
+                        RETURNING 1
+                    )
+                    SELECT (SELECT COUNT(*) FROM unchanged), (SELECT COUNT(*) FROM skipped)
+                """)
+                skipped_groups, skipped_rows = cursor.fetchone()
+                resolved -= skipped_rows
+
+            # Вставка новых пар и обновление существующих одним запросом;
+            # xmax = 0 у только что вставленной строки
+            cursor.execute("""
+                WITH upserted AS (
+                    INSERT INTO schedule (group_id, lesson_date, lesson_time_id, subject_id, teacher_id, room_id)
+                    SELECT r.group_id, r.lesson_date, r.lesson_time_id, r.subject_id, r.teacher_id, r.room_id
+                    FROM import_resolved r
+                    ON CONFLICT (group_id, lesson_date, lesson_time_id)
+                    DO UPDATE SET subject_id = EXCLUDED.subject_id,
+                                  teacher_id = EXCLUDED.teacher_id,
+                                  room_id = EXCLUDED.room_id
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT COUNT(*) FILTER (WHERE inserted) FROM upserted
+            """)
+            inserted = cursor.fetchone()[0]
+
+            cursor.execute("SELECT COUNT(*) FROM import_staging")
+            total = cursor.fetchone()[0] + len(errors)   # строки с ошибками уже удалены из staging
+            if ledger:
+                self._record_import_ledger(cursor, ledger, total)
+
+            check_cancel()
+            conn.commit()
+            logger.info(f"Пакетный импорт: добавлено {inserted}, обновлено {resolved - inserted}, "
+                        f"без изменений групп {skipped_groups}, ошибок {len(errors)}")
+            return {
+                'rows': total,
+                'inserted': inserted,
+                'updated': resolved - inserted,
+                'duplicates': total - len(errors) - resolved - skipped_rows,
+                'skipped_groups': skipped_groups,
+                'skipped_rows': skipped_rows,
+                'errors': errors,
+            }
+        except ImportCancelled:
+            conn.rollback()
+            logger.info("Пакетный импорт отменён, изменения откатены")
+            raise
+        except Exception as e:
+            conn.rollback()
+            if cancel is not None and cancel.is_set():
+                # Отмена во время COPY приходит от psycopg2 как ошибка чтения источника
+                logger.info("Пакетный импорт отменён, изменения откатены")
+                raise ImportCancelled("Импорт отменён") from e
+            logger.error(f"Ошибка пакетного импорта расписания: {e}")
+            raise
+        finally:
+            cursor.close()
+            self.disconnect()
+
+    def diff_import_schedule(self, records, apply: bool = False, cancel=None, ledger=None):
+        """
+        Сравнение файла импорта с текущим расписанием (и применение только разницы).
+        Область сравнения — группы из файла, для каждой — период от первой до последней
+        даты этой группы в файле. Пары из файла, которых нет в расписании, — вставки;
+        совпадающие по (группа, дата, пара), но с другим предметом/преподавателем/
+        аудиторией — изменения; пары расписания в этой области, которых нет в файле, — удаления.
+
+        apply=False — предпросмотр: транзакция откатывается целиком (в том числе
+        созданные справочники). apply=True — выполняются только DELETE/UPDATE/INSERT разницы.
+        cancel и ledger — как в bulk_import_schedule (журнал пишется только при apply=True).
+
+        Возвращает {'rows', 'inserts', 'updates', 'deletes', 'unchanged', 'duplicates',
+        'date_from', 'date_to', 'groups': [{'group_number', 'inserts', 'updates', 'deletes'}],
+        'applied', 'errors'}; groups — только группы с изменениями.
+        """
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise ImportCancelled("Импорт отменён")
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        try:
+            errors, resolved = self._stage_import(cursor, records, check_cancel)
+            check_cancel()
+
+            cursor.execute("""
+                CREATE TEMP TABLE import_diff ON COMMIT DROP AS
+                WITH scope AS (
+                    SELECT group_id, MIN(lesson_date) AS date_from, MAX(lesson_date) AS date_to
+                    FROM import_resolved
+                    GROUP BY group_id
+                ), current AS (
+                    SELECT s.id, s.group_id, s.lesson_date, s.lesson_time_id,
+                           s.subject_id, s.teacher_id, s.room_id
+                    FROM schedule s
+                    JOIN scope sc ON sc.group_id = s.group_id
+                                 AND s.lesson_date BETWEEN sc.date_from AND sc.date_to
+                )
+                SELECT COALESCE(r.group_id, c.group_id) AS group_id,
+                       c.id AS schedule_id,
+                       r.lesson_date, r.lesson_time_id, r.subject_id, r.teacher_id, r.room_id,
+                       CASE
+                           WHEN c.id IS NULL THEN 'insert'
+                           WHEN r.group_id IS NULL THEN 'delete'
+                           WHEN (r.subject_id, r.teacher_id, r.room_id)
+                                IS DISTINCT FROM (c.subject_id, c.teacher_id, c.room_id) THEN 'update'
+                           ELSE 'same'
+                       END AS change
+                FROM import_resolved r
+                FULL JOIN current c
+                    ON c.group_id = r.group_id
+                   AND c.lesson_date = r.lesson_date
+                   AND c.lesson_time_id = r.lesson_time_id
+            """)
+
+            cursor.execute("""
+                SELECT COUNT(*) FILTER (WHERE change = 'insert'),
+                       COUNT(*) FILTER (WHERE change = 'update'),
+                       COUNT(*) FILTER (WHERE change = 'delete'),
+                       COUNT(*) FILTER (WHERE change = 'same'),
+                       (SELECT MIN(lesson_date) FROM import_resolved),
+                       (SELECT MAX(lesson_date) FROM import_resolved)
+                FROM import_diff
+            """)
+            inserts, updates, deletes, unchanged, date_from, date_to = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT g.group_number,
+                       COUNT(*) FILTER (WHERE d.change = 'insert') AS inserts,
+                       COUNT(*) FILTER (WHERE d.change = 'update') AS updates,
+                       COUNT(*) FILTER (WHERE d.change = 'delete') AS deletes
+                FROM import_diff d
+                JOIN student_groups g ON g.id = d.group_id
+                WHERE d.change <> 'same'
+                GROUP BY g.group_number
+                ORDER BY COUNT(*) DESC, g.group_number
+            """)
+            groups = [
+                {'group_number': group_number, 'inserts': ins, 'updates': upd, 'deletes': dels}
+                for group_number, ins, upd, dels in cursor.fetchall()
+            ]
+
+            cursor.execute("SELECT COUNT(*) FROM import_staging")
+            total = cursor.fetchone()[0] + len(errors)   # строки с ошибками уже удалены из staging
+
+            if apply:
+                # Только разница: неизменные пары не трогаются вовсе
+                cursor.execute("""
+                    DELETE FROM schedule s
+                    USING import_diff d
+                    WHERE d.change = 'delete' AND s.id = d.schedule_id
+                """)
+                cursor.execute("""
+                    UPDATE schedule s
+                    SET subject_id = d.subject_id, teacher_id = d.teacher_id, room_id = d.room_id
+                    FROM import_diff d
+                    WHERE d.change = 'update' AND s.id = d.schedule_id
+                """)
+                cursor.execute("""
+                    INSERT INTO schedule (group_id, lesson_date, lesson_time_id, subject_id, teacher_id, room_id)
+                    SELECT group_id, lesson_date, lesson_time_id, subject_id, teacher_id, room_id
+                    FROM import_diff
+                    WHERE change = 'insert'
+                    ON CONFLICT (group_id, lesson_date, lesson_time_id)
+                    DO UPDATE SET subject_id = EXCLUDED.subject_id,
+                                  teacher_id = EXCLUDED.teacher_id,
+                                  room_id = EXCLUDED.room_id
+                """)
+                if ledger:
+                    self._import_checksums(cursor)
+                    self._record_import_ledger(cursor, ledger, total)
+                check_cancel()
+                conn.commit()
+                logger.info(f"Импорт разницы: +{inserts}, изменено {updates}, удалено {deletes}")
+            else:
+                conn.rollback()
+
+            return {
+                'rows': total,
+                'inserts': inserts,
+                'updates': updates,
+                'deletes': deletes,
+                'unchanged': unchanged,
+                'duplicates': total - len(errors) - resolved,
+                'date_from': date_from,
+                'date_to': date_to,
+                'groups': groups,
+                'applied': apply,
+                'errors': errors,
+            }
+        except ImportCancelled:
+            conn.rollback()
+            logger.info("Сравнение импорта отменено, изменения откатены")
+            raise
+        except Exception as e:
+            conn.rollback()
+            if cancel is not None and cancel.is_set():
+                logger.info("Сравнение импорта отменено, изменения откатены")
+                raise ImportCancelled("Импорт отменён") from e
+            logger.error(f"Ошибка сравнения импорта расписания: {e}")
+            raise
+        finally:
+            cursor.close()
+            self.disconnect()
+
+    # ===== ФОНОВЫЕ ЗАДАЧИ ИМПОРТА =====
+
+    IMPORT_JOB_FIELDS = (
+        'status_message_id', 'status', 'rows_total', 'rows_processed', 'inserted',
+        'updated', 'errors_count', 'message', 'started_at', 'finished_at',
+    )
+
+    def create_import_job(self, admin_telegram_id: int, chat_id: int, file_name: str, file_path: str,
+                          mode: str = "import", file_sha256: str = None):
+        """Новая задача импорта в статусе queued; возвращает её id"""
+        result = self._execute_returning("""
+            INSERT INTO import_jobs (admin_telegram_id, chat_id, file_name, file_path, mode, file_sha256)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (admin_telegram_id, chat_id, file_name, file_path, mode, file_sha256))
+        return result[0]['id']
+
+    def update_import_job(self, job_id: int, **fields):
+        """Обновление полей задачи импорта (только из IMPORT_JOB_FIELDS)"""
+        fields = {k: v for k, v in fields.items() if k in self.IMPORT_JOB_FIELDS}
+        if not fields:
+            return 0
+        assignments = ", ".join(f"{name} = %({name})s" for name in fields)
+        return self.execute_query(
+            f"UPDATE import_jobs SET {assignments} WHERE id = %(job_id)s",
+            {**fields, 'job_id': job_id}
+        )
+
+    def get_import_job(self, job_id: int):
+        result = self.execute_query("SELECT * FROM import_jobs WHERE id = %s", (job_id,), fetch=True)
+        return result[0] if result else None
+
+    def close_import_preview(self, job_id: int, status: str):
+        """
+        Решение по предпросмотру (status: applied / discarded). Срабатывает один раз:
+        повторное нажатие кнопки вернёт None. Возвращает file_path, file_name и file_sha256 задачи.
+        """
+        result = self._execute_returning("""
+            UPDATE import_jobs
+            SET status = %s, finished_at = NOW()
+            WHERE id = %s AND status = 'previewed'
+            RETURNING file_path, file_name, file_sha256
+        """, (status, job_id))
+        return result[0] if result else None
+
+    def expire_import_previews(self, ttl_seconds: int):
+        """
+        Предпросмотры, ждущие решения дольше ttl_seconds, помечаются discarded.
+        Возвращает эти задачи, чтобы удалить их файлы и убрать кнопки.
+        """
+        return self._execute_returning("""
+            UPDATE import_jobs
+            SET status = 'discarded', message = 'Предпросмотр устарел', finished_at = NOW()
+            WHERE status = 'previewed' AND finished_at < NOW() - make_interval(secs => %s)
+            RETURNING id, chat_id, status_message_id, file_path
+        """, (ttl_seconds,))
+
+    def find_imported_file(self, file_sha256: str):
+        """
+        Последний импорт файла с тем же содержимым, после которого расписание
+        его групп не менялось (все контрольные суммы групп этого импорта на месте).
+        Возвращает {'file_name', 'imported_at', 'admin_telegram_id', 'admin_name', 'rows_count'} или None.
+        """
+        result = self.execute_query("""
+            SELECT l.file_name, l.imported_at, l.admin_telegram_id, l.rows_count,
+                   COALESCE(u.fio, u.username) AS admin_name
+            FROM import_ledger l
+            LEFT JOIN users u ON u.telegram_id = l.admin_telegram_id
+            WHERE l.file_sha256 = %s
+              AND l.groups_count > 0
+              AND l.groups_count = (SELECT COUNT(*) FROM import_group_checksums c WHERE c.ledger_id = l.id)
+            ORDER BY l.imported_at DESC
+            LIMIT 1
+        """, (file_sha256,), fetch=True)
+        return result[0] if result else None
+
+    def fail_interrupted_import_jobs(self):
+        """
+        Задачи, оставшиеся в queued/running после перезапуска бота, помечаются failed
+        (их транзакция уже откатилась вместе с соединением). Возвращает эти задачи.
+        """
+        return self._execute_returning("""
+            UPDATE import_jobs
+            SET status = 'failed', message = 'Импорт прерван перезапуском бота', finished_at = NOW()
+            WHERE status IN ('queued', 'running')
+            RETURNING id, chat_id, status_message_id, file_path
+        """)
+
     def delete_schedule_for_group(self, group_number: str, date_from: str = None, date_to: str = None):
         """Удалить расписание группы за период (или всё)"""
         try:
@@ -688,6 +1745,39 @@ class DatabaseManager:
         """
         return self.execute_query(query, (room_id, date_from, date_to), fetch=True)
 
+    # Колонка расписания, по которой выбираются пары для календаря
+    CALENDAR_FILTERS = {
+        'group': 's.group_id',
+        'teacher': 's.teacher_id',
+        'room': 's.room_id',
+    }
+
+    def get_calendar_lessons(self, kind, entity_id, date_from, date_to):
+        """Пары группы, преподавателя или аудитории за период — все поля для выгрузки ICS"""
+        query = f"""
+            SELECT 
+                s.lesson_date,
+                lt.lesson_number,
+                lt.start_time,
+                lt.end_time,
+                sg.group_number,
+                sub.name as subject_name,
+                sub.subject_type,
+                t.fio as teacher_fio,
+                b.name as building_name,
+                r.room_number
+            FROM schedule s
+            JOIN lesson_times lt ON s.lesson_time_id = lt.id
+            JOIN student_groups sg ON s.group_id = sg.id
+            JOIN subjects sub ON s.subject_id = sub.id
+            LEFT JOIN teachers t ON s.teacher_id = t.id
+            LEFT JOIN rooms r ON s.room_id = r.id
+            LEFT JOIN buildings b ON r.building_id = b.id
+            WHERE {self.CALENDAR_FILTERS[kind]} = %s AND s.lesson_date BETWEEN %s AND %s
+            ORDER BY s.lesson_date, lt.lesson_number, sg.group_number
+        """
+        return self.execute_query(query, (entity_id, date_from, date_to), fetch=True)
+
     def get_schedule_stats(self):
         """Получить статистику по расписанию в БД"""
         stats = {}
@@ -109,6 +109,130 @@ CREATE TABLE IF NOT EXISTS user_actions_log (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Журнал действий пользователей в боте (пишется пачками фоновой задачей).
+-- Секционирован по месяцам: user_actions_YYYYMM; старые месяцы удаляются целиком.
+-- Таблица из предыдущей версии (без секций) переименовывается и переносится ниже.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'user_actions' AND relkind = 'r') THEN
+        ALTER TABLE user_actions RENAME TO user_actions_unpartitioned;
+        ALTER INDEX IF EXISTS idx_user_actions_created_at RENAME TO idx_user_actions_unpartitioned_created_at;
+        ALTER TABLE user_actions_unpartitioned RENAME CONSTRAINT user_actions_pkey TO user_actions_unpartitioned_pkey;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS user_actions (
+    id BIGSERIAL,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    telegram_id BIGINT NOT NULL,
+    username VARCHAR(255),
+    action VARCHAR(100) NOT NULL,
+    details TEXT,
+    sample_rate REAL NOT NULL DEFAULT 1, -- доля записанных действий этого типа (политика выборки)
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE user_actions ADD COLUMN IF NOT EXISTS sample_rate REAL NOT NULL DEFAULT 1;
+
+-- Строки вне созданных месяцев (например, с неверной датой) не теряются
+CREATE TABLE IF NOT EXISTS user_actions_default PARTITION OF user_actions DEFAULT;
+
+-- Секция за месяц, содержащий p_month. Если подходящие строки уже попали
+-- в секцию по умолчанию, они переносятся в новую секцию.
+CREATE OR REPLACE FUNCTION create_user_actions_partition(p_month DATE) RETURNS VOID AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_month)::date;
+    month_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'user_actions_' || to_char(p_month, 'YYYYMM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM user_actions_default
+               WHERE created_at >= month_start AND created_at < month_end) THEN
+        CREATE TEMP TABLE user_actions_moving (LIKE user_actions) ON COMMIT DROP;
+        WITH moved AS (
+            DELETE FROM user_actions_default
+            WHERE created_at >= month_start AND created_at < month_end
+            RETURNING *
+        )
+        INSERT INTO user_actions_moving SELECT * FROM moved;
+
+        EXECUTE format('CREATE TABLE %I PARTITION OF user_actions FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, month_start, month_end);
+        INSERT INTO user_actions SELECT * FROM user_actions_moving;
+        DROP TABLE user_actions_moving;
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF user_actions FOR VALUES FROM (%L) TO (%L)',
+                       partition_name, month_start, month_end);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос журнала из таблицы без секций
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF to_regclass('user_actions_unpartitioned') IS NOT NULL THEN
+        FOR month IN
+            SELECT DISTINCT date_trunc('month', created_at)::date
+            FROM user_actions_unpartitioned
+            WHERE created_at IS NOT NULL
+        LOOP
+            PERFORM create_user_actions_partition(month);
+        END LOOP;
+
+        INSERT INTO user_actions (id, user_id, telegram_id, username, action, details, created_at)
+        SELECT id, user_id, telegram_id, username, action, details, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM user_actions_unpartitioned;
+        PERFORM setval(pg_get_serial_sequence('user_actions', 'id'),
+                       GREATEST((SELECT MAX(id) FROM user_actions), 1));
+        DROP TABLE user_actions_unpartitioned;
+    END IF;
+END $$;
+
+-- Сводки журнала действий: обновляются той же транзакцией, что и пакетная запись.
+-- Количество действий по часам и уникальные пользователи по дням.
+CREATE TABLE IF NOT EXISTS user_actions_hourly (
+    hour TIMESTAMP NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    actions_count BIGINT NOT NULL DEFAULT 0, -- все действия, включая не попавшие в журнал
+    logged_count BIGINT NOT NULL DEFAULT 0,  -- из них записано строк в user_actions
+    PRIMARY KEY (hour, action)
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'user_actions_hourly' AND column_name = 'logged_count') THEN
+        ALTER TABLE user_actions_hourly ADD COLUMN logged_count BIGINT NOT NULL DEFAULT 0;
+        UPDATE user_actions_hourly SET logged_count = actions_count;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS user_actions_daily_users (
+    day DATE NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    telegram_id BIGINT NOT NULL,
+    PRIMARY KEY (day, action, telegram_id)
+);
+
+-- Первичное заполнение сводок из уже накопленного журнала
+INSERT INTO user_actions_hourly (hour, action, actions_count, logged_count)
+SELECT date_trunc('hour', created_at), action, ROUND(SUM(1 / sample_rate)), COUNT(*)
+FROM user_actions
+WHERE NOT EXISTS (SELECT 1 FROM user_actions_hourly)
+GROUP BY 1, 2;
+
+INSERT INTO user_actions_daily_users (day, action, telegram_id)
+SELECT DISTINCT created_at::date, action, telegram_id
+FROM user_actions
+WHERE NOT EXISTS (SELECT 1 FROM user_actions_daily_users)
+ON CONFLICT DO NOTHING;
+
 -- Таблица настроек бота для пользователей
 CREATE TABLE IF NOT EXISTS user_settings (
     id SERIAL PRIMARY KEY,
@@ -122,12 +246,223 @@ CREATE TABLE IF NOT EXISTS user_settings (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Фоновые задачи импорта расписания.
+-- status: queued → running → done / failed / cancelled;
+-- для сравнения (mode = 'diff'): done → previewed → applied / discarded
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id SERIAL PRIMARY KEY,
+    admin_telegram_id BIGINT NOT NULL,
+    chat_id BIGINT,
+    status_message_id BIGINT,
+    file_name VARCHAR(255),
+    file_path TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    rows_total INTEGER,
+    rows_processed INTEGER DEFAULT 0,
+    inserted INTEGER DEFAULT 0,
+    updated INTEGER DEFAULT 0,
+    errors_count INTEGER DEFAULT 0,
+    message TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS mode VARCHAR(10) NOT NULL DEFAULT 'import';
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS file_sha256 CHAR(64);
+CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs(status) WHERE status IN ('queued', 'running');
+
+-- Журнал импортированных файлов: SHA-256 содержимого, кто и когда загрузил
+CREATE TABLE IF NOT EXISTS import_ledger (
+    id SERIAL PRIMARY KEY,
+    file_sha256 CHAR(64) NOT NULL,
+    file_name VARCHAR(255),
+    admin_telegram_id BIGINT,
+    job_id INTEGER REFERENCES import_jobs(id) ON DELETE SET NULL,
+    rows_count INTEGER DEFAULT 0,
+    groups_count INTEGER DEFAULT 0,
+    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_import_ledger_sha256 ON import_ledger(file_sha256, imported_at);
+
+-- Контрольная сумма пар каждой группы из последнего импорта (по id справочников).
+-- Запись удаляется триггером при любом изменении расписания группы,
+-- поэтому совпадение суммы значит, что пары группы с тех пор не менялись.
+CREATE TABLE IF NOT EXISTS import_group_checksums (
+    group_id INTEGER PRIMARY KEY REFERENCES student_groups(id) ON DELETE CASCADE,
+    ledger_id INTEGER NOT NULL REFERENCES import_ledger(id) ON DELETE CASCADE,
+    date_from DATE NOT NULL,
+    date_to DATE NOT NULL,
+    checksum CHAR(32) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_import_group_checksums_ledger ON import_group_checksums(ledger_id);
+
+CREATE OR REPLACE FUNCTION forget_import_checksums() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM import_group_checksums WHERE group_id IN (SELECT DISTINCT group_id FROM old_rows);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        DELETE FROM import_group_checksums WHERE group_id IN (SELECT DISTINCT group_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: один DELETE на весь пакетный INSERT/UPDATE
+DROP TRIGGER IF EXISTS schedule_forget_checksums_ins ON schedule;
+CREATE TRIGGER schedule_forget_checksums_ins AFTER INSERT ON schedule
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION forget_import_checksums();
+DROP TRIGGER IF EXISTS schedule_forget_checksums_upd ON schedule;
+CREATE TRIGGER schedule_forget_checksums_upd AFTER UPDATE ON schedule
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION forget_import_checksums();
+DROP TRIGGER IF EXISTS schedule_forget_checksums_del ON schedule;
+CREATE TRIGGER schedule_forget_checksums_del AFTER DELETE ON schedule
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION forget_import_checksums();
+
+-- Версии данных для кэша выгрузок: 'schedule' увеличивается при любом изменении
+-- расписания и справочников, которые попадают в выгрузку
+CREATE TABLE IF NOT EXISTS data_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO data_versions (name) VALUES ('schedule') ON CONFLICT (name) DO NOTHING;
+
+-- Версия растёт, только если оператор действительно изменил строки: пустые
+-- INSERT ... ON CONFLICT DO NOTHING, UPDATE без изменений значений и DELETE без строк
+-- не меняют версию (и не блокируют строку data_versions)
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NOT EXISTS (SELECT 1 FROM new_rows) THEN RETURN NULL; END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM old_rows) THEN RETURN NULL; END IF;
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF NOT EXISTS (SELECT * FROM new_rows EXCEPT SELECT * FROM old_rows) THEN RETURN NULL; END IF;
+    END IF;
+    UPDATE data_versions SET version = version + 1, changed_at = NOW() WHERE name = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Один UPDATE на оператор, а не на строку: пакетный импорт меняет версию один раз.
+-- Таблицы переходов допускаются только у триггера на одно событие — отсюда четыре триггера
+DO $$
+DECLARE
+    tbl TEXT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['schedule', 'student_groups', 'subjects', 'teachers', 'rooms', 'buildings', 'lesson_times']
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_bump_version', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_bump_version_ins', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_bump_version_upd', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_bump_version_del', tbl);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_bump_version_trunc', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version(''schedule'')',
+            tbl || '_bump_version_ins', tbl
+        );
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version(''schedule'')',
+            tbl || '_bump_version_upd', tbl
+        );
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version(''schedule'')',
+            tbl || '_bump_version_del', tbl
+        );
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version(''schedule'')',
+            tbl || '_bump_version_trunc', tbl
+        );
+    END LOOP;
+END $$;
+
 -- Индексы для оптимизации запросов
 CREATE INDEX IF NOT EXISTS idx_schedule_group_date ON schedule(group_id, lesson_date);
 CREATE INDEX IF NOT EXISTS idx_schedule_teacher ON schedule(teacher_id, lesson_date);
 CREATE INDEX IF NOT EXISTS idx_schedule_room ON schedule(room_id, lesson_date);
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
 CREATE INDEX IF NOT EXISTS idx_user_actions_log_user_id ON user_actions_log(user_id);
+-- Журнал пишется по возрастанию времени: BRIN по created_at почти ничего не весит
+CREATE INDEX IF NOT EXISTS idx_user_actions_created_at_brin ON user_actions USING BRIN (created_at);
+-- Нормализованное имя для уникальности справочников:
+-- без крайних пробелов, повторные пробелы схлопнуты, нижний регистр, ё → е
+CREATE OR REPLACE FUNCTION norm_name(value TEXT) RETURNS TEXT AS $$
+    SELECT lower(translate(regexp_replace(btrim(value), '\s+', ' ', 'g'), 'Ёё', 'Ее'))
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+-- Уникальность предметов, преподавателей и аудиторий (в пределах корпуса)
+-- по нормализованному имени. Накопленные дубли один раз сливаются:
+-- ссылки в расписании переводятся на запись с наименьшим id, остальные удаляются.
+DO $$
+BEGIN
+    IF to_regclass('uq_subjects_norm_name') IS NULL THEN
+        UPDATE schedule s SET subject_id = d.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY norm_name(name)) AS keep_id FROM subjects) d
+        WHERE s.subject_id = d.id AND d.id <> d.keep_id;
+
+        DELETE FROM subjects x USING subjects keep
+        WHERE norm_name(keep.name) = norm_name(x.name) AND keep.id < x.id;
+
+        CREATE UNIQUE INDEX uq_subjects_norm_name ON subjects (norm_name(name));
+    END IF;
+
+    IF to_regclass('uq_teachers_norm_fio') IS NULL THEN
+        UPDATE schedule s SET teacher_id = d.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY norm_name(fio)) AS keep_id FROM teachers) d
+        WHERE s.teacher_id = d.id AND d.id <> d.keep_id;
+
+        DELETE FROM teachers x USING teachers keep
+        WHERE norm_name(keep.fio) = norm_name(x.fio) AND keep.id < x.id;
+
+        CREATE UNIQUE INDEX uq_teachers_norm_fio ON teachers (norm_name(fio));
+    END IF;
+
+    IF to_regclass('uq_rooms_building_norm_number') IS NULL THEN
+        UPDATE schedule s SET room_id = d.keep_id
+        FROM (
+            SELECT id, MIN(id) OVER (PARTITION BY building_id, norm_name(room_number)) AS keep_id
+            FROM rooms
+        ) d
+        WHERE s.room_id = d.id AND d.id <> d.keep_id;
+
+        DELETE FROM rooms x USING rooms keep
+        WHERE keep.building_id = x.building_id
+          AND norm_name(keep.room_number) = norm_name(x.room_number)
+          AND keep.id < x.id;
+
+        CREATE UNIQUE INDEX uq_rooms_building_norm_number ON rooms (building_id, norm_name(room_number));
+    END IF;
+END $$;
+-- Поиск аудитории по номеру без учёта корпуса
+CREATE INDEX IF NOT EXISTS idx_rooms_norm_number ON rooms (norm_name(room_number));
+
+-- Одна пара группы в один день: перед созданием уникального индекса
+-- удаляем дубли (остаётся последняя добавленная запись). Выполняется только один раз.
+DO $$
+BEGIN
+    IF to_regclass('uq_schedule_group_date_time') IS NULL THEN
+        DELETE FROM schedule s
+        USING schedule newer
+        WHERE newer.group_id = s.group_id
+          AND newer.lesson_date = s.lesson_date
+          AND newer.lesson_time_id = s.lesson_time_id
+          AND newer.id > s.id;
+
+        CREATE UNIQUE INDEX uq_schedule_group_date_time
+            ON schedule(group_id, lesson_date, lesson_time_id);
+    END IF;
+END $$;
+-- Постраничный выбор (keyset): факультет → курс → группа и алфавит преподавателей
+CREATE INDEX IF NOT EXISTS idx_student_groups_faculty_course ON student_groups(faculty_id, course, group_number);
+CREATE INDEX IF NOT EXISTS idx_teachers_fio_id ON teachers(fio, id);
 """
 
 # SQL для начального заполнения таблицы времени пар
@@ -145,12 +480,15 @@ ON CONFLICT (lesson_number) DO NOTHING;
 
 # SQL для добавления тестовых данных
 INSERT_TEST_DATA_SQL = """
--- Добавление корпусов
-INSERT INTO buildings (name, address) VALUES
+-- Добавление корпусов (уникального ключа по имени нет — проверяем сами,
+-- иначе каждый перезапуск добавлял бы копии и менял версию данных)
+INSERT INTO buildings (name, address)
+SELECT v.name, v.address FROM (VALUES
 ('Главный корпус', 'ул. Ленина, д. 1'),
 ('Второй корпус', 'ул. Пушкина, д. 10'),
 ('Третий корпус', 'пр. Победы, д. 25')
-ON CONFLICT DO NOTHING;
+) AS v(name, address)
+WHERE NOT EXISTS (SELECT 1 FROM buildings b WHERE b.name = v.name);
 
 -- Добавление кабинетов
 INSERT INTO rooms (building_id, room_number, capacity, room_type) VALUES
@@ -163,10 +501,12 @@ INSERT INTO rooms (building_id, room_number, capacity, room_type) VALUES
 ON CONFLICT DO NOTHING;
 
 -- Добавление факультетов
-INSERT INTO faculties (name, short_name, dean_fio) VALUES
+INSERT INTO faculties (name, short_name, dean_fio)
+SELECT v.name, v.short_name, v.dean_fio FROM (VALUES
 ('Факультет информационных технологий', 'ФИТ', 'Иванов И.И.'),
 ('Экономический факультет', 'ЭФ', 'Петрова П.П.')
-ON CONFLICT DO NOTHING;
+) AS v(name, short_name, dean_fio)
+WHERE NOT EXISTS (SELECT 1 FROM faculties f WHERE f.name = v.name);
 
 -- Добавление групп
 INSERT INTO student_groups (faculty_id, group_number, course, students_count) VALUES
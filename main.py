@@ -9,6 +9,13 @@ import logging
 
 from bot.handlers import dp, bot
 from database.db_manager import DatabaseManager
+from utils.action_logger import action_log_writer, action_partitions_loop
+from utils.cache import reference_refresh_loop
+from utils.calendar_feed import calendar_feed_server
+from utils.export_jobs import shutdown_export_pool
+from utils.import_jobs import import_job_runner, preview_expiry_loop
+from utils.reporting import shutdown_validation_pool
+from utils.schedule_image import shutdown_render_pool
 from utils.generate_schedule import ensure_schedule_for_academic_year
 
 # ===== ЛОГИРОВАНИЕ =====
@@ -40,11 +47,41 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Ошибка при генерации расписания: {e}", exc_info=True)
 
+    # ===== ФОНОВЫЕ ЗАДАЧИ =====
+    # Справочники для inline-режима держим в памяти и обновляем в фоне
+    refresh_task = asyncio.create_task(reference_refresh_loop(db))
+    # Действия пользователей пишутся в БД пачками
+    action_log_writer.start(db)
+    # Месячные секции журнала: создание наперёд и удаление по сроку хранения
+    partitions_task = asyncio.create_task(action_partitions_loop(db))
+    # Импорты, прерванные прошлым перезапуском, помечаются как неудавшиеся,
+    # устаревшие предпросмотры отклоняются (и затем периодически)
+    try:
+        await import_job_runner.recover(db, bot)
+    except Exception as e:
+        logger.error(f"❌ Ошибка проверки прерванных импортов: {e}")
+    preview_task = asyncio.create_task(preview_expiry_loop(db, bot))
+
+    # Календарные подписки (.ics) по HTTP, если задан ICS_FEED_PORT
+    try:
+        await calendar_feed_server.start(db)
+    except Exception as e:
+        logger.error(f"❌ Не удалось запустить сервер календарных подписок: {e}")
+
     # ===== ЗАПУСК БОТА =====
     try:
         logger.info("🤖 Запуск long-polling...")
         await dp.start_polling(bot)
     finally:
+        refresh_task.cancel()
+        partitions_task.cancel()
+        preview_task.cancel()
+        await import_job_runner.stop()
+        await action_log_writer.stop()
+        await calendar_feed_server.stop()
+        shutdown_render_pool()
+        shutdown_validation_pool()
+        shutdown_export_pool()
         await bot.session.close()
         logger.info("🛑 Бот остановлен.")
 
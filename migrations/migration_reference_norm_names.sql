@@ -0,0 +1,49 @@
+-- Миграция: уникальность предметов, преподавателей и аудиторий
+-- по нормализованному имени (регистр, ё/е, лишние пробелы не различаются).
+-- Дубли сливаются в запись с наименьшим id, ссылки в расписании переносятся.
+-- То же самое выполняется автоматически при запуске бота (database/schema.py).
+
+BEGIN;
+
+-- 1. Функция нормализации (IMMUTABLE — нужна для индексов по выражению)
+CREATE OR REPLACE FUNCTION norm_name(value TEXT) RETURNS TEXT AS $$
+    SELECT lower(translate(regexp_replace(btrim(value), '\s+', ' ', 'g'), 'Ёё', 'Ее'))
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+-- 2. Предметы
+UPDATE schedule s SET subject_id = d.keep_id
+FROM (SELECT id, MIN(id) OVER (PARTITION BY norm_name(name)) AS keep_id FROM subjects) d
+WHERE s.subject_id = d.id AND d.id <> d.keep_id;
+
+DELETE FROM subjects x USING subjects keep
+WHERE norm_name(keep.name) = norm_name(x.name) AND keep.id < x.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_subjects_norm_name ON subjects (norm_name(name));
+
+-- 3. Преподаватели
+UPDATE schedule s SET teacher_id = d.keep_id
+FROM (SELECT id, MIN(id) OVER (PARTITION BY norm_name(fio)) AS keep_id FROM teachers) d
+WHERE s.teacher_id = d.id AND d.id <> d.keep_id;
+
+DELETE FROM teachers x USING teachers keep
+WHERE norm_name(keep.fio) = norm_name(x.fio) AND keep.id < x.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_teachers_norm_fio ON teachers (norm_name(fio));
+
+-- 4. Аудитории (в пределах корпуса)
+UPDATE schedule s SET room_id = d.keep_id
+FROM (
+    SELECT id, MIN(id) OVER (PARTITION BY building_id, norm_name(room_number)) AS keep_id
+    FROM rooms
+) d
+WHERE s.room_id = d.id AND d.id <> d.keep_id;
+
+DELETE FROM rooms x USING rooms keep
+WHERE keep.building_id = x.building_id
+  AND norm_name(keep.room_number) = norm_name(x.room_number)
+  AND keep.id < x.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_rooms_building_norm_number ON rooms (building_id, norm_name(room_number));
+CREATE INDEX IF NOT EXISTS idx_rooms_norm_number ON rooms (norm_name(room_number));
+
+COMMIT;
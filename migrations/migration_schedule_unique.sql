@@ -0,0 +1,20 @@
+-- Миграция: уникальность пары группы в расписании
+-- (group_id, lesson_date, lesson_time_id). Все записи расписания
+-- выполняются через INSERT ... ON CONFLICT DO UPDATE.
+-- То же самое выполняется автоматически при запуске бота (database/schema.py).
+
+BEGIN;
+
+-- 1. Удаляем дубли: для каждой пары группы в день остаётся последняя добавленная запись
+DELETE FROM schedule s
+USING schedule newer
+WHERE newer.group_id = s.group_id
+  AND newer.lesson_date = s.lesson_date
+  AND newer.lesson_time_id = s.lesson_time_id
+  AND newer.id > s.id;
+
+-- 2. Уникальный индекс (на него опирается ON CONFLICT)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_schedule_group_date_time
+    ON schedule(group_id, lesson_date, lesson_time_id);
+
+COMMIT;
@@ -0,0 +1,293 @@
+"""
+Пакетная запись действий пользователей.
+Обработчики только кладут запись в очередь в памяти, а фоновая задача
+раз в ACTION_LOG_FLUSH_INTERVAL_MS (или по набору ACTION_LOG_BATCH_SIZE записей)
+пишет их в user_actions одним многострочным INSERT.
+Если БД недоступна, пачка дописывается в локальный файл-запас (JSON Lines),
+который фоновая задача загружает в БД после восстановления соединения.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from config.settings import (
+    ACTION_LOG_BATCH_SIZE,
+    ACTION_LOG_DEFAULT_POLICY,
+    ACTION_LOG_FLUSH_INTERVAL_MS,
+    ACTION_LOG_PARTITIONS_AHEAD,
+    ACTION_LOG_POLICIES,
+    ACTION_LOG_QUEUE_SIZE,
+    ACTION_LOG_REPLAY_INTERVAL,
+    ACTION_LOG_RETENTION_MONTHS,
+    ACTION_LOG_SPOOL_FILE,
+    ACTION_LOG_USER_CACHE_TTL,
+)
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ActionSpool:
+    """
+    Локальный журнал-запас: пачки действий дописываются в конец файла
+    (одна строка JSON на действие, один fsync на пачку).
+    Для загрузки файл атомарно переименовывается в *.replay, поэтому новые
+    пачки пишутся в свежий файл, пока идёт загрузка старого. Позиция
+    загруженной части хранится в *.pos, чтобы после сбоя не задвоить строки.
+    """
+
+    def __init__(self, path: str = ACTION_LOG_SPOOL_FILE):
+        self.path = path
+        self.replay_path = path + ".replay"
+        self.pos_path = path + ".pos"
+        self._lock = threading.Lock()
+
+    def append(self, batch: list):
+        """Дописать пачку в файл и сбросить её на диск"""
+        lines = []
+        for telegram_id, action, details, created_at, sample_rate in batch:
+            lines.append(json.dumps(
+                [telegram_id, action, details, created_at.isoformat(), sample_rate],
+                ensure_ascii=False
+            ))
+
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def has_data(self) -> bool:
+        return os.path.exists(self.replay_path) or (
+            os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        )
+
+    def replay(self, write_batch, batch_size: int) -> int:
+        """
+        Загрузить накопленные пачки через write_batch(batch).
+        Возвращает число загруженных действий; при ошибке БД исключение
+        пробрасывается, а незагруженная часть останется до следующей попытки.
+        """
+        with self._lock:
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.path):
+                    return 0
+                os.replace(self.path, self.replay_path)
+
+        position = 0
+        if os.path.exists(self.pos_path):
+            with open(self.pos_path, encoding="utf-8") as f:
+                position = int(f.read().strip() or 0)
+
+        replayed = 0
+        with open(self.replay_path, "rb") as f:
+            f.seek(position)
+            while True:
+                batch = []
+                for raw in f:
+                    if not raw.strip():
+                        continue
+                    try:
+                        telegram_id, action, details, created_at, sample_rate = json.loads(raw)
+                    except ValueError:
+                        # Оборванная при сбое последняя строка
+                        logger.warning("Пропущена повреждённая строка в запасе журнала действий")
+                        continue
+                    batch.append((telegram_id, action, details, datetime.fromisoformat(created_at), sample_rate))
+                    if len(batch) >= batch_size:
+                        break
+                if not batch:
+                    break
+
+                write_batch(batch)
+                replayed += len(batch)
+                with open(self.pos_path, "w", encoding="utf-8") as pos:
+                    pos.write(str(f.tell()))
+
+        os.remove(self.replay_path)
+        if os.path.exists(self.pos_path):
+            os.remove(self.pos_path)
+        return replayed
+
+
+class ActionLogWriter:
+    """
+    Очередь действий пользователей с фоновой пакетной записью в БД.
+    Запись в очередь не блокирует обработчик; при переполнении очереди
+    действие отбрасывается и учитывается в счётчике dropped.
+    """
+
+    def __init__(self, queue_size: int = ACTION_LOG_QUEUE_SIZE,
+                 batch_size: int = ACTION_LOG_BATCH_SIZE,
+                 flush_interval_ms: int = ACTION_LOG_FLUSH_INTERVAL_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # telegram_id → (user_id, username); незарегистрированных не кэшируем,
+        # чтобы после /start действие сразу привязывалось к пользователю
+        self.users = TTLCache(maxsize=50000, ttl=ACTION_LOG_USER_CACHE_TTL)
+        self.spool = ActionSpool()
+        self.db = None
+        self._task = None
+        self._replay_task = None
+        self._pending = []
+        self._inflight = None
+        self.counters = {
+            'queued': 0,    # принято в очередь
+            'written': 0,   # записано в БД
+            'dropped': 0,   # отброшено из-за переполнения очереди
+            'failed': 0,    # потеряно: не записано ни в БД, ни в запас
+            'flushes': 0,   # выполнено пакетных INSERT
+            'spooled': 0,   # записано в локальный запас, пока БД была недоступна
+            'replayed': 0,  # загружено из запаса в БД
+        }
+
+    def log(self, telegram_id: int, action: str, details: str = "", sample_rate: float | None = 1.0):
+        """
+        Поставить действие в очередь (без обращения к БД).
+        sample_rate — доля записываемых действий этого типа (сохраняется в строке журнала);
+        None — действие учитывается только в сводках, строка журнала не пишется.
+        """
+        try:
+            self.queue.put_nowait((telegram_id, action, details, datetime.now(), sample_rate))
+            self.counters['queued'] += 1
+        except asyncio.QueueFull:
+            self.counters['dropped'] += 1
+            if self.counters['dropped'] % 1000 == 1:
+                logger.warning(
+                    f"Очередь журнала действий переполнена, отброшено: {self.counters['dropped']}"
+                )
+
+    def start(self, db):
+        """Запуск фоновой задачи записи (вызывать из event loop)"""
+        self.db = db
+        self._task = asyncio.create_task(self._run())
+        self._replay_task = asyncio.create_task(self._replay_loop())
+        return self._task
+
+    async def stop(self):
+        """Остановка: дописываем всё, что осталось в очереди"""
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            self._replay_task = None
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._inflight is not None:
+            await self._inflight
+        # Пачка, которую задача набирала в момент остановки, и остаток очереди
+        await self._flush(self._pending)
+        self._pending = []
+        while not self.queue.empty():
+            await self._flush(self._take_batch())
+
+        logger.info(f"Журнал действий остановлен: {self.counters}")
+
+    def _take_batch(self) -> list:
+        """Забрать из очереди до batch_size записей без ожидания"""
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            # Ждём первую запись, затем добираем пачку до размера или до таймаута
+            self._pending.append(await self.queue.get())
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch, self._pending = self._pending, []
+            # Запись не прерываем при остановке: stop() дождётся её завершения
+            self._inflight = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._inflight)
+            self._inflight = None
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self._write, batch)
+            self.counters['written'] += len(batch)
+            self.counters['flushes'] += 1
+        except Exception as e:
+            logger.error(f"Не удалось записать {len(batch)} действий пользователей в БД: {e}")
+            try:
+                await asyncio.to_thread(self.spool.append, batch)
+                self.counters['spooled'] += len(batch)
+            except Exception as spool_error:
+                self.counters['failed'] += len(batch)
+                logger.error(f"Не удалось сохранить действия в локальный запас: {spool_error}")
+
+    async def _replay_loop(self):
+        """Периодически загружает локальный запас в БД, если он не пуст"""
+        while True:
+            if self.spool.has_data():
+                try:
+                    replayed = await asyncio.to_thread(self.spool.replay, self._write, self.batch_size)
+                    self.counters['replayed'] += replayed
+                    if replayed:
+                        logger.info(f"Из локального запаса загружено действий: {replayed}")
+                except Exception as e:
+                    logger.warning(f"Локальный запас журнала пока не загружен: {e}")
+            await asyncio.sleep(ACTION_LOG_REPLAY_INTERVAL)
+
+    def _write(self, batch: list):
+        """Определяем user_id одним запросом на пачку и пишем её одним INSERT"""
+        unknown = {item[0] for item in batch if self.users.get(item[0]) is None}
+        if unknown:
+            for user in self.db.get_users_by_telegram_ids(unknown):
+                self.users.set(user['telegram_id'], (user['id'], user['username']))
+
+        rows = []
+        for telegram_id, action, details, created_at, sample_rate in batch:
+            user_id, username = self.users.get(telegram_id, (None, None))
+            rows.append((user_id, telegram_id, username, action, details, created_at, sample_rate))
+
+        self.db.insert_user_actions_bulk(rows)
+
+
+def get_action_policy(action: str) -> tuple:
+    """Политика записи для типа действия: ("always",), ("sample", p), ("count",) или ("off",)"""
+    return ACTION_LOG_POLICIES.get(action, ACTION_LOG_DEFAULT_POLICY)
+
+
+# Общий экземпляр для обработчиков
+action_log_writer = ActionLogWriter()
+
+
+def maintain_action_partitions(db):
+    """Секции журнала наперёд и удаление месяцев старше срока хранения"""
+    db.ensure_user_actions_partitions(ACTION_LOG_PARTITIONS_AHEAD)
+    dropped = db.drop_old_user_actions_partitions(ACTION_LOG_RETENTION_MONTHS)
+    if dropped:
+        logger.info(f"Удалены старые секции журнала действий: {', '.join(dropped)}")
+
+
+async def action_partitions_loop(db):
+    """Обслуживание секций журнала при запуске и затем раз в сутки"""
+    while True:
+        try:
+            await asyncio.to_thread(maintain_action_partitions, db)
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания секций журнала действий: {e}")
+        await asyncio.sleep(24 * 3600)
@@ -0,0 +1,498 @@
+"""
+Замеры производительности тяжёлых операций бота.
+
+Запуск:
+    python -m utils.benchmarks images [картинок] [параллельно]
+    python -m utils.benchmarks import [строк]
+    python -m utils.benchmarks excel [строк]
+    python -m utils.benchmarks formats [строк]
+    python -m utils.benchmarks validate [строк] [процессов]
+    python -m utils.benchmarks export [занятий]
+
+Замеры с БД работают с базой из config/settings.py: создают свои группы
+BENCH-*, предметы/преподавателей/аудитории с префиксом BENCH и удаляют их в конце.
+"""
+
+import asyncio
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+
+def _synthetic_week(seed: int) -> list[dict]:
+    """Неделя занятий группы: 3–5 пар в день, ПН–СБ"""
+    rnd = random.Random(seed)
+    monday = date(2026, 10, 19)
+    subjects = ["Базы данных", "Программирование на Python", "Веб-разработка",
+                "Математический анализ и дифференциальные уравнения", "Физика"]
+    lessons = []
+    for day in range(6):
+        for pair in sorted(rnd.sample(range(1, 8), rnd.randint(3, 5))):
+            lessons.append({
+                'lesson_date': monday + timedelta(days=day),
+                'lesson_number': pair,
+                'subject_name': rnd.choice(subjects),
+                'teacher_fio': f"Преподаватель {rnd.randint(1, 40)}",
+                'group_number': f"ИВТ-{seed % 50}",
+                'room_number': str(rnd.randint(100, 450)),
+            })
+    return lessons
+
+
+def bench_images(count: int = 48, concurrency: int = 8):
+    """
+    Рендер картинок недели: последовательно в одном процессе
+    и конкурентно через пул процессов из utils.schedule_image.
+    """
+    from config.settings import IMAGE_RENDER_WORKERS
+    from utils.schedule_image import (
+        get_render_pool,
+        prepare_week_cells,
+        render_week_image,
+        shutdown_render_pool,
+    )
+
+    days = [f"День {i + 1}" for i in range(6)]
+    jobs = [("ИВТ-21", f"неделя {i}", days, prepare_week_cells("group", _synthetic_week(i)))
+            for i in range(count)]
+
+    started = time.perf_counter()
+    sizes = [len(render_week_image(*job)) for job in jobs]
+    serial = time.perf_counter() - started
+    print(f"Последовательно: {count} картинок за {serial:.2f} с — "
+          f"{count / serial:.1f} шт/с, средний PNG {sum(sizes) // len(sizes) // 1024} КБ")
+
+    async def run_pool():
+        loop = asyncio.get_running_loop()
+        pool = get_render_pool()
+        # Прогрев: процессы пула стартуют и загружают шрифты
+        await asyncio.gather(*(loop.run_in_executor(pool, render_week_image, *jobs[0])
+                               for _ in range(IMAGE_RENDER_WORKERS)))
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(job):
+            async with semaphore:
+                t0 = time.perf_counter()
+                await loop.run_in_executor(pool, render_week_image, *job)
+                latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(job) for job in jobs))
+        return time.perf_counter() - t0, sorted(latencies)
+
+    elapsed, latencies = asyncio.run(run_pool())
+    shutdown_render_pool()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"Пул ({IMAGE_RENDER_WORKERS} процессов, {concurrency} запросов одновременно): "
+          f"{count} картинок за {elapsed:.2f} с — {count / elapsed:.1f} шт/с, p95 {p95 * 1000:.0f} мс")
+
+
+def _synthetic_import_rows(count: int, groups: list[str], year: int = 2031):
+    """Строки импорта: группы × дни × пары, справочники с префиксом BENCH"""
+    from config.settings import SCHEDULE_TIMES
+    rnd = random.Random(count)
+    per_day = 7 * len(groups)
+    start = date(year, 1, 1)
+    for i in range(count):
+        day, rest = divmod(i, per_day)
+        group_index, pair = divmod(rest, 7)
+        yield {
+            'row_num': i + 4,
+            'group': groups[group_index],
+            'date': start + timedelta(days=day),
+            'lesson_number': pair + 1,
+            'start_time': SCHEDULE_TIMES[pair + 1][0],
+            'end_time': SCHEDULE_TIMES[pair + 1][1],
+            'subject': f"BENCH Предмет {rnd.randint(1, 300)}",
+            'subject_type': rnd.choice(["lecture", "practice", "lab"]),
+            'teacher': f"BENCH Преподаватель {rnd.randint(1, 200)}",
+            'room': f"BENCH-{rnd.randint(1, 150)}",
+        }
+
+
+def _cleanup_bench_data(db):
+    db.execute_query("DELETE FROM student_groups WHERE group_number LIKE %s", ("BENCH-%",))
+    db.execute_query("DELETE FROM subjects WHERE name LIKE %s", ("BENCH %",))
+    db.execute_query("DELETE FROM teachers WHERE fio LIKE %s", ("BENCH %",))
+    db.execute_query("DELETE FROM rooms WHERE room_number LIKE %s", ("BENCH-%",))
+
+
+def bench_import(count: int = 100000):
+    """
+    Импорт расписания: пакетный (COPY + set-based upsert) на count строк
+    против построчного add_schedule_from_import на выборке.
+    """
+    from database.db_manager import DatabaseManager
+
+    db = DatabaseManager()
+    _cleanup_bench_data(db)
+    groups = [f"BENCH-{i:03d}" for i in range(1, 101)]
+    db.execute_query(
+        "INSERT INTO student_groups (group_number, course) SELECT unnest(%s::text[]), 1",
+        (groups,)
+    )
+
+    try:
+        started = time.perf_counter()
+        result = db.bulk_import_schedule(_synthetic_import_rows(count, groups))
+        elapsed = time.perf_counter() - started
+        print(f"Пакетный импорт, новые строки: {count} за {elapsed:.2f} с — {count / elapsed:.0f} строк/с "
+              f"(добавлено {result['inserted']}, ошибок {len(result['errors'])})")
+
+        started = time.perf_counter()
+        result = db.bulk_import_schedule(_synthetic_import_rows(count, groups))
+        elapsed = time.perf_counter() - started
+        print(f"Пакетный импорт, повторная загрузка: {count} за {elapsed:.2f} с — {count / elapsed:.0f} строк/с "
+              f"(обновлено {result['updated']})")
+
+        sample = 500
+        started = time.perf_counter()
+        for r in _synthetic_import_rows(sample, groups, year=2032):
+            db.add_schedule_from_import(
+                group_number=r['group'], lesson_date=r['date'], lesson_number=r['lesson_number'],
+                start_time=r['start_time'], end_time=r['end_time'], subject_name=r['subject'],
+                subject_type=r['subject_type'], teacher_fio=r['teacher'], room_number=r['room']
+            )
+        elapsed = time.perf_counter() - started
+        print(f"Построчный импорт: {sample} строк за {elapsed:.2f} с — {sample / elapsed:.0f} строк/с, "
+              f"на {count} строк ≈ {count / (sample / elapsed) / 60:.1f} мин")
+    finally:
+        _cleanup_bench_data(db)
+
+
+def _read_excel_legacy(filepath):
+    """Прежнее чтение файла импорта: полная книга в памяти и ws.cell() на каждую ячейку"""
+    from openpyxl import load_workbook
+    from utils.reporting import parse_schedule_import_row
+
+    errors = []
+    wb = load_workbook(filepath)
+    ws = wb.active
+    count = 0
+    for row_num in range(4, ws.max_row + 1):
+        row_data = [ws.cell(row=row_num, column=col_num).value for col_num in range(1, 10)]
+        if parse_schedule_import_row(row_num, row_data, errors):
+            count += 1
+    return count
+
+
+def _read_excel_streaming(filepath):
+    from utils.reporting import iter_schedule_rows_from_excel
+    return sum(1 for _ in iter_schedule_rows_from_excel(filepath, []))
+
+
+def _measure_in_process(func, filepath):
+    """Время и пиковая память (RSS) функции в отдельном процессе"""
+    import resource
+    started = time.perf_counter()
+    count = func(filepath)
+    elapsed = time.perf_counter() - started
+    return count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def _write_bench_import_file(file_format: str, count: int) -> str:
+    """Файл импорта на count строк в формате xlsx, csv (CP1251, «;») или jsonl"""
+    import csv
+    import json
+    import os
+    import tempfile
+    from openpyxl import Workbook
+
+    filepath = os.path.join(tempfile.gettempdir(), f"bench_import_{count}.{file_format}")
+    headers = ["Группа*", "Дата*", "Пара*", "Начало*", "Конец*", "Предмет*", "Тип*", "Преподаватель", "Аудитория"]
+    rows = ([r['group'], r['date'].isoformat(), r['lesson_number'], r['start_time'], r['end_time'],
+             r['subject'], r['subject_type'], r['teacher'], r['room']]
+            for r in _synthetic_import_rows(count, [f"BENCH-{i:03d}" for i in range(1, 101)]))
+
+    if file_format == "xlsx":
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Расписание")
+        ws.append(["ШАБЛОН ИМПОРТА РАСПИСАНИЯ"])
+        ws.append([])
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
+        wb.save(filepath)
+    elif file_format == "csv":
+        with open(filepath, "w", encoding="cp1251", newline="") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(headers)
+            writer.writerows(rows)
+    else:
+        from utils.reporting import JSONL_IMPORT_FIELDS
+        with open(filepath, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(JSONL_IMPORT_FIELDS, row)), ensure_ascii=False) + "\n")
+    return filepath
+
+
+def _read_import_file(filepath):
+    from utils.reporting import iter_schedule_rows
+    return sum(1 for _ in iter_schedule_rows(filepath, []))
+
+
+def bench_excel(count: int = 100000):
+    """Чтение файла импорта на count строк: прежний способ против потокового"""
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    filepath = _write_bench_import_file("xlsx", count)
+    print(f"Файл: {count} строк, {os.path.getsize(filepath) // 1024} КБ")
+
+    try:
+        for title, func in (("Прежнее чтение (load_workbook + ws.cell)", _read_excel_legacy),
+                            ("Потоковое (read_only + iter_rows)", _read_excel_streaming)):
+            # Каждый способ — в новом процессе, чтобы пиковая память не смешивалась
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                rows, elapsed, peak_mb = pool.submit(_measure_in_process, func, filepath).result()
+            print(f"{title}: {rows} строк за {elapsed:.2f} с — {rows / elapsed:.0f} строк/с, "
+                  f"пиковая память процесса {peak_mb} МБ")
+    finally:
+        os.remove(filepath)
+
+
+def bench_formats(count: int = 100000):
+    """Разбор одного и того же расписания из XLSX, CSV (CP1251) и JSON Lines"""
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    for file_format in ("xlsx", "csv", "jsonl"):
+        filepath = _write_bench_import_file(file_format, count)
+        try:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                rows, elapsed, peak_mb = pool.submit(_measure_in_process, _read_import_file, filepath).result()
+            print(f"{file_format.upper()}: {os.path.getsize(filepath) // 1024} КБ, {rows} строк за {elapsed:.2f} с — "
+                  f"{rows / elapsed:.0f} строк/с, пиковая память процесса {peak_mb} МБ")
+        finally:
+            os.remove(filepath)
+
+
+def bench_validate(count: int = 200000, workers: int = 0):
+    """Проверка строк импорта: в одном процессе против пула процессов"""
+    from config.settings import IMPORT_VALIDATION_WORKERS
+    from utils.reporting import shutdown_validation_pool, validate_schedule_rows
+
+    workers = workers or IMPORT_VALIDATION_WORKERS
+    raw_rows = [(r['row_num'], (r['group'], r['date'].strftime("%d.%m.%Y"), str(r['lesson_number']),
+                                r['start_time'], r['end_time'], r['subject'], r['subject_type'],
+                                r['teacher'], r['room']))
+                for r in _synthetic_import_rows(count, [f"BENCH-{i:03d}" for i in range(1, 101)])]
+
+    try:
+        for title, pool_size in (("В одном процессе", 1), (f"Пул из {workers} процессов", workers)):
+            errors, warnings = [], []
+            started = time.perf_counter()
+            rows = sum(1 for _ in validate_schedule_rows(raw_rows, errors, warnings, workers=pool_size))
+            elapsed = time.perf_counter() - started
+            print(f"{title}: {rows} строк за {elapsed:.2f} с — {rows / elapsed:.0f} строк/с, "
+                  f"ошибок {len(errors)}, предупреждений {len(warnings)}")
+    finally:
+        shutdown_validation_pool()
+
+
+def _synthetic_schedule_data(count: int):
+    """Занятия в формате get_all_schedule_range для выгрузок (генератор)"""
+    for r in _synthetic_import_rows(count, [f"BENCH-{i:03d}" for i in range(1, 101)]):
+        yield {
+            'group_number': r['group'], 'lesson_date': r['date'], 'lesson_number': r['lesson_number'],
+            'start_time': r['start_time'], 'end_time': r['end_time'], 'subject_name': r['subject'],
+            'subject_type': r['subject_type'], 'teacher_fio': r['teacher'],
+            'building_name': "Главный корпус", 'room_number': r['room'], 'notes': None,
+        }
+
+
+def _export_schedule_legacy(count: int, filename: str):
+    """Прежняя выгрузка: полная книга в памяти, новые Border/Alignment на каждую ячейку"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from utils.reporting import get_day_name
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Расписание"
+    header_fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF", size=12)
+    border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                    top=Side(style='thin'), bottom=Side(style='thin'))
+    center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+
+    ws.merge_cells('A1:I1')
+    ws['A1'].value = "Расписание занятий"
+    ws['A1'].font = Font(bold=True, size=14)
+    ws['A1'].alignment = center_align
+    ws.append([])
+    headers = ["Группа", "Дата", "День", "Пара", "Время", "Предмет", "Тип", "Преподаватель", "Аудитория"]
+    for col_num, header in enumerate(headers, 1):
+        cell = ws.cell(row=3, column=col_num)
+        cell.value = header
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = center_align
+        cell.border = border
+
+    for row_num, item in enumerate(_synthetic_schedule_data(count), 4):
+        lesson_date = item['lesson_date']
+        cells_data = [
+            item['group_number'], lesson_date.strftime("%Y-%m-%d"), get_day_name(lesson_date.weekday()),
+            item['lesson_number'], f"{item['start_time']}-{item['end_time']}", item['subject_name'],
+            item['subject_type'], item['teacher_fio'], f"{item['room_number']} ({item['building_name']})",
+        ]
+        for col_num, value in enumerate(cells_data, 1):
+            cell = ws.cell(row=row_num, column=col_num)
+            cell.value = value
+            cell.alignment = center_align if col_num <= 5 else left_align
+            cell.border = border
+    wb.save(filename)
+
+
+def _export_schedule_streaming(count: int, filename: str):
+    from utils.reporting import export_schedule_to_excel
+    export_schedule_to_excel(_synthetic_schedule_data(count), filename=filename)
+
+
+def _measure_export(func, count: int, filename: str):
+    """Время и пиковая память (RSS) выгрузки в отдельном процессе"""
+    import resource
+    started = time.perf_counter()
+    func(count, filename)
+    elapsed = time.perf_counter() - started
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def bench_export(count: int = 100000):
+    """Выгрузка расписания в XLSX: прежний способ против write-only книги с именованными стилями"""
+    import os
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    filename = os.path.join(tempfile.gettempdir(), f"bench_export_{count}.xlsx")
+    try:
+        for title, func in (("Прежняя выгрузка (Workbook + стили на ячейку)", _export_schedule_legacy),
+                            ("Write-only + именованные стили", _export_schedule_streaming)):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                elapsed, peak_mb = pool.submit(_measure_export, func, count, filename).result()
+            print(f"{title}: {count} занятий за {elapsed:.2f} с — {count / elapsed:.0f} строк/с, "
+                  f"файл {os.path.getsize(filename) // 1024} КБ, пиковая память процесса {peak_mb} МБ")
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def _export_db_fetchall(date_from, date_to, filename: str):
+    """Прежний путь: все занятия периода списком (fetchall), затем книга"""
+    from database.db_manager import DatabaseManager
+    from utils.reporting import export_schedule_to_excel
+    export_schedule_to_excel(DatabaseManager().get_all_schedule_range(date_from, date_to), filename=filename)
+
+
+def _export_db_streaming(date_from, date_to, filename: str):
+    from utils.export_jobs import export_schedule_range
+    export_schedule_range(date_from, date_to, None, None, filename)
+
+
+def _measure_export_db(func, date_from, date_to, filename: str):
+    """Время и пиковая память (RSS) выгрузки из БД в отдельном процессе"""
+    import resource
+    started = time.perf_counter()
+    func(date_from, date_to, filename)
+    elapsed = time.perf_counter() - started
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def bench_export_db(count: int = 200000):
+    """Выгрузка всех групп из БД: fetchall в список против серверного курсора (iter_all_schedule_range)"""
+    import os
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    from database.db_manager import DatabaseManager
+
+    db = DatabaseManager()
+    _cleanup_bench_data(db)
+    groups = [f"BENCH-{i:03d}" for i in range(1, 101)]
+    db.execute_query(
+        "INSERT INTO student_groups (group_number, course) SELECT unnest(%s::text[]), 1",
+        (groups,)
+    )
+    filename = os.path.join(tempfile.gettempdir(), f"bench_export_db_{count}.xlsx")
+    try:
+        db.bulk_import_schedule(_synthetic_import_rows(count, groups))
+        date_from, date_to = date(2031, 1, 1), date(2031 + count // (700 * 365), 12, 31)
+        for title, func in (("get_all_schedule_range (fetchall)", _export_db_fetchall),
+                            ("iter_all_schedule_range (серверный курсор)", _export_db_streaming)):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                elapsed, peak_mb = pool.submit(_measure_export_db, func, date_from, date_to, filename).result()
+            print(f"{title}: {count} занятий за {elapsed:.2f} с — {count / elapsed:.0f} строк/с, "
+                  f"пиковая память процесса {peak_mb} МБ")
+    finally:
+        _cleanup_bench_data(db)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def bench_ics(count: int = 20000):
+    """
+    Календарь .ics группы: выгрузка build_schedule_ics и обратный импорт
+    iter_schedule_rows_from_ics должны дать те же пары (группа, дата, номер,
+    предмет, тип, преподаватель, аудитория).
+    """
+    import os
+    import tempfile
+    from utils.reporting import build_schedule_ics, iter_schedule_rows_from_ics
+
+    lessons = [
+        dict(lesson, group_number="BENCH-001", subject_name=f'{lesson["subject_name"]}; ч. 1, "база"')
+        for lesson in _synthetic_schedule_data(count)
+        if lesson['group_number'] == "BENCH-001"
+    ]
+    filename = os.path.join(tempfile.gettempdir(), f"bench_ics_{count}.ics")
+    try:
+        started = time.perf_counter()
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            f.write(build_schedule_ics(lessons, "BENCH-001"))
+        export_elapsed = time.perf_counter() - started
+
+        errors = []
+        started = time.perf_counter()
+        rows = list(iter_schedule_rows_from_ics(filename, errors))
+        import_elapsed = time.perf_counter() - started
+
+        expected = [(l['group_number'], l['lesson_date'], l['lesson_number'], l['subject_name'],
+                     l['subject_type'], l['teacher_fio'], l['room_number']) for l in lessons]
+        actual = [(r['group'], r['date'], r['lesson_number'], r['subject'],
+                   r['subject_type'], r['teacher'], r['room']) for r in rows]
+        mismatches = [(e, a) for e, a in zip(expected, actual) if e != a]
+        print(f"Выгрузка .ics: {len(lessons)} пар за {export_elapsed:.2f} с, "
+              f"обратный импорт за {import_elapsed:.2f} с, ошибок импорта {len(errors)}")
+        if errors or mismatches or len(expected) != len(actual):
+            print(f"❌ Пары не совпадают: выгружено {len(expected)}, прочитано {len(actual)}")
+            for e, a in mismatches[:5]:
+                print(f"  было {e}\n  стало {a}")
+            raise SystemExit(1)
+        print("✅ Обратный импорт совпадает с выгрузкой")
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+BENCHMARKS = {
+    "images": bench_images,
+    "import": bench_import,
+    "excel": bench_excel,
+    "formats": bench_formats,
+    "validate": bench_validate,
+    "export": bench_export,
+    "export_db": bench_export_db,
+    "ics": bench_ics,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Использование: python -m utils.benchmarks <{'|'.join(BENCHMARKS)}> [параметры]")
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]](*(int(arg) for arg in sys.argv[2:]))
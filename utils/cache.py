@@ -0,0 +1,237 @@
+"""
+Кэши бота:
+- справочники (группы, преподаватели, аудитории) с поиском по префиксу
+- готовые тексты расписания
+- готовые файлы выгрузок (ExportCache)
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from config.settings import (
+    EXPORT_CACHE_DIR,
+    EXPORT_CACHE_SIZE,
+    REFERENCE_CACHE_TTL,
+    REPORTS_DIR_MAX_BYTES,
+    SCHEDULE_CACHE_SIZE,
+    SCHEDULE_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_search_key(text: str) -> str:
+    """Ключ для поиска: без регистра, ё → е, без лишних пробелов"""
+    return " ".join(str(text).split()).casefold().replace("ё", "е")
+
+
+class TTLCache:
+    """LRU-кэш с ограничением по количеству записей и времени жизни"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ReferenceCache:
+    """
+    Справочники в памяти: группы, преподаватели, аудитории.
+    Каждая запись — словарь {'kind', 'id', 'title'}, поиск — по префиксу
+    через отсортированный список ключей (bisect), без обращения к БД.
+    """
+
+    KINDS = ("group", "teacher", "room")
+
+    def __init__(self):
+        self.loaded_at = None
+        self._index = {kind: ([], []) for kind in self.KINDS}   # вид -> (ключи, записи)
+        self._by_id = {}
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def refresh(self, db):
+        """Перечитать справочники из БД (синхронно, вызывать вне event loop)"""
+        groups = [
+            {'kind': 'group', 'id': g['id'], 'title': g['group_number']}
+            for g in db.get_all_groups()
+        ]
+        teachers = [
+            {'kind': 'teacher', 'id': t['id'], 'title': t['fio']}
+            for t in db.get_all_teachers()
+        ]
+        rooms = [
+            {
+                'kind': 'room',
+                'id': r['id'],
+                'title': r['room_number'],
+                'building_name': r.get('building_name'),
+            }
+            for r in db.get_all_rooms()
+        ]
+
+        index = {}
+        for kind, entries in (("group", groups), ("teacher", teachers), ("room", rooms)):
+            indexed = sorted(
+                ((normalize_search_key(e['title']), e) for e in entries if e['title']),
+                key=lambda item: item[0]
+            )
+            index[kind] = ([key for key, _ in indexed], [entry for _, entry in indexed])
+
+        # Новый индекс подставляется одним присваиванием: поиск читает ссылку один раз
+        # и не увидит ключи одной версии справочника с записями другой
+        self._index = index
+
+        self._by_id = {(e['kind'], e['id']): e for e in groups + teachers + rooms}
+        self.loaded_at = time.monotonic()
+        logger.info(
+            f"Справочники обновлены: групп {len(groups)}, "
+            f"преподавателей {len(teachers)}, аудиторий {len(rooms)}"
+        )
+
+    def get(self, kind: str, entity_id: int):
+        """Запись справочника по виду и id (или None)"""
+        return self._by_id.get((kind, entity_id))
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        """Поиск по префиксу: сначала группы, затем преподаватели и аудитории"""
+        prefix = normalize_search_key(query)
+        if not prefix:
+            return []
+
+        index = self._index
+        found = []
+        for kind in self.KINDS:
+            keys, entries = index[kind]
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix) and len(found) < limit:
+                found.append(entries[i])
+                i += 1
+            if len(found) >= limit:
+                break
+
+        return found
+
+
+class ExportCache:
+    """
+    Готовые выгрузки по ключу (вид, группа, начало, конец, версия данных).
+    Запись — {'path', 'rows', 'file_id'}: файл в каталоге выгрузок и file_id
+    последней отправки в Telegram (повторно файл можно отправить без загрузки).
+    Имя файла строится из ключа, поэтому повторная выгрузка перезаписывает файл.
+    Каталог принадлежит только кэшу (отчёты и логи лежат уровнем выше и не удаляются)
+    и ограничен по размеру: при превышении удаляются файлы, которые
+    дольше всех не использовались (время изменения обновляется при каждом попадании).
+    """
+
+    def __init__(self, directory: str, max_bytes: int, maxsize: int = 256):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def path_for(self, key: tuple, extension: str = ".xlsx") -> str:
+        kind, group, date_from, date_to, version = key
+        name = f"{kind}_{group or 'all'}_{date_from}_{date_to}_v{version}"
+        return os.path.join(self.directory, re.sub(r"[^\w.-]+", "_", name) + extension)
+
+    def get(self, key: tuple):
+        """Запись кэша или None; запись без file_id действительна, пока файл на диске"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        has_file = os.path.exists(entry['path'])
+        if not has_file and entry['file_id'] is None:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        if has_file:
+            os.utime(entry['path'])
+        return entry
+
+    def put(self, key: tuple, path: str, rows: int) -> dict:
+        """Добавить выгрузку; возвращает запись (она остаётся у вызывающего, даже если её вытеснят)"""
+        entry = self._entries[key] = {'path': path, 'rows': rows, 'file_id': None}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def set_file_id(self, key: tuple, file_id: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry['file_id'] = file_id
+
+    def cleanup(self) -> int:
+        """Удалить самые давно использованные файлы каталога сверх max_bytes; возвращает их число"""
+        try:
+            files = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in os.scandir(self.directory) if entry.is_file()
+            ]
+        except FileNotFoundError:
+            return 0
+
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить старую выгрузку {path}: {e}")
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Каталог выгрузок очищен: удалено файлов {removed}")
+        return removed
+
+
+# Общие экземпляры кэшей
+reference_cache = ReferenceCache()
+schedule_text_cache = TTLCache(maxsize=SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL)
+export_cache = ExportCache(EXPORT_CACHE_DIR, REPORTS_DIR_MAX_BYTES, maxsize=EXPORT_CACHE_SIZE)
+
+
+async def reference_refresh_loop(db):
+    """Фоновое обновление справочников раз в REFERENCE_CACHE_TTL секунд"""
+    while True:
+        try:
+            await asyncio.to_thread(reference_cache.refresh, db)
+        except Exception as e:
+            logger.error(f"Ошибка обновления справочников: {e}")
+        await asyncio.sleep(REFERENCE_CACHE_TTL)
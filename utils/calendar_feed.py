@@ -0,0 +1,175 @@
+"""
+Календарные подписки (.ics) для групп, преподавателей и аудиторий.
+Небольшой HTTP-сервер (aiohttp) отдаёт календарь по адресу
+/calendar/<group|teacher|room>/<id>.ics, который добавляется в календарь
+телефона как подписка; ссылку выдаёт команда /calendar.
+
+Календарные клиенты опрашивают подписку раз в час, поэтому ответы дешёвые:
+- ETag и Last-Modified строятся из версии данных (data_versions) и текущей даты
+  (окно календаря сдвигается раз в сутки), на If-None-Match / If-Modified-Since
+  без изменений отвечаем 304 без обращения к расписанию;
+- версия данных запрашивается у БД не чаще раза в ICS_FEED_VERSION_TTL секунд;
+- готовый календарь (и его gzip) хранится в памяти до смены версии или даты,
+  одновременные промахи по одному календарю собирают его один раз.
+"""
+
+import asyncio
+import gzip
+import logging
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from config.settings import (
+    ICS_FEED_BASE_URL,
+    ICS_FEED_CACHE_SIZE,
+    ICS_FEED_FUTURE_DAYS,
+    ICS_FEED_HOST,
+    ICS_FEED_MAX_AGE,
+    ICS_FEED_PAST_DAYS,
+    ICS_FEED_PORT,
+    ICS_FEED_VERSION_TTL,
+)
+from utils.cache import TTLCache, reference_cache
+from utils.reporting import build_schedule_ics, ics_timezone
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_TITLES = {'group': "Группа", 'teacher': "Преподаватель", 'room': "Аудитория"}
+
+# Календарь действителен до смены версии данных или даты — TTL лишь страхует память
+calendar_cache = TTLCache(maxsize=ICS_FEED_CACHE_SIZE, ttl=24 * 3600)
+_version_cache = TTLCache(maxsize=1, ttl=ICS_FEED_VERSION_TTL)
+_building = {}   # ключ календаря -> задача сборки (чтобы не собирать один календарь параллельно)
+
+
+def calendar_url(entry: dict):
+    """Адрес подписки на календарь записи справочника (None, если сервер подписок не настроен)"""
+    if not ICS_FEED_BASE_URL:
+        return None
+    return f"{ICS_FEED_BASE_URL}/calendar/{entry['kind']}/{entry['id']}.ics"
+
+
+def calendar_name(entry: dict) -> str:
+    """Название календаря; у группы — только номер: по нему импорт .ics определяет группу"""
+    if entry['kind'] == "group":
+        return entry['title']
+    return f"{CALENDAR_TITLES[entry['kind']]} {entry['title']}"
+
+
+async def get_data_version(db) -> dict:
+    info = _version_cache.get("schedule")
+    if info is None:
+        info = await asyncio.to_thread(db.get_data_version_info)
+        info = info or {'version': 0, 'changed_at': datetime.now(timezone.utc)}
+        _version_cache.set("schedule", info)
+    return info
+
+
+def _build_calendar(db, entry: dict, info: dict, today) -> dict:
+    """Сборка календаря (синхронно, ходит в БД)"""
+    lessons = db.get_calendar_lessons(
+        entry['kind'], entry['id'],
+        today - timedelta(days=ICS_FEED_PAST_DAYS), today + timedelta(days=ICS_FEED_FUTURE_DAYS)
+    )
+    body = build_schedule_ics(lessons, calendar_name(entry), kind=entry['kind'],
+                              stamp=info['changed_at']).encode('utf-8')
+    # Окно календаря сдвигается в полночь — календарь мог измениться не раньше неё
+    midnight = datetime.combine(today, datetime.min.time(), ics_timezone())
+    return {
+        'body': body,
+        'gzip': gzip.compress(body, compresslevel=6),
+        'etag': f"{entry['kind']}-{entry['id']}-{info['version']}-{today:%Y%m%d}",
+        'last_modified': max(info['changed_at'], midnight).astimezone(timezone.utc).replace(microsecond=0),
+        'lessons': len(lessons),
+    }
+
+
+async def get_calendar(db, entry: dict) -> dict:
+    """
+    Календарь записи справочника из кэша (или собранный в отдельном потоке):
+    {'body', 'gzip', 'etag', 'last_modified', 'lessons'}
+    """
+    info = await get_data_version(db)
+    today = datetime.now(ics_timezone()).date()
+    key = (entry['kind'], entry['id'], info['version'], today)
+
+    calendar = calendar_cache.get(key)
+    if calendar is not None:
+        return calendar
+
+    task = _building.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_build_calendar, db, entry, info, today))
+        _building[key] = task
+        task.add_done_callback(lambda _: _building.pop(key, None))
+    calendar = await asyncio.shield(task)
+    calendar_cache.set(key, calendar)
+    return calendar
+
+
+def _not_modified(request: web.Request, calendar: dict) -> bool:
+    """Условный GET: If-None-Match важнее If-Modified-Since (RFC 9110)"""
+    if_none_match = request.if_none_match
+    if if_none_match is not None:
+        return any(etag.value in (calendar['etag'], calendar['etag'] + "-gz") or etag.value == "*"
+                   for etag in if_none_match)
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and if_modified_since >= calendar['last_modified']
+
+
+class CalendarFeedServer:
+    """HTTP-сервер подписок; запускается из main.py, если задан ICS_FEED_PORT"""
+
+    def __init__(self):
+        self.db = None
+        self.runner = None
+
+    async def handle_calendar(self, request: web.Request) -> web.StreamResponse:
+        kind = request.match_info['kind']
+        if kind not in CALENDAR_TITLES:
+            raise web.HTTPNotFound()
+        if not reference_cache.is_loaded:
+            raise web.HTTPServiceUnavailable(headers={'Retry-After': "30"})
+        entry = reference_cache.get(kind, int(request.match_info['entity_id']))
+        if entry is None:
+            raise web.HTTPNotFound()
+
+        calendar = await get_calendar(self.db, entry)
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        headers = {
+            'Cache-Control': f"public, max-age={ICS_FEED_MAX_AGE}",
+            'Vary': "Accept-Encoding",
+        }
+
+        if _not_modified(request, calendar):
+            response = web.Response(status=304, headers=headers)
+        else:
+            if use_gzip:
+                headers['Content-Encoding'] = "gzip"
+            response = web.Response(
+                body=calendar['gzip'] if use_gzip else calendar['body'],
+                content_type="text/calendar", charset="utf-8", headers=headers,
+            )
+        response.etag = calendar['etag'] + ("-gz" if use_gzip else "")
+        response.last_modified = calendar['last_modified']
+        return response
+
+    async def start(self, db):
+        if not ICS_FEED_PORT:
+            return
+        self.db = db
+        app = web.Application()
+        app.router.add_get(r"/calendar/{kind}/{entity_id:\d+}.ics", self.handle_calendar)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, ICS_FEED_HOST, ICS_FEED_PORT).start()
+        logger.info(f"📅 Сервер календарных подписок: {ICS_FEED_HOST}:{ICS_FEED_PORT}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+calendar_feed_server = CalendarFeedServer()
@@ -0,0 +1,155 @@
+"""
+Очередь выгрузок (XLSX расписания, логи).
+Одновременно выполняется не больше EXPORT_MAX_CONCURRENT выгрузок, у одного
+пользователя — не больше EXPORT_PER_USER_LIMIT. Остальные ждут своей очереди
+в порядке поступления, и им показывается номер в очереди.
+
+Книги XLSX расписания строятся в отдельных процессах (get_export_pool), чтобы
+большая выгрузка всех групп не занимала интерпретатор бота: обработчики
+остальных пользователей продолжают отвечать, пока файл собирается.
+Процесс сам читает занятия из БД потоком (export_schedule_range), в бот
+передаются только путь к файлу и число занятий.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+from config.settings import EXPORT_MAX_CONCURRENT, EXPORT_PER_USER_LIMIT, EXPORT_PROGRESS_INTERVAL
+from database.db_manager import DatabaseManager
+from utils.reporting import export_schedule_to_excel
+
+logger = logging.getLogger(__name__)
+
+# Пул процессов для построения XLSX (см. get_export_pool)
+_export_pool = None
+
+
+def get_export_pool() -> ProcessPoolExecutor:
+    """Пул процессов выгрузки создаётся при первой выгрузке"""
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(max_workers=EXPORT_MAX_CONCURRENT)
+    return _export_pool
+
+
+def shutdown_export_pool():
+    """Остановка пула выгрузки при завершении бота"""
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+        _export_pool = None
+
+
+def export_schedule_range(date_from, date_to, group_number, group_name, filename) -> int:
+    """
+    Выгрузка расписания за период в XLSX (выполняется в процессе пула).
+    Занятия читаются из БД серверным курсором пачками и сразу пишутся в книгу
+    write_only, поэтому память не зависит от периода. Возвращает число занятий;
+    если их нет, файл не сохраняется.
+    """
+    rows = 0
+
+    def counted(lessons):
+        nonlocal rows
+        for lesson in lessons:
+            rows += 1
+            yield lesson
+
+    lessons = DatabaseManager().iter_all_schedule_range(date_from, date_to, group_number)
+    try:
+        export_schedule_to_excel(counted(lessons), group_name=group_name, filename=filename)
+    finally:
+        lessons.close()
+    if not rows:
+        os.remove(filename)
+    return rows
+
+
+async def build_schedule_excel(date_from, date_to, group_number, group_name: str, filename: str) -> int:
+    """Строит XLSX расписания за период в пуле процессов, возвращает число занятий"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_export_pool(), export_schedule_range, date_from, date_to, group_number, group_name, filename
+    )
+
+
+class ExportQueue:
+    """
+    Ограничение числа одновременных выгрузок.
+    slot(user_id) — место для одной выгрузки; если все места заняты,
+    ожидание идёт в порядке очереди, on_wait(position) вызывается при
+    постановке в очередь и при каждом продвижении.
+    """
+
+    def __init__(self, max_concurrent: int, per_user_limit: int):
+        self.max_concurrent = max_concurrent
+        self.per_user_limit = per_user_limit
+        self.running = 0
+        self.waiting = deque()   # futures ожидающих выгрузок, в порядке поступления
+        self.in_flight = {}      # user_id -> выгрузок пользователя (выполняются и ждут)
+
+    def is_user_busy(self, user_id: int) -> bool:
+        """У пользователя уже столько выгрузок, сколько разрешено"""
+        return self.in_flight.get(user_id, 0) >= self.per_user_limit
+
+    def stats(self) -> dict:
+        return {'running': self.running, 'waiting': len(self.waiting)}
+
+    def _release(self):
+        """Освободившееся место сразу передаётся первому в очереди"""
+        while self.waiting:
+            waiter = self.waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    async def _wait_turn(self, on_wait):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting.append(waiter)
+        last_position = None
+        try:
+            while not waiter.done():
+                position = self.waiting.index(waiter) + 1
+                if on_wait and position != last_position:
+                    last_position = position
+                    await on_wait(position)
+                await asyncio.wait({waiter}, timeout=EXPORT_PROGRESS_INTERVAL)
+        except BaseException:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # место уже было передано — отдаём его следующему
+                self._release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, on_wait=None):
+        self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+        try:
+            if self.running < self.max_concurrent and not self.waiting:
+                self.running += 1
+            else:
+                await self._wait_turn(on_wait)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            self.in_flight[user_id] -= 1
+            if not self.in_flight[user_id]:
+                del self.in_flight[user_id]
+
+
+def format_export_queued(position: int) -> str:
+    return (f"🕐 Сейчас готовятся другие выгрузки.\n"
+            f"Ваша выгрузка в очереди: {position}-я. Файл придёт автоматически.")
+
+
+EXPORT_BUSY_MESSAGE = "⏳ У вас уже готовится выгрузка. Дождитесь файла и повторите команду."
+
+export_queue = ExportQueue(EXPORT_MAX_CONCURRENT, EXPORT_PER_USER_LIMIT)
@@ -123,11 +123,17 @@ def generate_semester_schedule(semester_start_date: datetime,
                                 None
                             ])
 
-                        # Вставляем запись в расписание
+                        # Вставляем запись в расписание (повторная генерация без очистки
+                        # заменяет пару, а не создаёт дубль)
                         insert_query = """
                             INSERT INTO schedule 
                             (group_id, subject_id, teacher_id, room_id, lesson_time_id, lesson_date, notes)
                             VALUES (%s, %s, %s, %s, %s, %s, %s)
+                            ON CONFLICT (group_id, lesson_date, lesson_time_id)
+                            DO UPDATE SET subject_id = EXCLUDED.subject_id,
+                                          teacher_id = EXCLUDED.teacher_id,
+                                          room_id = EXCLUDED.room_id,
+                                          notes = EXCLUDED.notes
                         """
                         cursor.execute(insert_query, (
                             group_id, subject_id, teacher_id, room_id,
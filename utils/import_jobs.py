@@ -0,0 +1,393 @@
+"""
+Фоновые задачи импорта расписания.
+Обработчик только скачивает файл и ставит задачу; импорт выполняется
+в отдельном потоке, а сообщение о ходе импорта (строки, скорость, оставшееся
+время, ошибки) периодически обновляется. Задачи хранятся в таблице import_jobs,
+выполняются по одной и могут быть отменены кнопкой — транзакция откатывается.
+
+Режим сравнения (diff): файл сравнивается с текущим расписанием, администратор
+видит сводку изменений и кнопкой применяет только разницу. Файл до решения
+остаётся на диске (путь — в import_jobs), при применении разница считается заново.
+Предпросмотр без решения дольше IMPORT_PREVIEW_TTL отклоняется, его файл удаляется
+(при запуске бота и затем периодически, см. preview_expiry_loop).
+
+Успешные импорты записываются в журнал (import_ledger) с SHA-256 файла:
+повторно присланный файл, после импорта которого расписание его групп не менялось,
+не импортируется (см. format_already_imported).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config.settings import IMPORT_PREVIEW_TTL, IMPORT_PROGRESS_INTERVAL
+from utils.reporting import import_schedule_from_file
+
+logger = logging.getLogger(__name__)
+
+
+def cancel_import_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⛔ Отменить импорт", callback_data=f"import_cancel_{job_id}")]
+    ])
+
+
+def preview_import_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Применить изменения", callback_data=f"import_apply_{job_id}")],
+        [InlineKeyboardButton(text="❌ Не применять", callback_data=f"import_discard_{job_id}")],
+    ])
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    return f"{seconds // 60} мин {seconds % 60:02d} с"
+
+
+def format_import_progress(file_name: str, progress: dict, elapsed: float) -> str:
+    """Текст сообщения о ходе импорта"""
+    rows = progress.get('rows', 0)
+    total = progress.get('total')
+    text = f"⏳ Импорт файла {file_name}\n\n"
+
+    if progress.get('stage') == 'write':
+        text += f"📝 Прочитано строк: {rows}\n💾 Запись в базу данных...\n"
+    else:
+        rate = rows / elapsed if elapsed > 0 else 0
+        text += f"📝 Обработано строк: {rows}"
+        if total:
+            text += f" из ~{total} ({min(rows * 100 // total, 99)}%)"
+        text += f"\n⚡ Скорость: {int(rate)} строк/с\n"
+        if total and rate > 0 and total > rows:
+            text += f"⏱ Осталось: ~{format_duration((total - rows) / rate)}\n"
+
+    text += f"⚠️ Ошибок: {progress.get('errors', 0)}\n"
+    text += f"🕐 Прошло: {format_duration(elapsed)}"
+    return text
+
+
+def format_import_warnings(result: dict, limit: int = 5) -> str:
+    """Предупреждения проверки строк (время пары, повторы в файле); строки при этом импортируются"""
+    warnings = result.get('warnings')
+    if not warnings:
+        return ""
+    response = f"\n🔔 Предупреждений: {len(warnings)}\n"
+    for warning in warnings[:limit]:
+        response += f"• {warning}\n"
+    if len(warnings) > limit:
+        response += f"... и ещё {len(warnings) - limit} предупреждений\n"
+    return response
+
+
+def format_import_result(result: dict) -> str:
+    """Итоговое сообщение импорта"""
+    response = f"{'✅' if result['success'] else '❌'} {result['message']}\n"
+    response += f"📝 Добавлено записей: {result['added']}\n"
+    if result.get('updated'):
+        response += f"   из них новых: {result['inserted']}, обновлено: {result['updated']}\n"
+    if result.get('skipped_groups'):
+        response += f"⏭ Групп без изменений с прошлого импорта: {result['skipped_groups']} (не перезаписывались)\n"
+    if result.get('rows_per_sec'):
+        response += f"⚡ Скорость обработки: {result['rows_per_sec']} строк/с\n"
+
+    if result['errors']:
+        response += f"\n⚠️ Ошибок: {len(result['errors'])}\n"
+        response += "Детали ошибок:\n"
+        for error in result['errors'][:10]:  # Показываем первые 10 ошибок
+            response += f"• {error}\n"
+        if len(result['errors']) > 10:
+            response += f"... и ещё {len(result['errors']) - 10} ошибок\n"
+    response += format_import_warnings(result)
+    return response
+
+
+def format_import_diff(file_name: str, result: dict) -> str:
+    """Сводка сравнения файла с расписанием (предпросмотр или применённые изменения)"""
+    diff = result.get('diff')
+    if not result['success'] or diff is None:
+        return format_import_result(result)
+
+    if diff['applied']:
+        response = f"✅ Изменения из файла {file_name} применены\n\n"
+    else:
+        response = f"🔍 Сравнение файла {file_name} с текущим расписанием\n\n"
+    response += f"📅 Период: {diff['date_from']:%d.%m.%Y} — {diff['date_to']:%d.%m.%Y}\n"
+    response += f"➕ Новых пар: {diff['inserts']}\n"
+    response += f"✏️ Изменённых пар: {diff['updates']}\n"
+    response += f"➖ Удаляемых пар: {diff['deletes']}\n"
+    response += f"▫️ Без изменений: {diff['unchanged']}\n"
+
+    if diff['groups']:
+        response += "\nПо группам:\n"
+        for group in diff['groups'][:10]:
+            response += (f"• {group['group_number']}: +{group['inserts']} "
+                         f"✏️{group['updates']} −{group['deletes']}\n")
+        if len(diff['groups']) > 10:
+            response += f"... и ещё {len(diff['groups']) - 10} групп\n"
+    elif not diff['applied']:
+        response += "\nРасписание уже совпадает с файлом.\n"
+
+    if result['errors']:
+        response += f"\n⚠️ Ошибок: {len(result['errors'])} (эти строки пропускаются)\n"
+        for error in result['errors'][:10]:
+            response += f"• {error}\n"
+        if len(result['errors']) > 10:
+            response += f"... и ещё {len(result['errors']) - 10} ошибок\n"
+    response += format_import_warnings(result)
+
+    if not diff['applied'] and diff['groups']:
+        response += "\nПары групп из файла в этом периоде, которых нет в файле, будут удалены."
+    return response
+
+
+def format_already_imported(file_name: str, entry: dict) -> str:
+    """Ответ на повторную отправку уже импортированного файла (entry — из find_imported_file)"""
+    admin = entry['admin_name'] or entry['admin_telegram_id'] or "неизвестно"
+    return (
+        f"ℹ️ Файл {file_name} уже импортирован {entry['imported_at']:%d.%m.%Y %H:%M} "
+        f"(администратор: {admin}, строк: {entry['rows_count']}).\n"
+        "С тех пор расписание групп из файла не менялось — импортировать нечего.\n\n"
+        "Чтобы загрузить файл заново, используйте /import_schedule force"
+    )
+
+
+class ImportJobRunner:
+    """
+    Очередь задач импорта. Задачи выполняются по одной (параллельные импорты
+    обновляют одни и те же строки расписания и мешали бы друг другу).
+    Для каждой запущенной задачи в памяти хранятся событие отмены и словарь прогресса.
+    """
+
+    def __init__(self, progress_interval: float = IMPORT_PROGRESS_INTERVAL):
+        self.progress_interval = progress_interval
+        self.jobs = {}
+        self._lock = asyncio.Lock()
+
+    async def submit(self, db, bot, status_message, admin_telegram_id: int,
+                     file_path: str, file_name: str, mode: str = "import", file_sha256: str = None) -> int:
+        """
+        Поставить файл в очередь импорта. status_message — сообщение бота,
+        которое будет показывать ход импорта; mode — как в import_schedule_from_file;
+        file_sha256 — хэш файла для журнала импорта (без него импорт в журнал не попадает).
+        Возвращает id задачи.
+        """
+        chat_id = status_message.chat.id
+        job_id = await asyncio.to_thread(
+            db.create_import_job, admin_telegram_id, chat_id, file_name, file_path, mode, file_sha256
+        )
+        await asyncio.to_thread(db.update_import_job, job_id, status_message_id=status_message.message_id)
+
+        job = {
+            'cancel': threading.Event(),
+            'progress': {'rows': 0, 'errors': 0},
+            'chat_id': chat_id,
+            'message_id': status_message.message_id,
+            'file_name': file_name,
+            'mode': mode,
+            'ledger': {
+                'file_sha256': file_sha256,
+                'file_name': file_name,
+                'admin_telegram_id': admin_telegram_id,
+                'job_id': job_id,
+            } if file_sha256 else None,
+        }
+        self.jobs[job_id] = job
+        if self._lock.locked():
+            await self._edit(bot, job, f"🕐 Файл {file_name} в очереди на импорт...",
+                             cancel_import_keyboard(job_id))
+        job['task'] = asyncio.create_task(self._run(db, bot, job_id, file_path))
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """Запросить отмену; False — если задача уже завершена"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job['cancel'].set()
+        return True
+
+    async def _edit(self, bot, job: dict, text: str, reply_markup=None):
+        """Обновить сообщение задачи (кнопки — только пока есть что нажимать)"""
+        try:
+            await bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['message_id'],
+                                        reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                logger.warning(f"Не удалось обновить сообщение импорта: {e}")
+
+    async def _run(self, db, bot, job_id: int, file_path: str):
+        job = self.jobs[job_id]
+        progress = job['progress']
+        keep_file = False
+        try:
+            async with self._lock:
+                if job['cancel'].is_set():
+                    result = {'success': False, 'cancelled': True, 'added': 0, 'errors': [],
+                              'message': "Импорт отменён до начала, изменения не вносились"}
+                else:
+                    result = await self._execute(db, bot, job_id, job, file_path)
+
+            status = 'done' if result['success'] else 'cancelled' if result.get('cancelled') else 'failed'
+            # Предпросмотр ждёт решения администратора вместе с файлом
+            keep_file = status == 'done' and job['mode'] == "diff" and bool(result['diff']['groups'])
+            if keep_file:
+                status = 'previewed'
+            await asyncio.to_thread(
+                db.update_import_job, job_id,
+                status=status,
+                rows_processed=progress.get('rows', 0),
+                inserted=result.get('inserted', 0),
+                updated=result.get('updated', 0),
+                errors_count=len(result['errors']),
+                message=result['message'],
+                finished_at=datetime.now(),
+            )
+            if job['mode'] == "import":
+                await self._edit(bot, job, format_import_result(result))
+            else:
+                markup = preview_import_keyboard(job_id) if keep_file else None
+                await self._edit(bot, job, format_import_diff(job['file_name'], result), markup)
+            logger.info(f"Задача импорта #{job_id} завершена: {status}")
+        except Exception as e:
+            logger.error(f"Ошибка задачи импорта #{job_id}: {e}")
+            try:
+                await asyncio.to_thread(db.update_import_job, job_id, status='failed',
+                                        message=str(e), finished_at=datetime.now())
+            except Exception:
+                pass
+            await self._edit(bot, job, f"❌ Ошибка при обработке файла: {str(e)}")
+        finally:
+            self.jobs.pop(job_id, None)
+            if not keep_file and os.path.exists(file_path):
+                os.remove(file_path)
+
+    async def _execute(self, db, bot, job_id: int, job: dict, file_path: str) -> dict:
+        """Импорт в отдельном потоке с обновлением сообщения раз в progress_interval секунд"""
+        progress = job['progress']
+        await asyncio.to_thread(db.update_import_job, job_id, status='running', started_at=datetime.now())
+
+        started = time.monotonic()
+        task = asyncio.create_task(asyncio.to_thread(
+            import_schedule_from_file, file_path, db, progress, job['cancel'], job['mode'], job['ledger']
+        ))
+
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self.progress_interval)
+            if done:
+                break
+
+            elapsed = time.monotonic() - started
+            if job['cancel'].is_set():
+                text = f"⏳ Отменяю импорт файла {job['file_name']}, изменения откатываются..."
+            else:
+                text = format_import_progress(job['file_name'], progress, elapsed)
+            await self._edit(bot, job, text, cancel_import_keyboard(job_id))
+            try:
+                await asyncio.to_thread(
+                    db.update_import_job, job_id,
+                    rows_total=progress.get('total'),
+                    rows_processed=progress.get('rows', 0),
+                    errors_count=progress.get('errors', 0),
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить прогресс импорта #{job_id}: {e}")
+
+        return task.result()
+
+    async def apply_preview(self, db, bot, job_id: int, status_message, admin_telegram_id: int):
+        """
+        Применить разницу по предпросмотру job_id: новая задача в режиме apply
+        с тем же файлом (разница считается заново). False — если предпросмотр
+        уже применён, отклонён или его файл не сохранился (тогда предпросмотр отклоняется).
+        """
+        job = await asyncio.to_thread(db.get_import_job, job_id)
+        if job is None or job['status'] != 'previewed':
+            return False
+        if not job['file_path'] or not os.path.exists(job['file_path']):
+            await asyncio.to_thread(db.close_import_preview, job_id, 'discarded')
+            return False
+        preview = await asyncio.to_thread(db.close_import_preview, job_id, 'applied')
+        if preview is None:
+            return False
+        await self.submit(db, bot, status_message, admin_telegram_id,
+                          preview['file_path'], preview['file_name'], mode="apply",
+                          file_sha256=preview['file_sha256'])
+        return True
+
+    async def discard_preview(self, db, job_id: int):
+        """Отказ от предпросмотра: файл удаляется. False — если решение уже принято"""
+        preview = await asyncio.to_thread(db.close_import_preview, job_id, 'discarded')
+        if preview is None:
+            return False
+        if preview['file_path'] and os.path.exists(preview['file_path']):
+            os.remove(preview['file_path'])
+        return True
+
+    async def recover(self, db, bot):
+        """
+        При запуске бота: задачи, прерванные перезапуском, помечаются failed,
+        их сообщения обновляются, а скачанные файлы удаляются;
+        устаревшие предпросмотры отклоняются (expire_previews).
+        """
+        jobs = await asyncio.to_thread(db.fail_interrupted_import_jobs)
+        for job in jobs:
+            if job['file_path'] and os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+            if job['chat_id'] and job['status_message_id']:
+                await self._edit(
+                    bot,
+                    {'chat_id': job['chat_id'], 'message_id': job['status_message_id']},
+                    "⚠️ Импорт прерван перезапуском бота, изменения не сохранены.\n"
+                    "Отправьте файл ещё раз через /import_schedule"
+                )
+        if jobs:
+            logger.info(f"Прерванных задач импорта: {len(jobs)}")
+        await self.expire_previews(db, bot)
+
+    async def expire_previews(self, db, bot):
+        """Отклонить предпросмотры старше IMPORT_PREVIEW_TTL: удалить файлы и убрать кнопки"""
+        jobs = await asyncio.to_thread(db.expire_import_previews, IMPORT_PREVIEW_TTL)
+        for job in jobs:
+            if job['file_path'] and os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+            if job['chat_id'] and job['status_message_id']:
+                await self._edit(
+                    bot,
+                    {'chat_id': job['chat_id'], 'message_id': job['status_message_id']},
+                    "⌛ Предпросмотр импорта устарел, изменения не применены.\n"
+                    "Отправьте файл ещё раз через /import_schedule diff"
+                )
+        if jobs:
+            logger.info(f"Устаревших предпросмотров импорта: {len(jobs)}")
+
+    async def stop(self):
+        """Остановка бота: отменяем выполняющиеся импорты и ждём отката"""
+        tasks = []
+        for job in list(self.jobs.values()):
+            job['cancel'].set()
+            if 'task' in job:
+                tasks.append(job['task'])
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Общий экземпляр для обработчиков
+import_job_runner = ImportJobRunner()
+
+
+async def preview_expiry_loop(db, bot):
+    """Периодическое отклонение устаревших предпросмотров (при запуске это делает recover)"""
+    while True:
+        await asyncio.sleep(min(IMPORT_PREVIEW_TTL, 3600))
+        try:
+            await import_job_runner.expire_previews(db, bot)
+        except Exception as e:
+            logger.error(f"Ошибка отклонения устаревших предпросмотров импорта: {e}")
@@ -1,16 +1,35 @@
 import csv
+import gzip
+import hashlib
+import json
 import os
-from datetime import datetime
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from functools import lru_cache
+from itertools import takewhile
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil.rrule import rrulestr
 from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, NamedStyle, PatternFill, Border, Side
 import logging
 
+from config.settings import (
+    ICS_DEFAULT_SUBJECT_TYPE, ICS_RRULE_HORIZON_DAYS, ICS_TIMEZONE,
+    IMPORT_SKIP_UNCHANGED_GROUPS, IMPORT_VALIDATION_CHUNK, IMPORT_VALIDATION_WORKERS, SCHEDULE_TIMES
+)
+from database.db_manager import ImportCancelled
+
 logger = logging.getLogger(__name__)
 
 
-def export_user_actions_to_csv(actions, filename=None):
+def export_user_actions_to_csv(actions, filename=None, compress=False):
     """
-    actions — список словарей:
+    actions — любой итерируемый набор словарей (список или генератор
+    из DatabaseManager.iter_user_actions), строки пишутся в файл по одной:
     [
       {
         'user_id': ...,
@@ -18,20 +37,25 @@ def export_user_actions_to_csv(actions, filename=None):
         'username': ...,
         'action': ...,
         'details': ...,
+        'sample_rate': 1.0,   # доля записанных действий этого типа
         'created_at': datetime(...)
       },
       ...
     ]
+    compress=True — файл сжимается gzip (.csv.gz)
     """
     if filename is None:
         os.makedirs("reports", exist_ok=True)
         filename = f"reports/user_actions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        if compress:
+            filename += ".gz"
 
     os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-    with open(filename, "w", newline="", encoding="utf-8") as f:
+    opener = gzip.open if compress else open
+    with opener(filename, "wt", newline="", encoding="utf-8") as f:
         writer = csv.writer(f, delimiter=';')
-        writer.writerow(["user_id", "telegram_id", "username", "action", "details", "created_at"])
+        writer.writerow(["user_id", "telegram_id", "username", "action", "details", "sample_rate", "created_at"])
         for a in actions:
             writer.writerow([
                 a.get("user_id"),
@@ -39,6 +63,7 @@ def export_user_actions_to_csv(actions, filename=None):
                 a.get("username") or "",
                 a.get("action") or "",
                 a.get("details") or "",
+                a.get("sample_rate", 1),
                 a.get("created_at").strftime("%Y-%m-%d %H:%M:%S")
                 if a.get("created_at") else ""
             ])
@@ -46,11 +71,50 @@ def export_user_actions_to_csv(actions, filename=None):
     return filename
 
 
+# ===== ВЫГРУЗКИ EXCEL =====
+
+def _add_export_styles(wb, header_color):
+    """
+    Именованные стили выгрузки регистрируются в книге один раз:
+    'export_title', 'export_header', 'export_center', 'export_left'.
+    Ячейкам назначаются эти стили по имени (см. _styled_row), без новых Border/Alignment на каждую.
+    """
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    for style in (
+        NamedStyle(name="export_title", font=Font(bold=True, size=14), alignment=center_align),
+        NamedStyle(name="export_header", font=Font(bold=True, color="FFFFFF", size=12),
+                   fill=PatternFill(start_color=header_color, end_color=header_color, fill_type="solid"),
+                   border=border, alignment=center_align),
+        NamedStyle(name="export_center", border=border, alignment=center_align),
+        NamedStyle(name="export_left", border=border, alignment=left_align),
+    ):
+        wb.add_named_style(style)
+
+
+def _styled_row(ws, values, styles):
+    """Строка write-only листа: значения с именованными стилями из _add_export_styles (по колонкам)"""
+    row = []
+    for value, style in zip(values, styles):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.style = style
+        row.append(cell)
+    return row
+
+
 def export_user_actions_to_excel(actions, filename=None):
     """
     Экспорт действий пользователей в Excel файл.
     
-    actions — список словарей с информацией о действиях пользователей
+    actions — итерируемый набор словарей с информацией о действиях пользователей.
+    Книга создаётся в режиме write_only: строки сразу уходят в файл,
+    поэтому память не растёт с размером выгрузки.
     """
     if filename is None:
         os.makedirs("reports", exist_ok=True)
@@ -59,56 +123,35 @@ def export_user_actions_to_excel(actions, filename=None):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
 
     # Создаём рабочую книгу
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Логи действий"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Логи действий")
+    _add_export_styles(wb, "4472C4")
 
-    # Стили
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=12)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    # Ширина колонок задаётся до записи строк
+    ws.column_dimensions['A'].width = 15
+    ws.column_dimensions['B'].width = 15
+    ws.column_dimensions['C'].width = 20
+    ws.column_dimensions['D'].width = 20
+    ws.column_dimensions['E'].width = 30
+    ws.column_dimensions['F'].width = 12
+    ws.column_dimensions['G'].width = 20
 
     # Заголовки
-    headers = ["ID пользователя", "Telegram ID", "Имя пользователя", "Действие", "Детали", "Дата/Время"]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_align
-        cell.border = border
+    headers = ["ID пользователя", "Telegram ID", "Имя пользователя", "Действие", "Детали", "Доля выборки", "Дата/Время"]
+    ws.append(_styled_row(ws, headers, ["export_header"] * len(headers)))
 
-    # Данные
-    for row_num, action in enumerate(actions, 2):
-        cells_data = [
+    # Данные: первые три колонки по центру, остальные — по левому краю
+    styles = ["export_center"] * 3 + ["export_left"] * 4
+    for action in actions:
+        ws.append(_styled_row(ws, (
             action.get("user_id"),
             action.get("telegram_id"),
             action.get("username") or "",
             action.get("action") or "",
             action.get("details") or "",
+            action.get("sample_rate", 1),
             action.get("created_at").strftime("%Y-%m-%d %H:%M:%S") if action.get("created_at") else ""
-        ]
-        
-        for col_num, value in enumerate(cells_data, 1):
-            cell = ws.cell(row=row_num, column=col_num)
-            cell.value = value
-            cell.alignment = center_align if col_num < 4 else left_align
-            cell.border = border
-
-    # Автоширина колонок
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 20
-    ws.column_dimensions['D'].width = 20
-    ws.column_dimensions['E'].width = 30
-    ws.column_dimensions['F'].width = 20
+        ), styles))
 
     wb.save(filename)
     logger.info(f"Экспорт логов в Excel: {filename}")
@@ -119,7 +162,7 @@ def export_schedule_to_excel(schedule_data, group_name=None, filename=None):
     """
     Экспорт расписания в Excel файл.
     
-    schedule_data — список словарей:
+    schedule_data — итерируемый набор словарей (список или генератор):
     [
       {
         'group_number': 'БПИ-24',
@@ -136,6 +179,7 @@ def export_schedule_to_excel(schedule_data, group_name=None, filename=None):
       },
       ...
     ]
+    Книга создаётся в режиме write_only, поэтому память не зависит от числа занятий.
     """
     if filename is None:
         os.makedirs("reports", exist_ok=True)
@@ -145,45 +189,35 @@ def export_schedule_to_excel(schedule_data, group_name=None, filename=None):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
 
     # Создаём рабочую книгу
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Расписание"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Расписание")
+    _add_export_styles(wb, "70AD47")
 
-    # Стили
-    header_fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=12)
-    title_font = Font(bold=True, size=14)
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    # Ширина колонок задаётся до записи строк
+    ws.column_dimensions['A'].width = 12
+    ws.column_dimensions['B'].width = 13
+    ws.column_dimensions['C'].width = 12
+    ws.column_dimensions['D'].width = 6
+    ws.column_dimensions['E'].width = 12
+    ws.column_dimensions['F'].width = 25
+    ws.column_dimensions['G'].width = 12
+    ws.column_dimensions['H'].width = 20
+    ws.column_dimensions['I'].width = 20
 
     # Заголовок
     title = f"Расписание занятий" + (f" - {group_name}" if group_name else "")
-    ws.merge_cells('A1:I1')
-    title_cell = ws['A1']
-    title_cell.value = title
-    title_cell.font = title_font
-    title_cell.alignment = center_align
+    ws.append(_styled_row(ws, [title], ["export_title"]))
+    ws.merged_cells.add('A1:I1')
 
     ws.append([])  # пустая строка
 
     # Заголовки колонок
     headers = ["Группа", "Дата", "День", "Пара", "Время", "Предмет", "Тип", "Преподаватель", "Аудитория"]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=3, column=col_num)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_align
-        cell.border = border
+    ws.append(_styled_row(ws, headers, ["export_header"] * len(headers)))
 
-    # Данные
-    for row_num, item in enumerate(schedule_data, 4):
+    # Данные: первые пять колонок по центру, остальные — по левому краю
+    styles = ["export_center"] * 5 + ["export_left"] * 4
+    for item in schedule_data:
         lesson_date = item.get('lesson_date')
         
         # Преобразуем дату если нужно
@@ -194,7 +228,7 @@ def export_schedule_to_excel(schedule_data, group_name=None, filename=None):
             date_str = str(lesson_date)
             day_name = "?"
 
-        cells_data = [
+        ws.append(_styled_row(ws, (
             item.get('group_number', ''),
             date_str,
             day_name,
@@ -204,24 +238,7 @@ def export_schedule_to_excel(schedule_data, group_name=None, filename=None):
             item.get('subject_type', ''),
             item.get('teacher_fio', ''),
             f"{item.get('room_number', '')} ({item.get('building_name', '')})" if item.get('room_number') else ""
-        ]
-        
-        for col_num, value in enumerate(cells_data, 1):
-            cell = ws.cell(row=row_num, column=col_num)
-            cell.value = value
-            cell.alignment = center_align if col_num <= 5 else left_align
-            cell.border = border
-
-    # Автоширина колонок
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 13
-    ws.column_dimensions['C'].width = 12
-    ws.column_dimensions['D'].width = 6
-    ws.column_dimensions['E'].width = 12
-    ws.column_dimensions['F'].width = 25
-    ws.column_dimensions['G'].width = 12
-    ws.column_dimensions['H'].width = 20
-    ws.column_dimensions['I'].width = 20
+        ), styles))
 
     wb.save(filename)
     logger.info(f"Экспорт расписания в Excel: {filename}")
@@ -278,7 +295,7 @@ def create_schedule_import_template(filename=None):
     # Описание и примеры
     examples = [
         ["БПИ-24", "2026-02-10", "1", "09:00", "10:30", "Программирование", "lecture", "Иванов И.И.", "101"],
-        ["БПИ-24", "2026-02-10", "2", "10:45", "12:15", "Алгоритмы", "practice", "Петров П.П.", "102"],
+        ["БПИ-24", "2026-02-10", "2", "10:40", "12:10", "Алгоритмы", "practice", "Петров П.П.", "102"],
         ["БПИ-25", "2026-02-10", "1", "09:00", "10:30", "Математика", "lecture", "Сидоров С.С.", "201"],
     ]
 
@@ -322,112 +339,904 @@ def create_schedule_import_template(filename=None):
     return filename
 
 
-def import_schedule_from_excel(filepath, db_manager=None):
+def parse_schedule_import_row(row_num, row_data, errors):
+    """
+    Разбор и проверка одной строки файла импорта (9 колонок).
+    Возвращает словарь записи или None; описание проблемы добавляется в errors.
+    Пустые строки пропускаются без ошибки.
+    """
+    # Пропускаем пустые строки
+    if not any(row_data[:5]):  # Если первые 5 обязательных полей пусты
+        return None
+
+    try:
+        group = str(row_data[0]).strip() if row_data[0] else None
+        date_str = str(row_data[1]).strip() if row_data[1] else None
+        lesson_num = int(row_data[2]) if row_data[2] else None
+        start_time = str(row_data[3]).strip() if row_data[3] else None
+        end_time = str(row_data[4]).strip() if row_data[4] else None
+        subject = str(row_data[5]).strip() if row_data[5] else None
+        lesson_type = str(row_data[6]).strip() if row_data[6] else None
+        teacher = str(row_data[7]).strip() if row_data[7] else None
+        room = str(row_data[8]).strip() if row_data[8] else None
+
+        # Валидация
+        if not all([group, date_str, lesson_num, start_time, end_time, subject, lesson_type]):
+            errors.append(f"Строка {row_num}: Не все обязательные поля заполнены")
+            return None
+
+        # Валидация типа пары
+        if lesson_type not in ['lecture', 'practice', 'lab']:
+            errors.append(f"Строка {row_num}: Неизвестный тип пары '{lesson_type}'")
+            return None
+
+        lesson_date = parse_import_date(row_data[1])
+        if lesson_date is None:
+            errors.append(f"Строка {row_num}: Неверный формат даты '{date_str}'")
+            return None
+
+        return {
+            'row_num': row_num,
+            'group': group,
+            'date': lesson_date,
+            'lesson_number': lesson_num,
+            'start_time': start_time,
+            'end_time': end_time,
+            'subject': subject,
+            'subject_type': lesson_type,
+            'teacher': teacher if teacher else None,
+            'room': room if room else None
+        }
+
+    except Exception as e:
+        errors.append(f"Строка {row_num}: {str(e)}")
+        return None
+
+
+# ===== ПРОВЕРКА СТРОК ИМПОРТА =====
+
+_TIME_RE = re.compile(r"^(\d{1,2})[:.](\d{2})(?::\d{2})?$")
+
+# Пул процессов для проверки строк (см. get_validation_pool)
+_validation_pool = None
+
+
+def normalize_import_time(value):
+    """Время из файла импорта → 'ЧЧ:ММ' (time/datetime из Excel или строка); None — если не разобрать"""
+    if isinstance(value, (dt_time, datetime)):
+        return f"{value.hour:02d}:{value.minute:02d}"
+    match = _TIME_RE.match(str(value).strip())
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def validate_schedule_chunk(rows):
+    """
+    Проверка пачки строк [(номер строки, 9 значений), ...].
+    Функция чистая и выполняется в процессе пула для больших файлов.
+    Возвращает (записи, ошибки, предупреждения). Ошибки — как в
+    parse_schedule_import_row; время пары, не совпадающее с расписанием звонков
+    (SCHEDULE_TIMES), — предупреждение: в БД время берётся по номеру пары.
+    """
+    records, errors, warnings = [], [], []
+    # Пар «начало–конец» в файле единицы, поэтому разбор времени кэшируется
+    times = {}
+    for row_num, row_data in rows:
+        record = parse_schedule_import_row(row_num, row_data, errors)
+        if record is None:
+            continue
+
+        key = (row_data[3], row_data[4], record['lesson_number'])
+        checked = times.get(key)
+        if checked is None:
+            start_time = normalize_import_time(row_data[3])
+            end_time = normalize_import_time(row_data[4])
+            expected = SCHEDULE_TIMES.get(record['lesson_number'])
+            if start_time is None or end_time is None:
+                checked = times[key] = (None, None, "bad")
+            elif expected and (start_time, end_time) != expected:
+                checked = times[key] = (start_time, end_time, expected)
+            else:
+                checked = times[key] = (start_time, end_time, None)
+
+        start_time, end_time, problem = checked
+        if problem == "bad":
+            warnings.append(
+                f"Строка {row_num}: Неверный формат времени '{record['start_time']}–{record['end_time']}'"
+            )
+        else:
+            record['start_time'], record['end_time'] = start_time, end_time
+            if problem:
+                warnings.append(
+                    f"Строка {row_num}: Время {start_time}–{end_time} не совпадает с парой "
+                    f"{record['lesson_number']} ({problem[0]}–{problem[1]})"
+                )
+        records.append(record)
+    return records, errors, warnings
+
+
+def get_validation_pool():
+    """Пул процессов для проверки больших файлов (создаётся при первом обращении)"""
+    global _validation_pool
+    if _validation_pool is None:
+        _validation_pool = ProcessPoolExecutor(max_workers=IMPORT_VALIDATION_WORKERS)
+    return _validation_pool
+
+
+def shutdown_validation_pool():
+    """Остановка пула процессов при завершении бота"""
+    global _validation_pool
+    if _validation_pool is not None:
+        _validation_pool.shutdown(wait=False, cancel_futures=True)
+        _validation_pool = None
+
+
+def _chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_schedule_rows(rows, errors, warnings=None, workers=None, chunk_size=None):
+    """
+    Проверка потока сырых строк [(номер строки, 9 значений)] пачками по chunk_size.
+    Первая пачка проверяется на месте (небольшие файлы не ждут запуска пула),
+    следующие — в пуле из workers процессов; одновременно в работе не больше
+    2 × workers пачек, записи отдаются в порядке строк файла.
+    Повторы пары группы (группа, дата, номер пары) внутри файла попадают
+    в warnings: в расписание пойдёт последняя строка.
+    """
+    workers = IMPORT_VALIDATION_WORKERS if workers is None else workers
+    chunk_size = chunk_size or IMPORT_VALIDATION_CHUNK
+    if warnings is None:
+        warnings = []
+    seen = {}
+
+    def collect(result):
+        records, chunk_errors, chunk_warnings = result
+        errors.extend(chunk_errors)
+        warnings.extend(chunk_warnings)
+        for record in records:
+            key = (record['group'], record['date'], record['lesson_number'])
+            first = seen.setdefault(key, record['row_num'])
+            if first != record['row_num']:
+                warnings.append(
+                    f"Строка {record['row_num']}: Пара {record['lesson_number']} группы {record['group']} "
+                    f"на {record['date']:%d.%m.%Y} уже есть в строке {first}, используется строка {record['row_num']}"
+                )
+                seen[key] = record['row_num']
+        return records
+
+    chunks = _chunked(rows, chunk_size)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return
+    yield from collect(validate_schedule_chunk(first_chunk))
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from collect(validate_schedule_chunk(chunk))
+        return
+
+    pool = get_validation_pool()
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(validate_schedule_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield from collect(pending.popleft().result())
+        while pending:
+            yield from collect(pending.popleft().result())
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# ===== ЧТЕНИЕ ФАЙЛОВ ИМПОРТА =====
+
+def iter_schedule_rows_from_excel(filepath, errors, progress=None, warnings=None):
+    """
+    Потоковое чтение файла импорта: книга открывается в режиме read_only,
+    строки читаются iter_rows(values_only=True) и отдаются генератором по одной,
+    поэтому память не зависит от размера файла.
+    Файл открывается сразу (ошибка открытия — исключение здесь),
+    ошибки проверки строк добавляются в errors, предупреждения — в warnings.
+    Если передан progress, в progress['total'] записывается число строк данных
+    по размерам листа из файла (если они там указаны).
+    """
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    if progress is not None:
+        progress['header_rows'] = 3
+        if wb.active.max_row:
+            progress['total'] = max(wb.active.max_row - 3, 0)
+    return validate_schedule_rows(_iter_workbook_rows(wb), errors, warnings)
+
+
+def _iter_workbook_rows(wb):
+    try:
+        ws = wb.active
+        # Пропускаем первые 3 строки (заголовок и описание)
+        for row_num, row_data in enumerate(ws.iter_rows(min_row=4, max_col=9, values_only=True), 4):
+            if len(row_data) < 9:
+                row_data = tuple(row_data) + (None,) * (9 - len(row_data))
+            yield row_num, row_data
+    finally:
+        wb.close()
+
+
+# Форматы файлов импорта: расширение → формат
+SCHEDULE_IMPORT_FORMATS = {
+    '.xlsx': 'excel',
+    '.xls': 'excel',
+    '.csv': 'csv',
+    '.tsv': 'csv',
+    '.txt': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.ics': 'ics',
+}
+
+# Ключи объекта в строке JSON Lines — в порядке колонок шаблона
+JSONL_IMPORT_FIELDS = (
+    'group', 'date', 'lesson_number', 'start_time', 'end_time',
+    'subject', 'subject_type', 'teacher', 'room',
+)
+
+
+def get_schedule_import_format(filename):
+    """Формат файла импорта по расширению ('excel', 'csv', 'jsonl', 'ics') или None"""
+    return SCHEDULE_IMPORT_FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def file_sha256(filepath, block_size=1 << 20):
+    """SHA-256 содержимого файла (для журнала импорта), читается блоками"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def detect_text_encoding(filepath, sample_size=1 << 16):
+    """
+    Кодировка текстового файла импорта: UTF-8 (с BOM или без) или CP1251.
+    Проверяется начало файла: если оно не декодируется как UTF-8 — это CP1251.
+    """
+    with open(filepath, 'rb') as f:
+        sample = f.read(sample_size)
+
+    if sample.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Многобайтный символ мог оборваться на границе образца
+        if e.start < len(sample) - 3:
+            return 'cp1251'
+    return 'utf-8'
+
+
+def _count_lines(filepath):
+    """Число строк файла (для оценки оставшегося времени импорта)"""
+    count = 0
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            count += chunk.count(b'\n')
+    return count
+
+
+def _is_header_row(row):
+    return bool(row) and str(row[0]).strip().rstrip('*').strip().lower() in ('группа', 'group')
+
+
+def iter_schedule_rows_from_csv(filepath, errors, progress=None, warnings=None):
+    """
+    Потоковое чтение CSV/TSV: разделитель (;  ,  табуляция) определяется по первой
+    строке, кодировка (UTF-8 или CP1251) — по началу файла. Первая строка
+    с заголовками колонок (как в шаблоне) пропускается, если она есть.
+    Номера строк в ошибках — номера строк файла.
+    """
+    encoding = detect_text_encoding(filepath)
+    f = open(filepath, encoding=encoding, newline='')
+    first_line = f.readline()
+    f.seek(0)
+    delimiter = max((';', ',', '\t'), key=first_line.count)
+
+    if progress is not None:
+        progress['header_rows'] = 0
+        progress['total'] = _count_lines(filepath)
+    return validate_schedule_rows(_iter_csv_rows(f, csv.reader(f, delimiter=delimiter), progress), errors, warnings)
+
+
+def _iter_csv_rows(f, reader, progress):
+    try:
+        for row_num, row_data in enumerate(reader, 1):
+            if row_num == 1 and _is_header_row(row_data):
+                if progress is not None:
+                    progress['header_rows'] = 1
+                    progress['total'] = max(progress.get('total', 1) - 1, 0)
+                continue
+            if len(row_data) < 9:
+                row_data = row_data + [None] * (9 - len(row_data))
+            yield row_num, row_data
+    finally:
+        f.close()
+
+
+def iter_schedule_rows_from_jsonl(filepath, errors, progress=None, warnings=None):
     """
-    Импорт расписания из Excel файла.
+    Потоковое чтение JSON Lines: в каждой строке объект с ключами JSONL_IMPORT_FIELDS
+    или массив из 9 значений в порядке колонок шаблона.
+    """
+    encoding = detect_text_encoding(filepath)
+    f = open(filepath, encoding=encoding)
+    if progress is not None:
+        progress['header_rows'] = 0
+        progress['total'] = _count_lines(filepath)
+    return validate_schedule_rows(_iter_jsonl_rows(f, errors), errors, warnings)
+
+
+def _iter_jsonl_rows(f, errors):
+    try:
+        for row_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                errors.append(f"Строка {row_num}: Неверный формат JSON")
+                continue
+
+            if isinstance(item, dict):
+                row_data = [item.get(field) for field in JSONL_IMPORT_FIELDS]
+            elif isinstance(item, list):
+                row_data = item + [None] * (9 - len(item))
+            else:
+                errors.append(f"Строка {row_num}: Ожидается объект или массив")
+                continue
+
+            yield row_num, row_data
+    finally:
+        f.close()
+
+
+# ===== ICALENDAR (ICS) =====
+
+_ICS_TEXT_ESCAPE_RE = re.compile(r"\\([\\;,nN])")
+_ICS_UNTIL_RE = re.compile(r"UNTIL=(\d{8}T\d{6}Z)")
+_ICS_DURATION_RE = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+_ICS_TYPE_SUFFIX_RE = re.compile(r"\s*[(\[]([^)\]]*)[)\]]\s*$")
+
+# Подстрока в CATEGORIES/SUMMARY → тип пары (проверяются по порядку)
+ICS_SUBJECT_TYPES = (
+    ("лаб", "lab"), ("lab", "lab"),
+    ("практ", "practice"), ("семинар", "practice"), ("practice", "practice"),
+    ("лек", "lecture"), ("lecture", "lecture"),
+)
+
+# Свойства VEVENT, которые нужны импорту; остальные не сохраняются
+ICS_EVENT_PROPERTIES = frozenset((
+    'UID', 'DTSTART', 'DTEND', 'DURATION', 'SUMMARY', 'LOCATION', 'ORGANIZER',
+    'CATEGORIES', 'STATUS', 'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID',
+))
+
+
+def _unfold_ics_lines(f):
+    """Логические строки iCalendar (продолжение начинается с пробела) с номером первой строки файла"""
+    current, start = None, 0
+    for line_num, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_num
+    if current:
+        yield start, current
+
+
+def _parse_ics_property(line):
+    """'ИМЯ;ПАРАМ=x;ПАРАМ2="a:b":значение' → (ИМЯ, {ПАРАМ: x}, значение)"""
+    colon = line.find(':')
+    if colon < 0:
+        return None, None, None
+    if '"' in line[:colon]:
+        # Двоеточие внутри кавычек параметра (например, CN="...:...")
+        in_quotes = False
+        for colon, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                break
+    name, *params = line[:colon].split(';')
+    return name.upper(), params, line[colon + 1:]
+
+
+def _ics_params(params):
+    result = {}
+    for param in params:
+        key, _, value = param.partition('=')
+        result[key.upper()] = value.strip('"')
+    return result
+
+
+def _ics_text(value):
+    return _ICS_TEXT_ESCAPE_RE.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value).strip()
+
+
+@lru_cache(maxsize=32)
+def _ics_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def _parse_ics_datetime(value, params):
+    """
+    DTSTART/DTEND/EXDATE → datetime в часовом поясе ICS_TIMEZONE (без tzinfo);
+    дата без времени (событие на весь день) → date. None — если разобрать не удалось.
+    """
+    value = value.strip()
+    try:
+        if len(value) == 8:
+            return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+        moment = datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                          int(value[9:11]), int(value[11:13]), int(value[13:15] or 0))
+    except ValueError:
+        return None
+
+    if value.endswith('Z'):
+        zone = timezone.utc
+    else:
+        tzid = _ics_params(params).get('TZID')
+        # Неизвестный TZID (например, из Outlook) считаем местным временем
+        zone = _ics_zone(tzid) if tzid and tzid != ICS_TIMEZONE else None
+    if zone is not None:
+        moment = moment.replace(tzinfo=zone).astimezone(_ics_zone(ICS_TIMEZONE)).replace(tzinfo=None)
+    return moment
+
+
+def _parse_ics_duration(value):
+    match = _ICS_DURATION_RE.match(value.strip())
+    if not match:
+        return None
+    weeks, days, hours, minutes, seconds = (int(part or 0) for part in match.groups()[1:])
+    duration = timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
+    return -duration if match.group(1) == '-' else duration
+
+
+def _ics_pair_number(moment):
+    """Номер пары по времени начала: начало пары ±15 минут или внутри пары"""
+    minutes = moment.hour * 60 + moment.minute
+    for number, (start, end) in SCHEDULE_TIMES.items():
+        start_minutes = int(start[:2]) * 60 + int(start[3:])
+        end_minutes = int(end[:2]) * 60 + int(end[3:])
+        if start_minutes - 15 <= minutes < end_minutes:
+            return number
+    return None
+
+
+def _ics_subject_and_type(summary, categories):
+    """Предмет и тип пары: тип ищется в CATEGORIES, затем в SUMMARY; пометка '(лек.)' из названия убирается"""
+    for source in (categories, summary):
+        text = (source or '').lower()
+        for marker, subject_type in ICS_SUBJECT_TYPES:
+            if marker in text:
+                if source is summary:
+                    suffix = _ICS_TYPE_SUFFIX_RE.search(summary)
+                    if suffix and marker in suffix.group(1).lower():
+                        summary = summary[:suffix.start()]
+                return summary, subject_type
+    return summary, ICS_DEFAULT_SUBJECT_TYPE
+
+
+def iter_schedule_rows_from_ics(filepath, errors, progress=None, warnings=None):
+    """
+    Потоковое чтение iCalendar (.ics): каждое VEVENT — пара.
+    Группа — название календаря (X-WR-CALNAME), номер пары — по времени DTSTART
+    (SCHEDULE_TIMES), предмет — SUMMARY, аудитория — LOCATION, преподаватель —
+    имя (CN) из ORGANIZER, тип пары — из CATEGORIES или пометки в SUMMARY.
+    События на весь день и отменённые (STATUS:CANCELLED) пропускаются.
+    Номера строк в ошибках — строка BEGIN:VEVENT события.
+    """
+    f = open(filepath, encoding=detect_text_encoding(filepath))
+    if progress is not None:
+        progress['header_rows'] = 0
+        progress['total'] = _count_lines(filepath)
+    return validate_schedule_rows(_iter_ics_rows(f, errors), errors, warnings)
+
+
+def _iter_ics_rows(f, errors):
+    """
+    Одиночные события отдаются сразу по мере чтения. Повторяющиеся (RRULE)
+    хранятся одной строкой-шаблоном и разворачиваются в конце файла лениво
+    через dateutil.rruleset, когда известны все их переносы (RECURRENCE-ID)
+    и исключения (EXDATE).
+    """
+    group = None
+    recurring = []   # (номер строки, группа, uid, начало, RRULE, RDATE, EXDATE, остальные 7 колонок)
+    moved = {}       # (группа, uid) → начала вхождений, заменённых отдельными событиями
+    event = None
+    nested = 0
+
+    try:
+        for row_num, line in _unfold_ics_lines(f):
+            if event is None:
+                if line == 'BEGIN:VEVENT':
+                    event = {'row_num': row_num}
+                elif line.startswith('X-WR-CALNAME'):
+                    group = _ics_text(_parse_ics_property(line)[2])
+                continue
+
+            if line.startswith('BEGIN:'):
+                nested += 1
+            elif line.startswith('END:'):
+                if nested:
+                    nested -= 1
+                    continue
+                row = _ics_event_row(event, group, errors, recurring, moved)
+                event = None
+                if row is not None:
+                    yield row
+            elif not nested:
+                name, params, value = _parse_ics_property(line)
+                if name in ICS_EVENT_PROPERTIES:
+                    if name in ('EXDATE', 'RDATE'):
+                        event.setdefault(name, []).append((params, value))
+                    else:
+                        event[name] = (params, value)
+
+        # Группа запомнена при чтении события: в файле может быть несколько VCALENDAR
+        for row_num, series_group, uid, start, rule, rdates, exdates, columns in recurring:
+            for moment in _expand_ics_rule(start, rule, rdates, exdates, moved.get((series_group, uid))):
+                yield row_num, (series_group, moment.date()) + columns
+    finally:
+        f.close()
+
+
+def _ics_event_row(event, group, errors, recurring, moved):
+    """Строка импорта из VEVENT (или None); повторяющееся событие откладывается в recurring"""
+    row_num = event['row_num']
+    uid = event.get('UID', (None, None))[1]
+
+    if 'RECURRENCE-ID' in event:
+        # Перенос/отмена одного вхождения: исходное вхождение серии не импортируется
+        original = _parse_ics_datetime(event['RECURRENCE-ID'][1], event['RECURRENCE-ID'][0])
+        if original is not None:
+            moved.setdefault((group, uid), set()).add(original)
+    if event.get('STATUS', (None, ''))[1].strip().upper() == 'CANCELLED':
+        return None
+    if 'DTSTART' not in event:
+        errors.append(f"Строка {row_num}: У события нет DTSTART")
+        return None
+
+    start = _parse_ics_datetime(event['DTSTART'][1], event['DTSTART'][0])
+    if start is None:
+        errors.append(f"Строка {row_num}: Неверный формат DTSTART '{event['DTSTART'][1]}'")
+        return None
+    if not isinstance(start, datetime):
+        return None  # событие на весь день — не пара
+
+    end = None
+    if 'DTEND' in event:
+        end = _parse_ics_datetime(event['DTEND'][1], event['DTEND'][0])
+    elif 'DURATION' in event:
+        duration = _parse_ics_duration(event['DURATION'][1])
+        end = start + duration if duration is not None else None
+
+    lesson_number = _ics_pair_number(start)
+    if lesson_number is None:
+        errors.append(f"Строка {row_num}: Время начала {start:%H:%M} не соответствует ни одной паре")
+        return None
+    # Без DTEND/DURATION событие длится всю пару
+    end_time = f"{end:%H:%M}" if isinstance(end, datetime) else SCHEDULE_TIMES[lesson_number][1]
+    if not group:
+        errors.append(f"Строка {row_num}: В календаре не указана группа (X-WR-CALNAME)")
+        return None
+
+    subject, subject_type = _ics_subject_and_type(
+        _ics_text(event.get('SUMMARY', (None, ''))[1]),
+        _ics_text(event.get('CATEGORIES', (None, ''))[1]),
+    )
+    teacher = None
+    if 'ORGANIZER' in event:
+        teacher = _ics_params(event['ORGANIZER'][0]).get('CN') or None
+    columns = (lesson_number, f"{start:%H:%M}", end_time, subject, subject_type,
+               teacher, _ics_text(event.get('LOCATION', (None, ''))[1]) or None)
+
+    if 'RRULE' in event:
+        recurring.append((row_num, group, uid, start, event['RRULE'][1],
+                          event.get('RDATE', ()), event.get('EXDATE', ()), columns))
+        return None
+    return row_num, (group, start.date()) + columns
+
+
+def _expand_ics_rule(start, rule, rdates, exdates, moved):
+    """
+    Вхождения повторяющегося события (генератор datetime). Правило без COUNT/UNTIL
+    разворачивается на ICS_RRULE_HORIZON_DAYS дней вперёд от DTSTART.
+    """
+    # UNTIL в UTC при DTSTART без часового пояса dateutil не принимает — переводим в местное время
+    rule = _ICS_UNTIL_RE.sub(lambda m: f"UNTIL={_parse_ics_datetime(m.group(1), []):%Y%m%dT%H%M%S}", rule)
+    rules = rrulestr(rule, dtstart=start, forceset=True)
+
+    for name, values in (('rdate', rdates), ('exdate', exdates)):
+        for params, value in values:
+            for item in value.split(','):
+                moment = _parse_ics_datetime(item, params)
+                if moment is None:
+                    continue
+                if not isinstance(moment, datetime):
+                    moment = datetime.combine(moment, start.time())
+                getattr(rules, name)(moment)
+    for moment in moved or ():
+        if not isinstance(moment, datetime):
+            moment = datetime.combine(moment, start.time())
+        rules.exdate(moment)
+
+    upper = rule.upper()
+    if 'COUNT=' in upper or 'UNTIL=' in upper:
+        return iter(rules)
+    limit = start + timedelta(days=ICS_RRULE_HORIZON_DAYS)
+    return takewhile(lambda moment: moment <= limit, rules)
+
+
+# ===== ВЫГРУЗКА ICS =====
+
+ICS_SUBJECT_TYPE_TITLES = {'lecture': 'Лекция', 'practice': 'Практика', 'lab': 'Лабораторная'}
+ICS_UID_DOMAIN = "tg-bot-schedule"
+
+
+def _ics_escape(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _fold_ics_line(line):
+    """Строки длиннее 75 октетов переносятся (продолжение начинается с пробела)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1  # не разрываем многобайтовый символ
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts)
+
+
+def ics_timezone():
+    """Пояс ICS_TIMEZONE (UTC, если такого пояса нет)"""
+    return _ics_zone(ICS_TIMEZONE) or timezone.utc
+
+
+def _ics_utc(day, moment, zone):
+    if isinstance(moment, str):
+        moment = dt_time.fromisoformat(moment)
+    return datetime.combine(day, moment, zone).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def build_schedule_ics(lessons, calendar_name, kind="group", stamp=None):
+    """
+    Календарь iCalendar (текст) из пар get_calendar_lessons.
+    Время пишется в UTC, UID пары — дата, номер пары и группа, поэтому
+    календарные клиенты при обновлении подписки сопоставляют события, а не дублируют их.
+    Календарь группы читается обратно импортом .ics (название — группа, CATEGORIES — тип пары,
+    ORGANIZER;CN — преподаватель, LOCATION — аудитория); см. bench_ics в utils/benchmarks.py.
+    stamp — DTSTAMP (время изменения данных), чтобы один и тот же набор пар давал одинаковый файл.
+    """
+    zone = ics_timezone()
+    stamp = (stamp or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:-//{ICS_UID_DOMAIN}//Расписание//RU",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+        f"X-WR-TIMEZONE:{ICS_TIMEZONE}",
+        "REFRESH-INTERVAL;VALUE=DURATION:PT1H",
+        "X-PUBLISHED-TTL:PT1H",
+    ]
+
+    for lesson in lessons:
+        day = lesson['lesson_date']
+        subject_type = ICS_SUBJECT_TYPE_TITLES.get(lesson.get('subject_type'), lesson.get('subject_type') or "")
+        summary = lesson['subject_name']
+        if kind != "group":
+            summary += f" — {lesson['group_number']}"
+
+        details = [subject_type] if subject_type else []
+        if lesson.get('teacher_fio'):
+            details.append(f"Преподаватель: {lesson['teacher_fio']}")
+        details.append(f"Группа: {lesson['group_number']}")
+        # В LOCATION только аудитория — импорт .ics читает её как номер аудитории
+        location = lesson.get('room_number') or ""
+        if location and lesson.get('building_name'):
+            details.append(f"Корпус: {lesson['building_name']}")
+        description = "\n".join(details)
+
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{day:%Y%m%d}-{lesson['lesson_number']}-{_ics_escape(lesson['group_number'])}@{ICS_UID_DOMAIN}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_ics_utc(day, lesson['start_time'], zone)}",
+            f"DTEND:{_ics_utc(day, lesson['end_time'], zone)}",
+            f"SUMMARY:{_ics_escape(summary)}",
+            f"DESCRIPTION:{_ics_escape(description)}",
+        ]
+        if lesson.get('teacher_fio'):
+            # Импорт .ics берёт преподавателя из CN; кавычки внутри параметра недопустимы
+            teacher = lesson['teacher_fio'].replace('"', "'")
+            lines.append(f'ORGANIZER;CN="{teacher}":mailto:noreply@{ICS_UID_DOMAIN}')
+        if location:
+            lines.append(f"LOCATION:{_ics_escape(location)}")
+        if subject_type:
+            lines.append(f"CATEGORIES:{_ics_escape(subject_type)}")
+        lines.append("END:VEVENT")
+
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold_ics_line(line) for line in lines) + "\r\n"
+
+
+def iter_schedule_rows(filepath, errors, progress=None, warnings=None):
+    """Потоковое чтение файла импорта любого поддерживаемого формата"""
+    file_format = get_schedule_import_format(filepath)
+    if file_format == 'csv':
+        return iter_schedule_rows_from_csv(filepath, errors, progress, warnings)
+    if file_format == 'jsonl':
+        return iter_schedule_rows_from_jsonl(filepath, errors, progress, warnings)
+    if file_format == 'ics':
+        return iter_schedule_rows_from_ics(filepath, errors, progress, warnings)
+    return iter_schedule_rows_from_excel(filepath, errors, progress, warnings)
+
+
+def track_import_progress(records, errors, progress, cancel=None):
+    """
+    Пропускает записи импорта дальше, обновляя progress:
+    rows — сколько строк файла прочитано, errors — сколько ошибок найдено,
+    stage — 'read' пока файл читается и 'write', когда остались запросы к БД.
+    Если установлен cancel (threading.Event), чтение прерывается ImportCancelled.
+    """
+    progress['stage'] = 'read'
+    for record in records:
+        if cancel is not None and cancel.is_set():
+            raise ImportCancelled("Импорт отменён")
+        # Вхождения повторяющихся событий ICS приходят в конце файла с номером строки события
+        progress['rows'] = max(progress['rows'], record['row_num'] - progress.get('header_rows', 0))
+        progress['errors'] = len(errors)
+        yield record
+    progress['errors'] = len(errors)
+    progress['stage'] = 'write'
+
+
+def import_schedule_from_file(filepath, db_manager=None, progress=None, cancel=None, mode="import",
+                              ledger=None):
+    """
+    Импорт расписания из файла Excel, CSV/TSV, JSON Lines или iCalendar (формат — по расширению).
+    Строки читаются потоком и сразу уходят в пакетную загрузку (COPY).
+    progress — необязательный словарь, который обновляется по ходу импорта
+    (rows, total, errors, stage; см. track_import_progress), cancel — threading.Event
+    для отмены: импорт откатывается целиком.
+    mode: "import" — добавить/обновить все пары файла; "diff" — только сравнить
+    с расписанием; "apply" — применить разницу (с удалением пар, которых нет в файле).
+    Для "diff" и "apply" в результате есть 'diff' (см. DatabaseManager.diff_import_schedule).
+    ledger — данные файла для журнала импорта ({'file_sha256', 'file_name',
+    'admin_telegram_id', 'job_id'}); в режиме "import" группы без изменений
+    с прошлого импорта пропускаются, если включён IMPORT_SKIP_UNCHANGED_GROUPS.
     
     Возвращает:
     {
         'success': True/False,
         'message': 'Сообщение об ошибке или успехе',
-        'added': количество добавленных записей,
-        'errors': список ошибок
+        'added': количество добавленных и обновлённых записей,
+        'inserted': из них новых, 'updated': из них обновлённых,
+        'skipped_groups': групп без изменений (не записывались),
+        'rows_per_sec': скорость обработки файла, строк в секунду,
+        'cancelled': True, если импорт отменён,
+        'errors': список ошибок,
+        'warnings': предупреждения проверки (строки всё равно импортируются)
     }
     """
     errors = []
-    added_count = 0
+    warnings = []
     result = {
         'success': False,
         'message': '',
         'added': 0,
-        'errors': []
+        'errors': [],
+        'warnings': warnings
     }
+    started = time.perf_counter()
+    if progress is None:
+        progress = {}
+    progress.setdefault('rows', 0)
+    progress.setdefault('errors', 0)
 
     try:
-        # Загружаем файл
-        wb = load_workbook(filepath)
-        ws = wb.active
-
-        schedule_records = []
-
-        # Пропускаем первые 3 строки (заголовок и описание)
-        for row_num in range(4, ws.max_row + 1):
-            row_data = []
-            for col_num in range(1, 10):  # 9 колонок
-                cell = ws.cell(row=row_num, column=col_num)
-                row_data.append(cell.value)
-
-            # Пропускаем пустые строки
-            if not any(row_data[:5]):  # Если первые 5 обязательных полей пусты
-                continue
+        records = track_import_progress(
+            iter_schedule_rows(filepath, errors, progress, warnings), errors, progress, cancel
+        )
 
+        if db_manager:
+            # Добавляем в БД одной транзакцией через COPY
             try:
-                group = str(row_data[0]).strip() if row_data[0] else None
-                date_str = str(row_data[1]).strip() if row_data[1] else None
-                lesson_num = int(row_data[2]) if row_data[2] else None
-                start_time = str(row_data[3]).strip() if row_data[3] else None
-                end_time = str(row_data[4]).strip() if row_data[4] else None
-                subject = str(row_data[5]).strip() if row_data[5] else None
-                lesson_type = str(row_data[6]).strip() if row_data[6] else None
-                teacher = str(row_data[7]).strip() if row_data[7] else None
-                room = str(row_data[8]).strip() if row_data[8] else None
-
-                # Валидация
-                if not all([group, date_str, lesson_num, start_time, end_time, subject, lesson_type]):
-                    errors.append(f"Строка {row_num}: Не все обязательные поля заполнены")
-                    continue
-
-                # Валидация типа пары
-                if lesson_type not in ['lecture', 'practice', 'lab']:
-                    errors.append(f"Строка {row_num}: Неизвестный тип пары '{lesson_type}'")
-                    continue
-
-                schedule_records.append({
-                    'group': group,
-                    'date': date_str,
-                    'lesson_number': lesson_num,
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'subject': subject,
-                    'subject_type': lesson_type,
-                    'teacher': teacher if teacher else None,
-                    'room': room if room else None
-                })
-
+                if mode == "import":
+                    imported = db_manager.bulk_import_schedule(
+                        records, cancel=cancel, ledger=ledger, skip_unchanged=IMPORT_SKIP_UNCHANGED_GROUPS
+                    )
+                else:
+                    imported = db_manager.diff_import_schedule(
+                        records, apply=mode == "apply", cancel=cancel, ledger=ledger
+                    )
+            except ImportCancelled:
+                result['message'] = "Импорт отменён администратором, изменения не сохранены"
+                result['cancelled'] = True
+                result['errors'] = errors
+                return result
             except Exception as e:
-                errors.append(f"Строка {row_num}: {str(e)}")
+                errors.append(f"Ошибка импорта: {str(e)}")
+                result['message'] = "Импорт отменён, изменения не сохранены"
+                result['errors'] = errors
+                return result
+            total_rows = imported['rows']
+            if mode == "import":
+                added_count = imported['inserted'] + imported['updated']
+                result['inserted'] = imported['inserted']
+                result['updated'] = imported['updated']
+                result['skipped_groups'] = imported['skipped_groups']
+            else:
+                added_count = imported['inserts'] + imported['updates']
+                result['inserted'] = imported['inserts']
+                result['updated'] = imported['updates']
+                result['diff'] = imported
+            errors.extend(imported['errors'])
+        else:
+            total_rows = added_count = sum(1 for _ in records)
+        progress['errors'] = len(errors)
 
-        if not schedule_records:
+        if not total_rows:
             result['message'] = "Нет данных для импорта"
             result['errors'] = errors
             return result
 
-        # Добавляем в БД если передан db_manager
-        if db_manager:
-            for record in schedule_records:
-                try:
-                    db_manager.add_schedule_from_import(
-                        group_number=record['group'],
-                        lesson_date=record['date'],
-                        lesson_number=record['lesson_number'],
-                        start_time=record['start_time'],
-                        end_time=record['end_time'],
-                        subject_name=record['subject'],
-                        subject_type=record['subject_type'],
-                        teacher_fio=record['teacher'],
-                        room_number=record['room']
-                    )
-                    added_count += 1
-                except Exception as e:
-                    errors.append(f"Ошибка импорта: Группа {record['group']}, дата {record['date']}: {str(e)}")
-
+        elapsed = time.perf_counter() - started
         result['success'] = True
-        result['message'] = f"Успешно импортировано {added_count} записей"
+        if mode == "diff":
+            result['message'] = "Сравнение с текущим расписанием готово"
+        elif mode == "apply":
+            result['message'] = "Изменения применены"
+        elif not added_count and result.get('skipped_groups'):
+            result['message'] = "Изменений нет: пары всех групп файла совпадают с прошлым импортом"
+        else:
+            result['message'] = f"Успешно импортировано {added_count} записей"
         result['added'] = added_count
+        result['rows_per_sec'] = int(total_rows / elapsed) if elapsed > 0 else total_rows
         result['errors'] = errors
 
-        logger.info(f"Импорт расписания завершен: {added_count} записей, {len(errors)} ошибок")
+        logger.info(
+            f"Импорт расписания завершен: {added_count} записей, {len(errors)} ошибок, "
+            f"{len(warnings)} предупреждений, {result['rows_per_sec']} строк/с"
+        )
 
+    except ImportCancelled:
+        result['message'] = "Импорт отменён администратором, изменения не сохранены"
+        result['cancelled'] = True
+        result['errors'] = errors
     except Exception as e:
         result['message'] = f"Ошибка при открытии файла: {str(e)}"
         logger.error(f"Ошибка импорта расписания: {e}")
@@ -435,6 +1244,38 @@ def import_schedule_from_excel(filepath, db_manager=None):
     return result
 
 
+def import_schedule_from_excel(filepath, db_manager=None, progress=None, cancel=None):
+    """Импорт расписания из Excel файла (см. import_schedule_from_file)"""
+    return import_schedule_from_file(filepath, db_manager, progress, cancel)
+
+
+def parse_import_date(value):
+    """
+    Дата из ячейки файла импорта: date/datetime из Excel
+    или строка ГГГГ-ММ-ДД / ДД.ММ.ГГГГ. None — если разобрать не удалось.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None:
+        return None
+
+    text = str(value).strip()
+    if len(text) == 10 and text[4] == "-":
+        # Самый частый случай (ГГГГ-ММ-ДД) — без strptime, он заметно медленнее
+        try:
+            return date.fromisoformat(text)
+        except ValueError:
+            return None
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
 def get_day_name(weekday_num):
     """Преобразование номера дня недели в название"""
     days = {
@@ -0,0 +1,231 @@
+"""
+Расписание на неделю картинкой: сетка «дни × пары» (PNG).
+Рисование выполняется в пуле процессов, готовые картинки кэшируются
+по хэшу содержимого, а повторная отправка идёт по file_id Telegram.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config.settings import (
+    IMAGE_CACHE_SIZE,
+    IMAGE_RENDER_WORKERS,
+    SCHEDULE_IMAGE_FONT,
+    SCHEDULE_TIMES,
+)
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Размеры сетки, px
+TITLE_HEIGHT = 60
+HEADER_HEIGHT = 44
+TIME_COLUMN_WIDTH = 110
+CELL_WIDTH = 250
+CELL_HEIGHT = 104
+PADDING = 8
+
+# Цвета
+BACKGROUND = "#FFFFFF"
+GRID_COLOR = "#BFBFBF"
+HEADER_FILL = "#70AD47"
+HEADER_TEXT = "#FFFFFF"
+CELL_FILL = "#EAF3E3"
+TEXT_COLOR = "#222222"
+MUTED_TEXT = "#666666"
+
+# PNG по хэшу содержимого и file_id уже отправленных картинок
+image_cache = TTLCache(maxsize=IMAGE_CACHE_SIZE, ttl=24 * 3600)
+image_file_ids = TTLCache(maxsize=10000, ttl=30 * 24 * 3600)
+
+_render_pool = None
+_fonts = {}
+
+
+def _load_font(size: int):
+    """TTF-шрифт с кириллицей; если не найден — встроенный шрифт Pillow"""
+    if size not in _fonts:
+        candidates = [
+            SCHEDULE_IMAGE_FONT,
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+            "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+            "C:\\Windows\\Fonts\\arial.ttf",
+        ]
+        for path in candidates:
+            try:
+                _fonts[size] = ImageFont.truetype(path, size)
+                break
+            except OSError:
+                continue
+        else:
+            logger.warning("TTF-шрифт не найден, используется встроенный шрифт Pillow")
+            try:
+                _fonts[size] = ImageFont.load_default(size=size)
+            except TypeError:
+                # Pillow < 10.1: только растровый шрифт фиксированного размера
+                _fonts[size] = ImageFont.load_default()
+    return _fonts[size]
+
+
+def _wrap_text(draw, text: str, font, max_width: int, max_lines: int) -> list[str]:
+    """Перенос текста по словам в пределах ширины ячейки"""
+    lines = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if draw.textlength(candidate, font=font) <= max_width:
+            current = candidate
+            continue
+        if current:
+            lines.append(current)
+        current = word
+        if len(lines) == max_lines:
+            break
+
+    if current and len(lines) < max_lines:
+        lines.append(current)
+
+    if len(lines) == max_lines and " ".join(lines) != " ".join(text.split()):
+        lines[-1] = lines[-1].rstrip(".,") + "…"
+    return lines
+
+
+def prepare_week_cells(kind: str, lessons) -> list[list]:
+    """
+    Занятия → компактные строки ячеек [день 0–5, номер пары, предмет, строка 2, строка 3].
+    Только простые типы: список передаётся в другой процесс и хэшируется.
+    kind: "group" | "teacher" | "room" — какие подписи выводить
+    """
+    cells = []
+    for lesson in lessons:
+        lesson_date = lesson['lesson_date']
+        weekday = lesson_date.weekday() if hasattr(lesson_date, 'weekday') else None
+        if weekday is None or weekday > 5:
+            continue
+
+        if kind == "group":
+            second = lesson.get('teacher_fio') or ""
+        else:
+            second = f"Группа: {lesson.get('group_number') or ''}"
+
+        if kind == "room":
+            third = lesson.get('teacher_fio') or ""
+        else:
+            third = f"ауд. {lesson['room_number']}" if lesson.get('room_number') else ""
+
+        cells.append([weekday, lesson['lesson_number'], lesson['subject_name'], second, third])
+    return cells
+
+
+def schedule_image_key(title: str, week_label: str, cells: list[list]) -> str:
+    """Хэш содержимого картинки: одинаковое расписание → одинаковый ключ"""
+    payload = json.dumps([title, week_label, cells], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_week_image(title: str, week_label: str, days: list[str], cells: list[list]) -> bytes:
+    """
+    Рисует сетку «дни × пары» и возвращает PNG.
+    days — подписи столбцов (например «Понедельник 19.10»),
+    cells — результат prepare_week_cells.
+    Функция чистая и выполняется в отдельном процессе.
+    """
+    pairs = sorted(SCHEDULE_TIMES)
+    width = TIME_COLUMN_WIDTH + CELL_WIDTH * len(days)
+    height = TITLE_HEIGHT + HEADER_HEIGHT + CELL_HEIGHT * len(pairs)
+
+    image = Image.new("RGB", (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    title_font = _load_font(26)
+    header_font = _load_font(17)
+    text_font = _load_font(15)
+    small_font = _load_font(13)
+
+    draw.text((PADDING * 2, TITLE_HEIGHT // 2), f"{title} — {week_label}",
+              font=title_font, fill=TEXT_COLOR, anchor="lm")
+
+    # Заголовки дней
+    top = TITLE_HEIGHT
+    draw.rectangle([0, top, width, top + HEADER_HEIGHT], fill=HEADER_FILL)
+    for i, day in enumerate(days):
+        x = TIME_COLUMN_WIDTH + CELL_WIDTH * i
+        draw.text((x + CELL_WIDTH // 2, top + HEADER_HEIGHT // 2), day,
+                  font=header_font, fill=HEADER_TEXT, anchor="mm")
+
+    # Столбец времени
+    grid_top = TITLE_HEIGHT + HEADER_HEIGHT
+    for row, pair in enumerate(pairs):
+        y = grid_top + CELL_HEIGHT * row
+        start, end = SCHEDULE_TIMES[pair]
+        draw.text((TIME_COLUMN_WIDTH // 2, y + CELL_HEIGHT // 2 - 12), f"{pair} пара",
+                  font=header_font, fill=TEXT_COLOR, anchor="mm")
+        draw.text((TIME_COLUMN_WIDTH // 2, y + CELL_HEIGHT // 2 + 12), f"{start}–{end}",
+                  font=small_font, fill=MUTED_TEXT, anchor="mm")
+
+    # Занятия
+    row_by_pair = {pair: row for row, pair in enumerate(pairs)}
+    for weekday, pair, subject, second, third in cells:
+        if weekday >= len(days) or pair not in row_by_pair:
+            continue
+        x = TIME_COLUMN_WIDTH + CELL_WIDTH * weekday
+        y = grid_top + CELL_HEIGHT * row_by_pair[pair]
+        draw.rectangle([x, y, x + CELL_WIDTH, y + CELL_HEIGHT], fill=CELL_FILL)
+
+        text_y = y + PADDING
+        for line in _wrap_text(draw, subject, text_font, CELL_WIDTH - PADDING * 2, 2):
+            draw.text((x + PADDING, text_y), line, font=text_font, fill=TEXT_COLOR)
+            text_y += 20
+        for extra in (second, third):
+            if extra:
+                line = _wrap_text(draw, extra, small_font, CELL_WIDTH - PADDING * 2, 1)
+                draw.text((x + PADDING, text_y), line[0] if line else "", font=small_font, fill=MUTED_TEXT)
+                text_y += 18
+
+    # Сетка
+    for i in range(len(days) + 1):
+        x = TIME_COLUMN_WIDTH + CELL_WIDTH * i
+        draw.line([x, TITLE_HEIGHT, x, height], fill=GRID_COLOR)
+    for row in range(len(pairs) + 1):
+        y = grid_top + CELL_HEIGHT * row
+        draw.line([0, y, width, y], fill=GRID_COLOR)
+    draw.line([0, TITLE_HEIGHT, 0, height], fill=GRID_COLOR)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Пул процессов для рендера (создаётся при первом обращении)"""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=IMAGE_RENDER_WORKERS)
+    return _render_pool
+
+
+def shutdown_render_pool():
+    """Остановка пула процессов при завершении бота"""
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+async def get_week_image(title: str, week_label: str, days: list[str], cells: list[list]) -> tuple[str, bytes]:
+    """
+    PNG недели из кэша или из пула процессов.
+    Возвращает (ключ содержимого, PNG).
+    """
+    key = schedule_image_key(title, week_label, cells)
+    png = image_cache.get(key)
+    if png is None:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(get_render_pool(), render_week_image, title, week_label, days, cells)
+        image_cache.set(key, png)
+    return key, png